@@ -1,5 +1,5 @@
 from logging.config import fileConfig
-from app.config import settings
+from app.database import SQLALCHEMY_DATABASE_URL
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
@@ -8,7 +8,8 @@ from app.models import Base
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
-config.set_main_option("sqlalchemy.url", f"postgresql://{settings.DATABASE_USERNAME}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOSTNAME}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}")
+# Alembic runs on the sync psycopg2 driver, the app itself uses asyncpg
+config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL)
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -0,0 +1,31 @@
+"""add trigram search indexes
+
+Revision ID: 5d1c8e2a7f43
+Revises: 94b0b1e2fd36
+Create Date: 2026-10-18 19:30:12.481203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1c8e2a7f43'
+down_revision: Union[str, None] = '94b0b1e2fd36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_tasks_preferredSkillsets_trgm', 'tasks', ['preferredSkillsets'], unique=False, postgresql_using='gin', postgresql_ops={'preferredSkillsets': 'gin_trgm_ops'})
+    op.create_index('ix_teams_preferredSkillsets_trgm', 'teams', ['preferredSkillsets'], unique=False, postgresql_using='gin', postgresql_ops={'preferredSkillsets': 'gin_trgm_ops'})
+    op.create_index('ix_members_name_trgm', 'members', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_members_name_trgm', table_name='members', postgresql_using='gin')
+    op.drop_index('ix_teams_preferredSkillsets_trgm', table_name='teams', postgresql_using='gin')
+    op.drop_index('ix_tasks_preferredSkillsets_trgm', table_name='tasks', postgresql_using='gin')
@@ -0,0 +1,94 @@
+"""add skills catalog
+
+Revision ID: a8e4f1c29b07
+Revises: 5d1c8e2a7f43
+Create Date: 2026-10-18 19:52:40.118365
+
+"""
+import re
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8e4f1c29b07'
+down_revision: Union[str, None] = '5d1c8e2a7f43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same splitting rules as app.skills.parse_skills at the time of this migration
+SKILL_SEPARATORS = re.compile(r"[,;/|\n]+")
+
+
+def parse_skills(text):
+    skills = []
+    for part in SKILL_SEPARATORS.split(text or ""):
+        skill = " ".join(part.lower().split())
+        if skill and skill not in skills:
+            skills.append(skill)
+    return skills
+
+
+def upgrade() -> None:
+    op.create_table('skills',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('team_skills',
+    sa.Column('team_id', sa.Integer(), nullable=False),
+    sa.Column('skill_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['skill_id'], ['skills.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['team_id'], ['teams.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('team_id', 'skill_id')
+    )
+    op.create_table('task_skills',
+    sa.Column('task_id', sa.Integer(), nullable=False),
+    sa.Column('skill_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['skill_id'], ['skills.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['task_id'], ['tasks.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('task_id', 'skill_id')
+    )
+    op.create_table('member_skills',
+    sa.Column('member_id', sa.Integer(), nullable=False),
+    sa.Column('skill_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['member_id'], ['members.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['skill_id'], ['skills.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('member_id', 'skill_id')
+    )
+
+    # Backfill the catalog and associations from the existing free-text columns
+    bind = op.get_bind()
+    sources = [
+        ('team_skills', 'team_id', 'SELECT id, "preferredSkillsets" FROM teams'),
+        ('task_skills', 'task_id', 'SELECT id, "preferredSkillsets" FROM tasks'),
+        ('member_skills', 'member_id', 'SELECT id, skillsets FROM members'),
+    ]
+    parsed = []
+    names = set()
+    for table, column, query in sources:
+        rows = [(id, parse_skills(text)) for id, text in bind.execute(sa.text(query))]
+        parsed.append((table, column, rows))
+        for _, skills in rows:
+            names.update(skills)
+    if not names:
+        return
+
+    skills_table = sa.table('skills', sa.column('id', sa.Integer), sa.column('name', sa.String))
+    bind.execute(skills_table.insert(), [{'name': name} for name in sorted(names)])
+    skill_ids = {name: id for id, name in bind.execute(sa.select(skills_table.c.id, skills_table.c.name))}
+    for table, column, rows in parsed:
+        values = [{column: id, 'skill_id': skill_ids[skill]} for id, skills in rows for skill in skills]
+        if values:
+            association = sa.table(table, sa.column(column, sa.Integer), sa.column('skill_id', sa.Integer))
+            bind.execute(association.insert(), values)
+
+
+def downgrade() -> None:
+    op.drop_table('member_skills')
+    op.drop_table('task_skills')
+    op.drop_table('team_skills')
+    op.drop_table('skills')
@@ -0,0 +1,59 @@
+"""add team capacity and matchmaking queue
+
+Revision ID: a91d3e6c4f08
+Revises: f2c8a4d61b37
+Create Date: 2026-10-18 23:12:44.507391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a91d3e6c4f08'
+down_revision: Union[str, None] = 'f2c8a4d61b37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('teams', sa.Column('maxMembers', sa.Integer(), server_default='5', nullable=False))
+    # needsMembers now follows the member count; teams that turned it off by hand stay closed
+    # at their current size, open ones keep room for at least one more member
+    op.execute("""
+        UPDATE teams SET "maxMembers" = CASE WHEN "needsMembers" THEN greatest(5, counts.members + 1) ELSE greatest(1, counts.members) END
+        FROM (SELECT teams.id, count(members.id) AS members FROM teams LEFT JOIN members ON members.team_id = teams.id GROUP BY teams.id) counts
+        WHERE counts.id = teams.id
+    """)
+    # Open teams by where and at what level they work, for matching queued members
+    op.create_index('ix_teams_open', 'teams', [sa.text('lower(location)'), sa.text('lower("classificationLevel")'), 'id'],
+                    unique=False, postgresql_where=sa.text('"needsMembers"'))
+
+    op.create_table('join_requests',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('discordName', sa.String(), nullable=False),
+    sa.Column('skillsets', sa.String(), nullable=False),
+    sa.Column('location', sa.String(), nullable=True),
+    sa.Column('classificationLevel', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), server_default='waiting', nullable=False),
+    sa.Column('team_id', sa.Integer(), nullable=True),
+    sa.Column('member_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('checked_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('assigned_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['member_id'], ['members.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['team_id'], ['teams.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_join_requests_waiting', 'join_requests', ['checked_at', 'id'], unique=False,
+                    postgresql_where=sa.text("status = 'waiting'"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_join_requests_waiting', table_name='join_requests')
+    op.drop_table('join_requests')
+    op.drop_index('ix_teams_open', table_name='teams')
+    op.drop_column('teams', 'maxMembers')
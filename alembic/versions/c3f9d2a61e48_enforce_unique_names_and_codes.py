@@ -0,0 +1,50 @@
+"""enforce unique names and codes
+
+Revision ID: c3f9d2a61e48
+Revises: a8e4f1c29b07
+Create Date: 2026-10-18 20:14:05.412871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f9d2a61e48'
+down_revision: Union[str, None] = 'a8e4f1c29b07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows after the first that share a value, by id
+DUPLICATES = """
+    SELECT id FROM (
+        SELECT id, row_number() OVER (PARTITION BY "{column}" ORDER BY id) AS n FROM {table}
+    ) numbered WHERE n > 1
+"""
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    # Names were only checked by the API, so a race could have let a duplicate in; keep the oldest as is
+    for table in ('teams', 'tasks'):
+        connection.execute(sa.text(f"""
+            UPDATE {table} SET name = name || ' (' || id || ')'
+            WHERE id IN ({DUPLICATES.format(table=table, column='name')})
+        """))
+    # Task codes were never unique, redraw repeated ones until none are left
+    while connection.execute(sa.text(f"""
+        UPDATE tasks SET "taskCode" = substr(md5(random()::text || id::text), 1, 6)
+        WHERE id IN ({DUPLICATES.format(table='tasks', column='taskCode')})
+    """)).rowcount:
+        pass
+    op.create_unique_constraint('teams_name_key', 'teams', ['name'])
+    op.create_unique_constraint('tasks_name_key', 'tasks', ['name'])
+    op.create_unique_constraint('tasks_taskCode_key', 'tasks', ['taskCode'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('tasks_taskCode_key', 'tasks', type_='unique')
+    op.drop_constraint('tasks_name_key', 'tasks', type_='unique')
+    op.drop_constraint('teams_name_key', 'teams', type_='unique')
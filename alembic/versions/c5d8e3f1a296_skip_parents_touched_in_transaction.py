@@ -0,0 +1,46 @@
+"""skip parents touched in transaction
+
+Revision ID: c5d8e3f1a296
+Revises: b6e2f9d4a713
+Create Date: 2026-10-18 23:48:05.201377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d8e3f1a296'
+down_revision: Union[str, None] = 'b6e2f9d4a713'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CURRENT_TXID = "pg_current_xact_id()::text::bigint"
+
+# A parent this transaction already wrote carries its txid and now() already, touching it again
+# changes nothing. Bulk imports insert teams and their captains in one transaction, which
+# otherwise rewrote every new team a second time.
+TOUCH_PARENTS = f"""
+    CREATE OR REPLACE FUNCTION touch_parents() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        EXECUTE format('UPDATE %I SET updated_at = now() WHERE id IN (SELECT %I FROM changed) AND sync_txid <> {CURRENT_TXID}', TG_ARGV[0], TG_ARGV[1]);
+        RETURN NULL;
+    END $$
+    """
+
+PREVIOUS_TOUCH_PARENTS = """
+    CREATE OR REPLACE FUNCTION touch_parents() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        EXECUTE format('UPDATE %I SET updated_at = now() WHERE id IN (SELECT %I FROM changed)', TG_ARGV[0], TG_ARGV[1]);
+        RETURN NULL;
+    END $$
+    """
+
+
+def upgrade() -> None:
+    op.execute(TOUCH_PARENTS)
+
+
+def downgrade() -> None:
+    op.execute(PREVIOUS_TOUCH_PARENTS)
@@ -0,0 +1,46 @@
+"""add lookup and pagination indexes
+
+Revision ID: d7a2c5e81f90
+Revises: c3f9d2a61e48
+Create Date: 2026-10-18 21:05:37.902164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a2c5e81f90'
+down_revision: Union[str, None] = 'c3f9d2a61e48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name, table, columns, partial index predicate
+INDEXES = [
+    # Foreign keys, with id so a team's members / a task's teams come back already in id order
+    ('ix_members_team_id_id', 'members', ['team_id', 'id'], None),
+    ('ix_teams_task_id_id', 'teams', ['task_id', 'id'], None),
+    # Keyset pagination on (created_at, id)
+    ('ix_members_created_at_id', 'members', ['created_at', 'id'], None),
+    ('ix_teams_created_at_id', 'teams', ['created_at', 'id'], None),
+    ('ix_tasks_created_at_id', 'tasks', ['created_at', 'id'], None),
+    # /tasks/completed, only the completed rows are indexed
+    ('ix_tasks_completed_created_at_id', 'tasks', ['created_at', 'id'], '"isCompleted"'),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, and doesn't block writes
+    # while it builds; if_not_exists lets a run interrupted half way be repeated
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True,
+                            postgresql_where=sa.text(where) if where else None)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,27 @@
+"""add event sequence
+
+Revision ID: e4b1f7a39c25
+Revises: d7a2c5e81f90
+Create Date: 2026-10-18 21:48:19.236507
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b1f7a39c25'
+down_revision: Union[str, None] = 'd7a2c5e81f90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Numbers live change events across workers when EVENTS_BACKEND is "postgres", see app/events.py
+    op.execute(sa.schema.CreateSequence(sa.Sequence('event_seq')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('event_seq')))
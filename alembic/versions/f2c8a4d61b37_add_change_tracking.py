@@ -0,0 +1,106 @@
+"""add change tracking
+
+Revision ID: f2c8a4d61b37
+Revises: e4b1f7a39c25
+Create Date: 2026-10-18 22:31:52.640118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c8a4d61b37'
+down_revision: Union[str, None] = 'e4b1f7a39c25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CURRENT_TXID = "pg_current_xact_id()::text::bigint"
+
+FUNCTIONS = [
+    # Every insert and update stamps the row; sync_txid is the writing transaction's id,
+    # which /changes compares against snapshot horizons (see app/sync.py)
+    f"""
+    CREATE FUNCTION stamp_change() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.updated_at := now();
+        IF TG_ARGV[0] = 'sync' THEN
+            NEW.sync_txid := {CURRENT_TXID};
+        END IF;
+        RETURN NEW;
+    END $$
+    """,
+    # Members are returned inside their team and teams inside their task, so a change to a
+    # child counts as a change to its parent; once per statement, not once per row
+    """
+    CREATE FUNCTION touch_parents() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        EXECUTE format('UPDATE %I SET updated_at = now() WHERE id IN (SELECT %I FROM changed)', TG_ARGV[0], TG_ARGV[1]);
+        RETURN NULL;
+    END $$
+    """,
+    f"""
+    CREATE FUNCTION record_tombstones() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO tombstones (kind, id, sync_txid) SELECT TG_TABLE_NAME, changed.id, {CURRENT_TXID} FROM changed
+        ON CONFLICT DO NOTHING;
+        RETURN NULL;
+    END $$
+    """,
+]
+
+TRIGGERS = [
+    'CREATE TRIGGER tasks_stamp BEFORE INSERT OR UPDATE ON tasks FOR EACH ROW EXECUTE FUNCTION stamp_change(\'sync\')',
+    'CREATE TRIGGER teams_stamp BEFORE INSERT OR UPDATE ON teams FOR EACH ROW EXECUTE FUNCTION stamp_change(\'sync\')',
+    'CREATE TRIGGER members_stamp BEFORE INSERT OR UPDATE ON members FOR EACH ROW EXECUTE FUNCTION stamp_change(\'\')',
+    'CREATE TRIGGER members_touch_insert AFTER INSERT ON members REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION touch_parents(\'teams\', \'team_id\')',
+    'CREATE TRIGGER members_touch_update AFTER UPDATE ON members REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION touch_parents(\'teams\', \'team_id\')',
+    'CREATE TRIGGER members_touch_delete AFTER DELETE ON members REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION touch_parents(\'teams\', \'team_id\')',
+    'CREATE TRIGGER teams_touch_insert AFTER INSERT ON teams REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION touch_parents(\'tasks\', \'task_id\')',
+    # Teams only leave a task by being deleted or with the task itself, so the new rows are enough
+    'CREATE TRIGGER teams_touch_update AFTER UPDATE ON teams REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION touch_parents(\'tasks\', \'task_id\')',
+    'CREATE TRIGGER teams_touch_delete AFTER DELETE ON teams REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION touch_parents(\'tasks\', \'task_id\')',
+    'CREATE TRIGGER tasks_tombstone AFTER DELETE ON tasks REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION record_tombstones()',
+    'CREATE TRIGGER teams_tombstone AFTER DELETE ON teams REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION record_tombstones()',
+]
+
+
+def upgrade() -> None:
+    for table in ('tasks', 'teams', 'members'):
+        # Existing rows count as last updated when they were created
+        op.add_column(table, sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=True))
+        op.execute(f'UPDATE {table} SET updated_at = created_at')
+        op.alter_column(table, 'updated_at', nullable=False, server_default=sa.text('now()'))
+    for table in ('tasks', 'teams'):
+        # 0 for existing rows, so a first sync from token 0 includes them
+        op.add_column(table, sa.Column('sync_txid', sa.BigInteger(), server_default='0', nullable=False))
+        op.create_index(f'ix_{table}_sync_txid_id', table, ['sync_txid', 'id'], unique=False)
+
+    op.create_table('tombstones',
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sync_txid', sa.BigInteger(), nullable=False),
+    sa.Column('deleted_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'id')
+    )
+    op.create_index('ix_tombstones_kind_sync_txid', 'tombstones', ['kind', 'sync_txid'], unique=False)
+
+    for statement in FUNCTIONS + TRIGGERS:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    for trigger in TRIGGERS:
+        name, table = trigger.split()[2], trigger.split(' ON ')[1].split()[0]
+        op.execute(f'DROP TRIGGER {name} ON {table}')
+    for function in ('record_tombstones', 'touch_parents', 'stamp_change'):
+        op.execute(f'DROP FUNCTION {function}()')
+    op.drop_index('ix_tombstones_kind_sync_txid', table_name='tombstones')
+    op.drop_table('tombstones')
+    for table in ('tasks', 'teams'):
+        op.drop_index(f'ix_{table}_sync_txid_id', table_name=table)
+        op.drop_column(table, 'sync_txid')
+    for table in ('tasks', 'teams', 'members'):
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,127 @@
+import json
+import logging
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from fastapi.dependencies.utils import solve_dependencies
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute, serialize_response
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import Response
+from starlette.routing import Match
+
+from . import schemas
+from .cache import deferred_invalidations, invalidate
+from .database import get_db
+from .replicas import get_read_db
+
+logger = logging.getLogger(__name__)
+
+# Endpoints a batch can call, by handler name. Uploads, imports and streams are left out,
+# they read the raw request or manage their own transaction.
+BATCH_ROUTES = {
+    "get_team", "create_team", "update_team", "delete_team", "create_member",
+    "get_task", "create_tasks", "update_task", "delete_task", "join_task",
+    "get_member", "delete_member",
+    "join_queue", "get_queue_entry",
+}
+
+
+class OperationFailed(Exception):
+    # Carries a failed operation's result out of its savepoint, rolling the savepoint back
+    def __init__(self, result: Dict):
+        self.result = result
+
+
+def find_route(routes: list, method: str, path: str) -> Optional[Tuple[APIRoute, Dict]]:
+    scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+    for route in routes:
+        if isinstance(route, APIRoute) and route.name in BATCH_ROUTES:
+            match, child = route.matches(scope)
+            if match == Match.FULL:
+                return route, child["path_params"]
+    return None
+
+def failed(index: int, statusCode: int, detail: Any) -> Dict:
+    return {"operation": index + 1, "status": "failed", "statusCode": statusCode, "body": {"detail": detail}}
+
+async def run_operation(request: Request, db: AsyncSession, index: int, operation: schemas.BatchOperation) -> Dict:
+    # Resolve the path to a route and call its handler the way FastAPI would, except that
+    # the batch's session stands in for get_db and get_read_db
+    path, _, query = operation.path.partition("?")
+    found = find_route(request.app.router.routes, operation.method, path)
+    if found is None:
+        raise OperationFailed(failed(index, status.HTTP_404_NOT_FOUND, f"{operation.method} {path} can't be batched."))
+    route, pathParams = found
+
+    scope = {"type": "http", "method": operation.method, "path": path, "root_path": "", "query_string": query.encode(),
+             "headers": [(b"content-type", b"application/json")], "path_params": pathParams, "app": request.app, "state": {}}
+    async with AsyncExitStack() as stack:
+        try:
+            values, errors, _, _, _ = await solve_dependencies(request=Request(scope), dependant=route.dependant, body=operation.body,
+                                                               dependency_overrides_provider=request.app,
+                                                               dependency_cache={(get_db, ()): db, (get_read_db, ()): db},
+                                                               async_exit_stack=stack)
+            if errors:
+                raise OperationFailed(failed(index, status.HTTP_422_UNPROCESSABLE_ENTITY, jsonable_encoder(errors)))
+            content = await route.dependant.call(**values)
+        except HTTPException as error:
+            raise OperationFailed(failed(index, error.status_code, error.detail))
+        except IntegrityError:
+            raise OperationFailed(failed(index, status.HTTP_409_CONFLICT, "Conflicts with existing data."))
+        except SQLAlchemyError:
+            # What would have been a 500 on its own, e.g. an id out of the column's range
+            logger.exception("Batch operation %s %s failed", operation.method, path)
+            raise OperationFailed(failed(index, status.HTTP_500_INTERNAL_SERVER_ERROR, "Internal Server Error"))
+
+    if isinstance(content, Response):
+        body = json.loads(content.body) if content.body else None
+        return {"operation": index + 1, "status": "ok", "statusCode": content.status_code, "body": body}
+    body = await serialize_response(field=route.response_field, response_content=content,
+                                    include=route.response_model_include, exclude=route.response_model_exclude,
+                                    by_alias=route.response_model_by_alias, exclude_unset=route.response_model_exclude_unset,
+                                    exclude_defaults=route.response_model_exclude_defaults, exclude_none=route.response_model_exclude_none)
+    return {"operation": index + 1, "status": "ok", "statusCode": route.status_code or status.HTTP_200_OK, "body": body}
+
+
+async def run_batch(request: Request, db: AsyncSession, operations: List[schemas.BatchOperation], atomic: bool = True) -> Dict:
+    # Every operation shares one session and one transaction. Handlers' commit() only flushes,
+    # and their cache invalidations and on_commit callbacks wait for the batch's commit.
+    # Atomic batches stop at the first failure and roll everything back; otherwise each
+    # operation runs in a SAVEPOINT and only a failed one is undone.
+    db.info["batch"] = True
+    deferred: List[str] = []
+    token = deferred_invalidations.set(deferred)
+    results: List[Dict] = []
+    try:
+        for index, operation in enumerate(operations):
+            try:
+                if atomic:
+                    results.append(await run_operation(request, db, index, operation))
+                else:
+                    async with db.begin_nested():
+                        results.append(await run_operation(request, db, index, operation))
+            except OperationFailed as failure:
+                results.append(failure.result)
+                if atomic:
+                    break
+    finally:
+        deferred_invalidations.reset(token)
+        del db.info["batch"]
+
+    failedCount = sum(1 for result in results if result["status"] == "failed")
+    if atomic and failedCount:
+        await db.rollback()
+        # Nothing was written, so the operations that did run didn't happen either
+        for result in results:
+            if result["status"] == "ok":
+                result.update(status="skipped", statusCode=None, body=None)
+        results += [{"operation": index + 1, "status": "skipped", "statusCode": None, "body": None}
+                    for index in range(len(results), len(operations))]
+        return {"committed": False, "succeeded": 0, "failed": failedCount, "results": results}
+
+    await db.commit()
+    await invalidate(*dict.fromkeys(deferred))
+    return {"committed": True, "succeeded": len(results) - failedCount, "failed": failedCount, "results": results}
@@ -0,0 +1,276 @@
+import csv
+import io
+import json
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import ARRAY, Integer, String, any_, func, literal, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .cache import invalidate, team_tags
+from .codes import draw_codes
+from .database import on_commit
+from .events import emit
+from .matchmaking import member_counts, refresh_needs_members
+from .recommend import recommendations
+from .skills import sync_skills_many
+
+# Limits on a single import request
+BULK_MAX_ROWS = 100_000
+BULK_MAX_BYTES = 64 * 1024 * 1024
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+CSV_TYPES = ("text/csv", "application/csv")
+
+
+class BulkReport:
+    # Per-row outcome of an import, rows are numbered from 1 in the order they were sent
+    def __init__(self, count: int):
+        self.rows: List[Dict] = [{"row": row, "status": "created", "errors": []} for row in range(1, count + 1)]
+
+    def fail(self, index: int, *errors: str):
+        self.rows[index]["status"] = "failed"
+        self.rows[index]["errors"].extend(errors)
+
+    def record(self, index: int, id: int, code: Optional[str] = None):
+        self.rows[index]["id"] = id
+        if code is not None:
+            self.rows[index]["code"] = code
+
+    def result(self, atomic: bool = False) -> Dict:
+        failed = sum(1 for row in self.rows if row["status"] == "failed")
+        if atomic and failed:
+            # Nothing was written, so the rows that did validate weren't created either
+            for row in self.rows:
+                if row["status"] == "created":
+                    row["status"] = "skipped"
+                    row.pop("id", None)
+                    row.pop("code", None)
+        created = sum(1 for row in self.rows if row["status"] == "created")
+        return {"created": created, "failed": failed, "rows": self.rows}
+
+
+def unflatten(row: Dict[str, str]) -> Dict:
+    # CSV headers like "captain.name" become nested objects, empty cells count as missing
+    values: Dict = {}
+    for key, value in row.items():
+        if key is None or value is None or value == "":
+            continue
+        target = values
+        *parents, leaf = key.strip().split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value
+    return values
+
+async def read_rows(request: Request) -> List:
+    # Parse the body as a JSON array, NDJSON or CSV depending on its content type.
+    # Lines that don't parse are kept as strings and reported as failed rows.
+    body = await request.body()
+    if len(body) > BULK_MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Import bodies are limited to {BULK_MAX_BYTES} bytes.")
+    contentType = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Import bodies must be UTF-8.")
+
+    if contentType in NDJSON_TYPES:
+        rows = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as error:
+                rows.append(f"invalid JSON: {error}")
+    elif contentType in CSV_TYPES:
+        rows = [unflatten(row) for row in csv.DictReader(io.StringIO(text))]
+    else:
+        try:
+            rows = json.loads(text)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body is not valid JSON.")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array of rows.")
+
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No rows to import.")
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Imports are limited to {BULK_MAX_ROWS} rows.")
+    return rows
+
+def validate_rows(rows: List, schema, report: BulkReport) -> List[Tuple[int, BaseModel]]:
+    valid = []
+    for index, row in enumerate(rows):
+        if isinstance(row, str):
+            report.fail(index, row)
+            continue
+        if not isinstance(row, dict):
+            report.fail(index, "row must be an object")
+            continue
+        try:
+            valid.append((index, schema(**row)))
+        except ValidationError as error:
+            report.fail(index, *(f"{'.'.join(str(part) for part in e['loc']) or 'row'}: {e['msg']}" for e in error.errors()))
+        except (AttributeError, TypeError):
+            report.fail(index, "row has the wrong shape")
+    return valid
+
+
+def any_of(values: List, type_):
+    # One array parameter instead of one bind per value, which would hit asyncpg's parameter limit
+    return any_(literal(values, ARRAY(type_)))
+
+async def check_names(db: AsyncSession, model, valid: List[Tuple[int, BaseModel]], report: BulkReport, label: str) -> List[Tuple[int, BaseModel]]:
+    names = list({item.name for _, item in valid})
+    existing = set((await db.scalars(select(model.name).where(model.name == any_of(names, String)))).all()) if names else set()
+    seen = {}
+    kept = []
+    for index, item in valid:
+        if item.name in existing:
+            report.fail(index, f"name: a {label} named {item.name} already exists")
+        elif item.name in seen:
+            report.fail(index, f"name: duplicates row {seen[item.name] + 1}")
+        else:
+            seen[item.name] = index
+            kept.append((index, item))
+    return kept
+
+async def copy_rows(db: AsyncSession, table: str, columns: List[str], records: List[Tuple]):
+    # COPY inside the session's transaction, one round trip and one statement for every row,
+    # so statement triggers like touch_parents also run once per import rather than per batch
+    raw = (await (await db.connection()).get_raw_connection()).driver_connection
+    await raw.copy_records_to_table(table, columns=columns, records=records)
+
+async def insert_returning(db: AsyncSession, model, values: List[Dict]) -> List[int]:
+    # Ids are taken from the table's sequence up front and COPYed in with the rows, so they
+    # come back in the order the rows were given
+    if not values:
+        return []
+    table = model.__tablename__
+    ids = list(await db.scalars(select(func.nextval(func.pg_get_serial_sequence(table, "id"))).select_from(func.generate_series(1, len(values)))))
+    columns = list(values[0])
+    await copy_rows(db, table, ["id", *columns], [(id, *(row[column] for column in columns)) for id, row in zip(ids, values)])
+    return ids
+
+async def insert_named(db: AsyncSession, model, valid: List[Tuple[int, BaseModel]], values: List[Dict], report: BulkReport, label: str) -> List[Tuple[int, BaseModel, Dict, int]]:
+    # check_names ran in an earlier statement, a row with the same name can commit in between.
+    # The rows are COPYed into a staging table and merged with one INSERT ... SELECT, where
+    # ON CONFLICT DO NOTHING skips those rather than failing the whole import, and they are
+    # reported like names that were already taken. Rows come back matched up by their name.
+    if not values:
+        return []
+    table = model.__tablename__
+    staging = f"bulk_{table}"
+    columns = list(values[0])
+    quote = db.get_bind().dialect.identifier_preparer.quote
+    quoted = ", ".join(quote(column) for column in columns)
+    await db.execute(text(f"DROP TABLE IF EXISTS pg_temp.{staging}"))
+    await db.execute(text(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {quoted} FROM {table} WITH NO DATA"))
+    await copy_rows(db, staging, columns, [tuple(row[column] for column in columns) for row in values])
+    rows = select(*(literal_column(quote(column)) for column in columns)).select_from(text(staging))
+    result = await db.execute(pg_insert(model.__table__).from_select(columns, rows)
+                              .on_conflict_do_nothing(index_elements=[model.name]).returning(model.id, model.name))
+    ids = {name: id for id, name in result.all()}
+    inserted = []
+    for (index, item), row in zip(valid, values):
+        if item.name in ids:
+            inserted.append((index, item, row, ids[item.name]))
+        else:
+            report.fail(index, f"name: a {label} named {item.name} already exists")
+    return inserted
+
+
+async def finish(db: AsyncSession, report: BulkReport, atomic: bool, tags: List[str], event: str) -> Dict:
+    result = report.result(atomic)
+    if atomic and result["failed"]:
+        await db.rollback()
+        return result
+    # One event per import rather than per row, subscribers refetch
+    if result["created"]:
+        await emit(db, event, count=result["created"])
+    await db.commit()
+    await invalidate(*dict.fromkeys(tags))
+    return result
+
+async def import_members(db: AsyncSession, rows: List, atomic: bool = False) -> Dict:
+    report = BulkReport(len(rows))
+    valid = validate_rows(rows, schemas.BulkMember, report)
+
+    # Teams are locked in id order, so imports and joins touching the same teams can't deadlock,
+    # and rows past a team's capacity fail like any other invalid row
+    teamIds = list({item.team_id for _, item in valid})
+    teams = {team.id: team for team in (await db.execute(select(models.Teams.id, models.Teams.task_id, models.Teams.maxMembers)
+                                                         .where(models.Teams.id == any_of(teamIds, Integer))
+                                                         .order_by(models.Teams.id).with_for_update())).all()} if teamIds else {}
+    counts = await member_counts(db, list(teams))
+    kept = []
+    for index, item in valid:
+        team = teams.get(item.team_id)
+        if team is None:
+            report.fail(index, f"team_id: team {item.team_id} does not exist")
+        elif counts.get(team.id, 0) >= team.maxMembers:
+            report.fail(index, f"team_id: team {item.team_id} is full")
+        else:
+            counts[team.id] = counts.get(team.id, 0) + 1
+            kept.append((index, item))
+
+    if atomic and len(kept) < len(rows):
+        return report.result(atomic)
+    ids = await insert_returning(db, models.Members, [item.model_dump() for _, item in kept])
+    for (index, _), id in zip(kept, ids):
+        report.record(index, id)
+    await sync_skills_many(db, "members", {id: item.skillsets for (_, item), id in zip(kept, ids)})
+
+    joined = {item.team_id for _, item in kept}
+    await refresh_needs_members(db, list(joined))
+    tags = []
+    for team_id in joined:
+        tags += team_tags(team_id, teams[team_id].task_id)
+    return await finish(db, report, atomic, tags, "member.imported")
+
+async def import_teams(db: AsyncSession, rows: List, atomic: bool = False) -> Dict:
+    report = BulkReport(len(rows))
+    valid = await check_names(db, models.Teams, validate_rows(rows, schemas.CreateTeam, report), report, "team")
+    if atomic and len(valid) < len(rows):
+        return report.result(atomic)
+
+    codes = await draw_codes(db, models.Teams.captainCode, len(valid))
+    teams = [{**item.model_dump(exclude={"captain"}), "captainCode": code, "needsMembers": item.maxMembers > 1} for (_, item), code in zip(valid, codes)]
+    inserted = await insert_named(db, models.Teams, valid, teams, report, "team")
+    if atomic and len(inserted) < len(valid):
+        return await finish(db, report, atomic, [], "team.imported")
+    for index, _, team, id in inserted:
+        report.record(index, id, team["captainCode"])
+
+    # Each team's captain is its first member
+    captainIds = await insert_returning(db, models.Members, [{**item.captain.model_dump(), "team_id": id} for _, item, _, id in inserted])
+    await sync_skills_many(db, "teams", {id: team["preferredSkillsets"] for _, _, team, id in inserted})
+    await sync_skills_many(db, "members", {id: item.captain.skillsets for (_, item, _, _), id in zip(inserted, captainIds)})
+
+    tracked = [(id, team["location"], team["classificationLevel"], None) for _, _, team, id in inserted]
+    on_commit(db, lambda: [recommendations.upsert_team(*values) for values in tracked])
+    return await finish(db, report, atomic, ["teams"], "team.imported")
+
+async def import_tasks(db: AsyncSession, rows: List, atomic: bool = False) -> Dict:
+    report = BulkReport(len(rows))
+    valid = await check_names(db, models.Tasks, validate_rows(rows, schemas.CreateTask, report), report, "task")
+    if atomic and len(valid) < len(rows):
+        return report.result(atomic)
+
+    codes = await draw_codes(db, models.Tasks.taskCode, len(valid))
+    tasks = [{**item.model_dump(), "taskCode": code} for (_, item), code in zip(valid, codes)]
+    inserted = await insert_named(db, models.Tasks, valid, tasks, report, "task")
+    if atomic and len(inserted) < len(valid):
+        return await finish(db, report, atomic, [], "task.imported")
+    for index, _, task, id in inserted:
+        report.record(index, id, task["taskCode"])
+    await sync_skills_many(db, "tasks", {id: task["preferredSkillsets"] for _, _, task, id in inserted})
+
+    tracked = [(id, task["location"], task["classificationLevel"], False) for _, _, task, id in inserted]
+    on_commit(db, lambda: [recommendations.upsert_task(*values) for values in tracked])
+    return await finish(db, report, atomic, ["tasks"], "task.imported")
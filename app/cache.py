@@ -0,0 +1,215 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.datastructures import Headers
+from starlette.requests import cookie_parser
+from starlette.responses import Response
+
+from .config import settings
+from .pagination import NEXT_CURSOR_HEADER
+from .replicas import READ_PRIMARY, READ_YOUR_WRITES_COOKIE
+
+# Cached routes and the tags their responses depend on. Write handlers bump tag versions,
+# which moves every key built from the old versions out of reach.
+CACHED_ROUTES = [
+    (re.compile(r"^/teams/$"), lambda match: ["teams"]),
+    (re.compile(r"^/teams/(\d+)$"), lambda match: [f"team:{match[1]}"]),
+    (re.compile(r"^/tasks/$"), lambda match: ["tasks"]),
+    (re.compile(r"^/tasks/completed$"), lambda match: ["tasks"]),
+    (re.compile(r"^/tasks/(\d+)$"), lambda match: [f"task:{match[1]}"]),
+]
+# Response headers stored with the body, everything else is rebuilt per request
+CACHED_HEADERS = ("content-type", NEXT_CURSOR_HEADER.lower())
+CACHE_CONTROL = "no-cache"
+
+
+class MemoryBackend:
+    # Per-process LRU with TTL, invalidations only reach this worker
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.tag_versions: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    async def set(self, key: str, entry: dict, ttl: int):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    async def versions(self, tags: List[str]) -> List[int]:
+        return [self.tag_versions.get(tag, 0) for tag in tags]
+
+    async def bump(self, tags: List[str]):
+        with self.lock:
+            for tag in tags:
+                self.tag_versions[tag] = self.tag_versions.get(tag, 0) + 1
+
+
+class RedisBackend:
+    # Shared between workers, entries expire through Redis TTLs
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self.client.get(f"cache:entry:{key}")
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, entry: dict, ttl: int):
+        await self.client.set(f"cache:entry:{key}", json.dumps(entry), ex=ttl)
+
+    async def versions(self, tags: List[str]) -> List[int]:
+        values = await self.client.mget([f"cache:tag:{tag}" for tag in tags])
+        return [int(value or 0) for value in values]
+
+    async def bump(self, tags: List[str]):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(f"cache:tag:{tag}")
+            await pipe.execute()
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+
+    async def key(self, path: str, query: str, tags: List[str]) -> str:
+        versions = await self.backend.versions(tags)
+        return f"{path}?{query}#" + ",".join(f"{tag}={version}" for tag, version in zip(tags, versions))
+
+    async def invalidate(self, *tags: str):
+        if tags:
+            await self.backend.bump(list(tags))
+
+
+def make_backend():
+    if settings.RESPONSE_CACHE_REDIS_URL:
+        return RedisBackend(settings.RESPONSE_CACHE_REDIS_URL)
+    return MemoryBackend(settings.RESPONSE_CACHE_MAX_ENTRIES)
+
+
+response_cache = ResponseCache(make_backend(), settings.RESPONSE_CACHE_TTL)
+
+
+# Tags to invalidate after a write, a team also shows up nested in its task
+def team_tags(team_id: int, task_id: Optional[int] = None) -> List[str]:
+    tags = ["teams", f"team:{team_id}"]
+    if task_id is not None:
+        tags += task_tags(task_id)
+    return tags
+
+def task_tags(task_id: int) -> List[str]:
+    return ["tasks", f"task:{task_id}"]
+
+# Set to a list while a batch runs, handlers' invalidations are collected there and only
+# applied once the batch commits, a cached read in between would otherwise go stale
+deferred_invalidations: ContextVar[Optional[List[str]]] = ContextVar("deferred_invalidations", default=None)
+
+async def invalidate(*tags: str):
+    deferred = deferred_invalidations.get()
+    if deferred is not None:
+        deferred.extend(tags)
+        return
+    await response_cache.invalidate(*tags)
+
+
+def route_tags(path: str) -> Optional[List[str]]:
+    for pattern, tags in CACHED_ROUTES:
+        match = pattern.match(path)
+        if match:
+            return tags(match)
+    return None
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCacheMiddleware:
+    # Serves cached GET responses and answers If-None-Match with 304 before the route runs.
+    # What it stores is read from the primary: a lagging replica's answer would otherwise be
+    # kept under tag versions bumped after the write it hasn't replayed yet, and served to
+    # everyone for the TTL. Clients inside their read-your-writes window skip the cache.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        tags = route_tags(scope["path"])
+        if tags is None or READ_YOUR_WRITES_COOKIE in cookie_parser(Headers(scope=scope).get("cookie", "")):
+            await self.app(scope, receive, send)
+            return
+
+        query = urlencode(sorted(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)))
+        # Versions are read before the route runs, so a write landing mid-request
+        # leaves this response under a key that is already stale
+        key = await response_cache.key(scope["path"], query, tags)
+        if_none_match = Headers(scope=scope).get("if-none-match")
+
+        entry = await response_cache.backend.get(key)
+        if entry is not None:
+            await self.respond(entry, if_none_match, "HIT", scope, receive, send)
+            return
+
+        start, chunks = {}, []
+        scope.setdefault("state", {})[READ_PRIMARY] = True
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, capture)
+        body = b"".join(chunks)
+        if start.get("status") != 200:
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        headers = Headers(raw=start["headers"])
+        entry = {
+            "headers": [[name, headers[name]] for name in CACHED_HEADERS if name in headers],
+            "body": body.decode(),
+            "etag": make_etag(body),
+        }
+        await response_cache.backend.set(key, entry, response_cache.ttl)
+        await self.respond(entry, if_none_match, "MISS", scope, receive, send)
+
+    async def respond(self, entry: dict, if_none_match: Optional[str], result: str, scope, receive, send):
+        headers = {"ETag": entry["etag"], "Cache-Control": CACHE_CONTROL, "X-Cache": result}
+        if etag_matches(if_none_match, entry["etag"]):
+            response = Response(status_code=304, headers=headers)
+        else:
+            headers.update(entry["headers"])
+            response = Response(content=entry["body"], status_code=200, headers=headers)
+        await response(scope, receive, send)
@@ -0,0 +1,40 @@
+from typing import Dict, List
+
+from fastapi import HTTPException, status
+from sqlalchemy import ARRAY, String, any_, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .security import generate_code
+
+# Attempts at drawing an unused captain/task code before giving up
+CODE_ATTEMPTS = 5
+
+
+def codes_exhausted():
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not generate a unique code, try again.")
+
+async def insert_with_code(db: AsyncSession, model, values: Dict, code_field: str):
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING the new row. Nothing comes back when either
+    # the name or the random code is taken; a taken name returns None, a taken code is redrawn.
+    for _ in range(CODE_ATTEMPTS):
+        query = pg_insert(model).values(**values, **{code_field: generate_code()}).on_conflict_do_nothing().returning(model)
+        row = await db.scalar(query)
+        if row is not None:
+            return row
+        if await db.scalar(select(model.id).where(model.name == values["name"])) is not None:
+            return None
+    raise codes_exhausted()
+
+async def draw_codes(db: AsyncSession, column, count: int) -> List[str]:
+    # Codes are short random strings, so check the whole batch against the table and redraw clashes
+    codes: List[str] = []
+    if not count:
+        return codes
+    for _ in range(CODE_ATTEMPTS):
+        candidates = list({generate_code() for _ in range(count - len(codes))} - set(codes))
+        taken = set((await db.scalars(select(column).where(column == any_(literal(candidates, ARRAY(String)))))).all())
+        codes += [code for code in candidates if code not in taken]
+        if len(codes) == count:
+            return codes
+    raise codes_exhausted()
@@ -8,8 +8,81 @@ class Settings(BaseSettings):
     DATABASE_NAME: str
     DATABASE_USERNAME: str
 
+    # Connection pool, sized per worker process
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30
+    DATABASE_POOL_RECYCLE: int = 1800
+    DATABASE_POOL_PRE_PING: bool = True
+    DATABASE_POOL_WARMUP: bool = True
+    # Milliseconds, 0 leaves the server default
+    DATABASE_STATEMENT_TIMEOUT: int = 0
+    # PgBouncer in transaction mode: no cached prepared statements or startup parameters
+    DATABASE_PGBOUNCER: bool = False
+
+    # Comma separated read replica URLs, reads fall back to the primary when none are healthy
+    DATABASE_REPLICA_URLS: str = ""
+    # Seconds
+    DATABASE_REPLICA_MAX_LAG: float = 5
+    DATABASE_REPLICA_CHECK_INTERVAL: float = 10
+    # Seconds a client keeps reading from the primary after it writes
+    READ_YOUR_WRITES_WINDOW: int = 10
+
+    # Seconds a cached GET response lives, 0 turns the response cache off
+    RESPONSE_CACHE_TTL: int = 30
+    RESPONSE_CACHE_MAX_ENTRIES: int = 2048
+    # Share the cache and its invalidations between workers (needs the redis package)
+    RESPONSE_CACHE_REDIS_URL: str = ""
+
+    # Bytes of image data kept in memory per worker, 0 always reads from disk
+    IMAGE_CACHE_BYTES: int = 64 * 1024 * 1024
+    # Seconds an id -> image path lookup is reused, uploads in other workers show up after this
+    IMAGE_PATH_CACHE_TTL: int = 60
+    # Lookups kept per worker, the least recently used go first
+    IMAGE_PATH_CACHE_ENTRIES: int = 10_000
+
+    # "local" or "s3"; pictures are stored under the SHA-256 of their content either way
+    IMAGE_STORAGE: str = "local"
+    # Defaults to ./images/objects
+    IMAGE_STORAGE_ROOT: str = ""
+    # S3 or any S3-compatible store such as MinIO (needs the boto3 package)
+    S3_BUCKET: str = ""
+    S3_PREFIX: str = "images/"
+    S3_ENDPOINT_URL: str = ""
+    S3_REGION: str = "us-east-1"
+    S3_ACCESS_KEY_ID: str = ""
+    S3_SECRET_ACCESS_KEY: str = ""
+
+    # Add a Server-Timing header with database, handler and serialization time to responses
+    SERVER_TIMING: bool = True
+    # Log a warning when a request runs more queries than this, 0 turns the N+1 check off
+    QUERY_BUDGET: int = 0
+
+    # "memory" keeps live events within one worker, "postgres" shares them through LISTEN/NOTIFY
+    EVENTS_BACKEND: str = "memory"
+    # Direct connection for LISTEN, defaults to the primary; PgBouncer in transaction mode can't hold one
+    EVENTS_LISTEN_URL: str = ""
+    # Recent events kept per worker for clients resuming after a reconnect
+    EVENTS_BUFFER_SIZE: int = 1000
+    # Events waiting for one client before it is cut off as too slow
+    EVENTS_QUEUE_SIZE: int = 256
+    # Seconds
+    EVENTS_HEARTBEAT: float = 15
+    EVENTS_RECONNECT_DELAY: float = 3
+
+    # Queue workers per process placing members on teams, 0 leaves the queue to other processes
+    MATCHMAKING_WORKERS: int = 1
+    # Seconds between passes over requests no team fit, new requests wake the workers at once
+    MATCHMAKING_POLL_INTERVAL: float = 5
+    # Open teams considered for one request
+    MATCHMAKING_CANDIDATES: int = 20
+
+    # Seconds an Idempotency-Key is remembered, and between purges of expired ones
+    IDEMPOTENCY_TTL: int = 24 * 60 * 60
+    IDEMPOTENCY_PURGE_INTERVAL: float = 60 * 60
+
     class Config:
         env_file = ".env"
 
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
@@ -1,22 +1,150 @@
-from sqlalchemy import create_engine
+import asyncio
+import time
+from uuid import uuid4
+
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
-from psycopg2.extras import RealDictCursor
+from .metrics import Histogram, record_query
 
+# Sync (psycopg2) URL, still used by Alembic
 SQLALCHEMY_DATABASE_URL = f'postgresql://{settings.DATABASE_USERNAME}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOSTNAME}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}'
+ASYNC_DATABASE_URL = f'postgresql+asyncpg://{settings.DATABASE_USERNAME}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOSTNAME}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}'
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    # Records how long each checkout waited for a connection, including ones that timed out
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_time = Histogram()
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait_time.observe(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_time, pool.timeouts = self.wait_time, self.timeouts
+        return pool
+
+
+def connect_args():
+    args = {}
+    if settings.DATABASE_PGBOUNCER:
+        # PgBouncer hands each transaction to any server connection, so named prepared
+        # statements must not be cached or reused across transactions
+        args["statement_cache_size"] = 0
+        args["prepared_statement_cache_size"] = 0
+        args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+    elif settings.DATABASE_STATEMENT_TIMEOUT:
+        # PgBouncer rejects unknown startup parameters, there the timeout belongs on the role
+        args["server_settings"] = {"statement_timeout": str(settings.DATABASE_STATEMENT_TIMEOUT)}
+    return args
+
+
+def make_engine(url: str):
+    engine = create_async_engine(
+        url,
+        poolclass=InstrumentedPool,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+        connect_args=connect_args(),
+    )
+    count_queries(engine)
+    return engine
+
+# Count and time every round trip against the request being handled, see app/metrics.py
+def count_queries(engine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _start_query(connection, cursor, statement, parameters, context, executemany):
+        connection.info["query_start"] = time.perf_counter()
 
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _end_query(connection, cursor, statement, parameters, context, executemany):
+        record_query(statement, time.perf_counter() - connection.info.pop("query_start"))
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+def make_sessionmaker(engine):
+    return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+engine = make_engine(ASYNC_DATABASE_URL)
+
+SessionLocal = make_sessionmaker(engine)
 
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
+
+# Open pool_size connections up front so the first requests don't pay for the handshakes
+async def warm_pool():
+    connections = await asyncio.gather(*(engine.connect() for _ in range(settings.DATABASE_POOL_SIZE)))
+    for connection in connections:
+        await connection.close()
+
+def pool_stats(engine=engine) -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checkedOut": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "maxOverflow": settings.DATABASE_MAX_OVERFLOW,
+        "timeouts": pool.timeouts,
+        "waitTime": pool.wait_time.snapshot(),
+    }
+
+# What handlers call to commit. Inside a batch (see app/batch.py) it only flushes, the
+# batch commits once after its last operation.
+async def commit(db):
+    if db.info.get("batch"):
+        await db.flush()
+    else:
+        await db.commit()
+
+# Run callback once the session's current transaction commits, it is dropped on rollback.
+# Inside a SAVEPOINT it is dropped if that savepoint rolls back, callbacks from before stay.
+def on_commit(db, callback):
+    db.info.setdefault("on_commit", []).append(callback)
+
+@event.listens_for(Session, "after_commit")
+def _run_on_commit(session):
+    # Also fired when a savepoint is released, which commits nothing yet
+    if session.in_nested_transaction():
+        return
+    session.info.pop("savepoints", None)
+    for callback in session.info.pop("on_commit", []):
+        callback()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_commit(session):
+    if not session.in_nested_transaction():
+        session.info.pop("savepoints", None)
+        session.info.pop("on_commit", None)
+
+@event.listens_for(Session, "after_transaction_create")
+def _mark_savepoint(session, transaction):
+    if transaction.nested:
+        session.info.setdefault("savepoints", {})[transaction] = len(session.info.get("on_commit", []))
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_savepoint_callbacks(session, previous_transaction):
+    if previous_transaction.nested:
+        mark = session.info.get("savepoints", {}).pop(previous_transaction, None)
+        if mark is not None:
+            del session.info.get("on_commit", [])[mark:]
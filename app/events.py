@@ -0,0 +1,198 @@
+import asyncio
+import itertools
+import json
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import SQLALCHEMY_DATABASE_URL, on_commit
+
+logger = logging.getLogger(__name__)
+
+# Event types are "<entity>.<change>", subscribers filter on the entity's topic
+TOPICS = {"team": "teams", "member": "members", "task": "tasks"}
+# NOTIFY channel shared by every worker, and the sequence numbering events across them
+CHANNEL = "tb_events"
+NOTIFY = text(f"SELECT pg_notify('{CHANNEL}', nextval('event_seq') || ':' || :payload)")
+# Sent instead of events a subscriber can't be caught up on, clients refetch what they show
+RESET = "reset"
+PING = {"type": "ping"}
+
+
+def topic_of(event: Dict) -> Optional[str]:
+    return TOPICS.get(event["type"].partition(".")[0])
+
+def parse_topics(topics: Optional[str]) -> Optional[Set[str]]:
+    # None subscribes to everything
+    if not topics:
+        return None
+    selected = {topic.strip() for topic in topics.split(",") if topic.strip()}
+    unknown = selected - set(TOPICS.values())
+    if unknown:
+        raise ValueError(f"Unknown topics: {', '.join(sorted(unknown))}, pick from {', '.join(TOPICS.values())}.")
+    return selected
+
+def encode(event: Dict) -> str:
+    return json.dumps(event, separators=(",", ":"))
+
+
+class Subscription:
+    # One connected client: replayed events first, then live ones through a bounded queue.
+    # A client too slow to keep up is cut off and resumes from its last sequence number.
+    def __init__(self, topics: Optional[Set[str]], backlog: List[Dict]):
+        self.topics = topics
+        self.backlog = deque(backlog)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event: Dict) -> bool:
+        return self.topics is None or event["type"] == RESET or topic_of(event) in self.topics
+
+    def offer(self, event: Dict):
+        if self.overflowed or not self.wants(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def events(self, heartbeat: float) -> AsyncIterator[Optional[Dict]]:
+        # Yields None when nothing happened for `heartbeat` seconds, ends on overflow
+        while self.backlog:
+            event = self.backlog.popleft()
+            if self.wants(event):
+                yield event
+        while not self.overflowed:
+            try:
+                yield await asyncio.wait_for(self.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class Broker:
+    # Fans events out to this worker's subscribers and keeps the latest ones for resuming
+    def __init__(self, size: int):
+        self.recent: deque = deque(maxlen=size)
+        self.subscribers: Set[Subscription] = set()
+
+    def dispatch(self, event: Dict):
+        self.recent.append(event)
+        for subscriber in list(self.subscribers):
+            subscriber.offer(event)
+
+    def lost(self):
+        # Events may have gone by unseen, nobody can be caught up from before this point
+        self.recent.clear()
+        for subscriber in list(self.subscribers):
+            subscriber.offer({"type": RESET, "seq": None})
+
+    def latest(self) -> Optional[int]:
+        return self.recent[-1]["seq"] if self.recent else None
+
+    def replay(self, after: Optional[int]) -> List[Dict]:
+        # Events are kept in delivery order, which is commit order, so resuming means taking
+        # everything after the client's last event rather than every higher number
+        if after is None:
+            return []
+        for position, event in enumerate(self.recent):
+            if event["seq"] == after:
+                return list(itertools.islice(self.recent, position + 1, None))
+        return [{"type": RESET, "seq": self.latest()}]
+
+    @contextmanager
+    def subscribe(self, topics: Optional[Set[str]], after: Optional[int] = None):
+        subscription = Subscription(topics, self.replay(after))
+        self.subscribers.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self.subscribers.discard(subscription)
+
+
+class MemoryBackend:
+    # Events stay within the worker that handled the write
+    def __init__(self):
+        self.seq = itertools.count(1)
+
+    async def publish(self, db: AsyncSession, event: Dict):
+        on_commit(db, lambda: broker.dispatch({"seq": next(self.seq), **event}))
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class PostgresBackend:
+    # NOTIFY is sent inside the write's transaction, so it goes out only if the write commits,
+    # and every worker LISTENing receives the events in the same (commit) order
+    def __init__(self, url: str):
+        self.url = url
+        self.task: Optional[asyncio.Task] = None
+
+    async def publish(self, db: AsyncSession, event: Dict):
+        await db.execute(NOTIFY, {"payload": encode(event)})
+
+    def receive(self, connection, pid, channel, payload):
+        seq, _, body = payload.partition(":")
+        broker.dispatch({"seq": int(seq), **json.loads(body)})
+
+    async def listen(self):
+        import asyncpg
+        while True:
+            try:
+                connection = await asyncpg.connect(self.url)
+                try:
+                    closed = asyncio.Event()
+                    connection.add_termination_listener(lambda connection: closed.set())
+                    await connection.add_listener(CHANNEL, self.receive)
+                    await closed.wait()
+                finally:
+                    await connection.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the %s LISTEN connection, reconnecting", CHANNEL)
+            broker.lost()
+            await asyncio.sleep(settings.EVENTS_RECONNECT_DELAY)
+
+    async def start(self):
+        self.task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+
+def make_backend():
+    if settings.EVENTS_BACKEND == "postgres":
+        # A direct connection, PgBouncer in transaction mode can't hold a LISTEN
+        return PostgresBackend(settings.EVENTS_LISTEN_URL or SQLALCHEMY_DATABASE_URL)
+    return MemoryBackend()
+
+
+broker = Broker(settings.EVENTS_BUFFER_SIZE)
+backend = make_backend()
+
+
+# Queue an event for subscribers, call before the write commits; it is dropped on rollback
+async def emit(db: AsyncSession, type: str, **data):
+    await backend.publish(db, {"type": type, "data": data})
+
+
+async def sse_stream(topics: Optional[Set[str]], after: Optional[int]) -> AsyncIterator[str]:
+    with broker.subscribe(topics, after) as subscription:
+        yield f"retry: {int(settings.EVENTS_RECONNECT_DELAY * 1000)}\n\n"
+        async for event in subscription.events(settings.EVENTS_HEARTBEAT):
+            if event is None:
+                yield ": ping\n\n"
+            elif event["type"] == RESET:
+                yield f"event: {RESET}\ndata: {encode(event)}\n\n"
+            else:
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {encode(event)}\n\n"
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator, Dict, List
+
+from sqlalchemy import ARRAY, Integer, any_, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import models
+
+# Rows fetched per round trip from the server-side cursor, also the unit each chunk is encoded in
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+FORMAT_PATTERN = "^(ndjson|csv)$"
+
+# Exported columns, the captain and task codes are left out on purpose
+TEAM_FIELDS = ["id", "name", "captainDiscordName", "gitRepo", "location", "preferredWorkTime", "classificationLevel",
+               "preferredSkillsets", "needsMembers", "maxMembers", "task_id", "created_at"]
+TASK_FIELDS = ["id", "name", "description", "classificationLevel", "preferredSkillsets", "desiredDeliverable", "organization",
+               "location", "pocName", "pocDiscordName", "hasData", "isCompleted", "created_at"]
+MEMBER_FIELDS = ["id", "name", "discordName", "skillsets", "team_id", "created_at"]
+
+EXPORTS = {
+    "teams": (models.Teams, TEAM_FIELDS),
+    "tasks": (models.Tasks, TASK_FIELDS),
+    "members": (models.Members, MEMBER_FIELDS),
+}
+
+
+def columns(model, fields: List[str]):
+    return [getattr(model, field) for field in fields]
+
+def to_json(value):
+    return value.isoformat()
+
+async def fetch_members(db: AsyncSession, team_ids: List[int]) -> Dict[int, List[Dict]]:
+    members: Dict[int, List[Dict]] = {id: [] for id in team_ids}
+    if team_ids:
+        query = select(*columns(models.Members, MEMBER_FIELDS)).where(models.Members.team_id == any_(literal(team_ids, ARRAY(Integer)))).order_by(models.Members.id)
+        for row in await db.execute(query):
+            members[row.team_id].append(row._asdict())
+    return members
+
+async def fetch_teams(db: AsyncSession, task_ids: List[int]) -> Dict[int, List[Dict]]:
+    teams: Dict[int, List[Dict]] = {id: [] for id in task_ids}
+    if task_ids:
+        query = select(*columns(models.Teams, TEAM_FIELDS)).where(models.Teams.task_id == any_(literal(task_ids, ARRAY(Integer)))).order_by(models.Teams.id)
+        rows = [row._asdict() for row in await db.execute(query)]
+        members = await fetch_members(db, [row["id"] for row in rows])
+        for row in rows:
+            row["members"] = members[row["id"]]
+            teams[row["task_id"]].append(row)
+    return teams
+
+async def nest(db: AsyncSession, kind: str, rows: List[Dict]):
+    # Teams carry their members and tasks their teams, fetched once per batch rather than per row
+    ids = [row["id"] for row in rows]
+    if kind == "teams":
+        children, key = await fetch_members(db, ids), "members"
+    elif kind == "tasks":
+        children, key = await fetch_teams(db, ids), "teams"
+    else:
+        return
+    for row in rows:
+        row[key] = children[row["id"]]
+
+def encode_ndjson(rows: List[Dict]) -> bytes:
+    return "".join(json.dumps(row, default=to_json, separators=(",", ":")) + "\n" for row in rows).encode()
+
+def encode_csv(rows: List[Dict], fields: List[str], header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+    writer.writerows([row[field] for field in fields] for row in rows)
+    return buffer.getvalue().encode()
+
+async def export_rows(sessions: async_sessionmaker, kind: str, format: str) -> AsyncIterator[bytes]:
+    # The session is opened here rather than taken from a dependency, since dependencies are
+    # closed before a streaming response starts sending its body
+    model, fields = EXPORTS[kind]
+    query = select(*columns(model, fields)).order_by(model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    async with sessions() as db:
+        # Server-side cursor, only one batch of rows is held in memory at a time
+        result = await db.stream(query)
+        header = True
+        async for partition in result.partitions():
+            rows = [row._asdict() for row in partition]
+            if format == "csv":
+                # CSV stays flat, nested members/teams are exported on their own
+                yield encode_csv(rows, fields, header)
+                header = False
+            else:
+                await nest(db, kind, rows)
+                yield encode_ndjson(rows)
+        if format == "csv" and header:
+            yield encode_csv([], fields, header)
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
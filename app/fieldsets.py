@@ -0,0 +1,171 @@
+from typing import Dict, List, Optional, Set
+
+from fastapi import HTTPException, status
+from pydantic import ConfigDict, TypeAdapter, create_model
+from sqlalchemy import ARRAY, Integer, any_, func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, load_only, raiseload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import models, schemas
+from .pagination import MAX_PAGE_SIZE
+
+MODELS = {"teams": models.Teams, "tasks": models.Tasks, "members": models.Members}
+SCHEMAS = {"teams": schemas.ReturnTeam, "tasks": schemas.ReturnTask, "members": schemas.ReturnMember}
+# Embeddable relationships per kind: relationship name -> (relationship, child kind, child's foreign key)
+RELATIONS = {
+    "teams": {"members": (models.Teams.members, "members", "team_id")},
+    "tasks": {"teams": (models.Tasks.teams, "teams", "task_id")},
+    "members": {},
+}
+# What a list endpoint returns when no ?include= is given, the same shape as before
+DEFAULT_INCLUDE = {"teams": "members", "tasks": "teams.members", "members": ""}
+DEFAULT_ADAPTERS = {"teams": schemas.TeamList, "tasks": schemas.TaskList, "members": schemas.MemberList}
+# Pagination keys, always loaded even when not returned
+ALWAYS_LOADED = ("id", "created_at")
+# Generated response models kept per worker
+MAX_ADAPTERS = 256
+
+_adapters: Dict[tuple, TypeAdapter] = {}
+
+
+def bad_request(detail: str):
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+class FieldSet:
+    # One level of a ?fields=/?include= request: which columns to return and which
+    # relationships to embed, either all children or the first `limit` plus a count
+    def __init__(self, kind: str, foreign_key: Optional[str] = None, limit: Optional[int] = None):
+        self.kind = kind
+        self.model = MODELS[kind]
+        self.foreign_key = foreign_key
+        self.limit = limit
+        self.fields: Optional[Set[str]] = None
+        self.children: Dict[str, "FieldSet"] = {}
+
+    @classmethod
+    def parse(cls, kind: str, fields: Optional[str], include: Optional[str]) -> "FieldSet":
+        root = cls(kind)
+        for path in split(DEFAULT_INCLUDE[kind] if include is None else include):
+            root.add_include(path)
+        for path in split(fields or ""):
+            root.add_field(path)
+        return root
+
+    def scalar_fields(self) -> List[str]:
+        return [name for name in SCHEMAS[self.kind].model_fields if name not in RELATIONS[self.kind]]
+
+    def add_include(self, path: str):
+        node = self
+        for segment in path.split("."):
+            name, _, limit = segment.partition(":")
+            if name not in RELATIONS[node.kind]:
+                raise bad_request(f"Can't include {path}, {node.kind} can embed: {', '.join(RELATIONS[node.kind]) or 'nothing'}.")
+            if limit and (not limit.isdigit() or int(limit) > MAX_PAGE_SIZE):
+                raise bad_request(f"Include limits must be between 0 and {MAX_PAGE_SIZE}.")
+            _, child_kind, foreign_key = RELATIONS[node.kind][name]
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = FieldSet(child_kind, foreign_key)
+            if limit:
+                child.limit = int(limit)
+            node = child
+
+    def add_field(self, path: str):
+        *relations, name = path.split(".")
+        node = self
+        for relation in relations:
+            if relation not in node.children:
+                raise bad_request(f"Field {path} needs ?include= to embed {relation}.")
+            node = node.children[relation]
+        if name not in node.scalar_fields():
+            raise bad_request(f"Unknown field {path}, {node.kind} have: {', '.join(node.scalar_fields())}.")
+        if node.fields is None:
+            node.fields = set()
+        node.fields.add(name)
+
+    def columns(self, entity=None) -> list:
+        entity = self.model if entity is None else entity
+        names = set(ALWAYS_LOADED) | (self.fields if self.fields is not None else set(self.scalar_fields()))
+        if self.foreign_key:
+            names.add(self.foreign_key)
+        # Schema fields that aren't columns (ReturnTeam.task) fall back to their defaults
+        return [getattr(entity, name) for name in sorted(names) if name in self.model.__table__.columns]
+
+    def options(self, entity=None) -> list:
+        # Children are loaded with one SELECT ... WHERE fk IN (...) per level instead of a JOIN
+        # that repeats the parent row per child; limited ones are filled in by load()
+        entity = self.model if entity is None else entity
+        options = [load_only(*self.columns(entity))] if self.fields is not None else []
+        for name, child in self.children.items():
+            relationship = getattr(entity, name)
+            if child.limit is None:
+                options.append(selectinload(relationship).options(*child.options()))
+            else:
+                options.append(raiseload(relationship))
+        return options
+
+    def has_limits(self) -> bool:
+        return any(child.limit is not None or child.has_limits() for child in self.children.values())
+
+    async def load(self, db: AsyncSession, rows: list):
+        # Fill in the limited relationships, the rest came with the query through selectinload
+        if not self.has_limits():
+            return
+        for name, child in self.children.items():
+            if child.limit is not None:
+                await child.load_first(db, rows, name)
+            await child.load(db, [item for row in rows for item in getattr(row, name)])
+
+    async def load_first(self, db: AsyncSession, parents: list, name: str):
+        # First `limit` children per parent by id, plus how many there are in total
+        parentIds = [parent.id for parent in parents]
+        foreignKey = getattr(self.model, self.foreign_key)
+        matches = foreignKey == any_(literal(parentIds, ARRAY(Integer)))
+        children: Dict[int, list] = {id: [] for id in parentIds}
+        if parentIds and self.limit:
+            # Rows are read straight out of the ranked subquery, joining it back to the table
+            # makes the planner hash against a full scan of it
+            ranked = (select(self.model, func.row_number().over(partition_by=foreignKey, order_by=self.model.id).label("position"))
+                      .where(matches).subquery())
+            entity = aliased(self.model, ranked)
+            query = (select(entity).where(ranked.c.position <= self.limit).order_by(entity.id).options(*self.options(entity)))
+            for child in (await db.scalars(query)).all():
+                children[getattr(child, self.foreign_key)].append(child)
+        counts = dict((await db.execute(select(foreignKey, func.count()).where(matches).group_by(foreignKey))).all()) if parentIds else {}
+        for parent in parents:
+            set_committed_value(parent, name, children[parent.id])
+            setattr(parent, f"{name}Count", counts.get(parent.id, 0))
+
+    def key(self) -> tuple:
+        return (self.kind, self.limit, tuple(sorted(self.fields)) if self.fields is not None else None,
+                tuple((name, child.key()) for name, child in sorted(self.children.items())))
+
+    def response_model(self):
+        base = SCHEMAS[self.kind]
+        fields = {name: (info.annotation, info) for name, info in base.model_fields.items()
+                  if name in self.scalar_fields() and (self.fields is None or name in self.fields)}
+        for name, child in self.children.items():
+            fields[name] = (List[child.response_model()], [])
+            if child.limit is not None:
+                fields[f"{name}Count"] = (int, 0)
+        return create_model(f"{base.__name__}Fields", __config__=ConfigDict(from_attributes=True), **fields)
+
+    def adapter(self) -> TypeAdapter:
+        key = self.key()
+        if key == DEFAULT_KEYS[self.kind]:
+            return DEFAULT_ADAPTERS[self.kind]
+        adapter = _adapters.get(key)
+        if adapter is None:
+            if len(_adapters) >= MAX_ADAPTERS:
+                _adapters.clear()
+            adapter = _adapters[key] = TypeAdapter(List[self.response_model()])
+        return adapter
+
+
+def split(value: str) -> List[str]:
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+DEFAULT_KEYS = {kind: FieldSet.parse(kind, None, None).key() for kind in MODELS}
@@ -0,0 +1,97 @@
+import asyncio
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Members are assigned in chunks against this many teams at a time
+ASSIGN_WINDOW = 256
+# Upper bound on swap attempts in the local search, shared across buckets
+LOCAL_SEARCH_STEPS = 50_000
+FORMATION_WORKERS = 2
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _form_bucket(matrix: np.ndarray, team_size: int, steps: int, rng: np.random.Generator) -> List[np.ndarray]:
+    n, width = matrix.shape
+    team_count = max(1, math.ceil(n / team_size))
+    # Rare skills are worth more, so holders of rare skills are spread out first
+    frequency = matrix.sum(axis=0)
+    weights = np.divide(1.0, frequency, out=np.zeros(width), where=frequency > 0).astype(np.float32)
+    order = np.argsort(-(matrix @ weights), kind="stable")
+
+    counts = np.zeros((team_count, width), dtype=np.int32)
+    assignment = np.empty(n, dtype=np.int64)
+
+    # Greedy rounds: every team takes one member per round, which keeps sizes within one of each other
+    for start in range(0, n, team_count):
+        batch = order[start:start + team_count]
+        teams = rng.permutation(team_count)[:len(batch)]
+        for offset in range(0, len(batch), ASSIGN_WINDOW):
+            members = batch[offset:offset + ASSIGN_WINDOW]
+            window = teams[offset:offset + ASSIGN_WINDOW]
+            uncovered = (counts[window] == 0).astype(np.float32) * weights
+            gain = matrix[members].astype(np.float32) @ uncovered.T
+            for row, member in enumerate(members):
+                column = int(np.argmax(gain[row]))
+                team = window[column]
+                gain[:, column] = -np.inf
+                assignment[member] = team
+                counts[team] += matrix[member]
+
+    # Local search: swap members between teams when it raises total weighted coverage
+    if team_count > 1:
+        for first, second in rng.integers(0, n, size=(steps, 2)):
+            team_a, team_b = assignment[first], assignment[second]
+            if team_a == team_b:
+                continue
+            delta = matrix[second].astype(np.int32) - matrix[first]
+            after_a = counts[team_a] + delta
+            after_b = counts[team_b] - delta
+            improvement = (weights @ (after_a > 0) + weights @ (after_b > 0)
+                           - weights @ (counts[team_a] > 0) - weights @ (counts[team_b] > 0))
+            if improvement > 1e-9:
+                counts[team_a] = after_a
+                counts[team_b] = after_b
+                assignment[first], assignment[second] = team_b, team_a
+
+    return [np.flatnonzero(assignment == team) for team in range(team_count)]
+
+def form_teams(skills: Sequence[Sequence[int]], buckets: Sequence[int], team_size: int, seed: int = 0) -> List[List[int]]:
+    # skills[i] holds skill ids of member i, buckets[i] its (location, classificationLevel) group.
+    # Returns teams as lists of member indices; teams never mix buckets.
+    rng = np.random.default_rng(seed)
+    members = np.arange(len(skills))
+    bucket_ids = np.asarray(buckets, dtype=np.int64)
+    teams: List[List[int]] = []
+    for bucket in np.unique(bucket_ids):
+        bucket_members = members[bucket_ids == bucket]
+        vocabulary: Dict[int, int] = {}
+        rows, columns = [], []
+        for row, member in enumerate(bucket_members):
+            for skill in skills[member]:
+                rows.append(row)
+                columns.append(vocabulary.setdefault(skill, len(vocabulary)))
+        matrix = np.zeros((len(bucket_members), max(1, len(vocabulary))), dtype=np.int8)
+        matrix[rows, columns] = 1
+        steps = LOCAL_SEARCH_STEPS * len(bucket_members) // max(1, len(skills))
+        for team in _form_bucket(matrix, team_size, steps, rng):
+            teams.append(bucket_members[team].tolist())
+    return teams
+
+async def form_teams_in_pool(skills: Sequence[Sequence[int]], buckets: Sequence[int], team_size: int) -> List[List[int]]:
+    # CPU bound, so it runs in a worker process instead of on the event loop
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=FORMATION_WORKERS)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, form_teams, skills, buckets, team_size)
+
+def shutdown():
+    # Called when the app stops, formations not started yet are dropped
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
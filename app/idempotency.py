@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException, Request, status
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+from . import models
+from .config import settings
+from .database import SessionLocal, get_db
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# Seconds a duplicate waits for the first request's response to be stored
+RESPONSE_WAIT = 2
+RESPONSE_POLL = 0.02
+
+
+class IdempotentReplay(Exception):
+    # Raised by the dependency to answer with the stored response instead of running the route
+    def __init__(self, key):
+        self.key = key
+
+
+def in_progress():
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"A request with this {IDEMPOTENCY_HEADER} is still in progress.",
+                         headers={"Retry-After": "1"})
+
+def fingerprint(request: Request, body: bytes) -> bytes:
+    return hashlib.sha256(b"\n".join([request.method.encode(), request.url.path.encode(), request.url.query.encode(), body])).digest()
+
+def expired():
+    return models.IdempotencyKeys.created_at < func.now() - timedelta(seconds=settings.IDEMPOTENCY_TTL)
+
+
+# Add to a write route's dependencies. The key is claimed with an INSERT in the route's own
+# session, before anything else, so it commits or rolls back together with the write. A
+# duplicate sent while the first is running waits on the key's unique index until that
+# transaction ends, then finds the stored response; after a rollback it gets to run instead.
+async def idempotent(request: Request, db: AsyncSession = Depends(get_db),
+                     key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)):
+    if key is None:
+        return
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters.")
+    digest = fingerprint(request, await request.body())
+
+    # An expired key is taken over as if it were new
+    claim = (pg_insert(models.IdempotencyKeys).values(key=key, fingerprint=digest)
+             .on_conflict_do_update(index_elements=[models.IdempotencyKeys.key], where=expired(),
+                                    set_={"fingerprint": digest, "status_code": None, "content_type": None, "body": None, "created_at": func.now()})
+             .returning(models.IdempotencyKeys.key))
+    if await db.scalar(claim) is not None:
+        # For IdempotencyMiddleware to store the response under
+        request.state.idempotency_key = key
+        return
+
+    # ON CONFLICT locked the row even though it was left alone, which would hold up storing the response
+    await db.rollback()
+    # The response is stored just after the write commits, a duplicate that was waiting on the
+    # INSERT gets there first and gives it a moment; it stays missing only if the worker died
+    waited = 0.0
+    while True:
+        existing = (await db.execute(select(models.IdempotencyKeys.fingerprint, models.IdempotencyKeys.status_code,
+                                            models.IdempotencyKeys.content_type, models.IdempotencyKeys.body)
+                                     .where(models.IdempotencyKeys.key == key))).first()
+        if existing is None:
+            # Purged since the INSERT conflicted with it
+            raise in_progress()
+        if existing.fingerprint != digest:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"{IDEMPOTENCY_HEADER} was already used for a different request.")
+        if existing.status_code is not None:
+            raise IdempotentReplay(existing)
+        if waited >= RESPONSE_WAIT:
+            raise in_progress()
+        await asyncio.sleep(RESPONSE_POLL)
+        waited += RESPONSE_POLL
+
+async def replay(request: Request, error: IdempotentReplay):
+    return Response(error.key.body, status_code=error.key.status_code, media_type=error.key.content_type,
+                    headers={REPLAYED_HEADER: "true"})
+
+
+async def store_response(key: str, status_code: int, content_type: Optional[str], body: bytes):
+    async with SessionLocal() as db:
+        await db.execute(update(models.IdempotencyKeys).where(models.IdempotencyKeys.key == key)
+                         .values(status_code=status_code, content_type=content_type, body=body))
+        await db.commit()
+
+
+class IdempotencyMiddleware:
+    # Stores the response of a route that claimed a key, before its last byte goes out, so a
+    # client retrying the moment it sees the response already gets the replay.
+    # Only successful responses are kept: a failed route rolled its claim back with the write.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or IDEMPOTENCY_HEADER.lower().encode() not in dict(scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        start, chunks = {}, []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+                await send(message)
+                return
+            if message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                key = scope.get("state", {}).get("idempotency_key")
+                if not message.get("more_body") and key is not None and 200 <= start["status"] < 300:
+                    try:
+                        await store_response(key, start["status"], Headers(raw=start["headers"]).get("content-type"), b"".join(chunks))
+                    except Exception:
+                        # Retries then get a 409 until the key expires, rather than a second write
+                        logger.exception("Couldn't store the response for %s %s", IDEMPOTENCY_HEADER, key)
+            await send(message)
+
+        await self.app(scope, receive, capture)
+
+
+async def purge_expired():
+    while True:
+        try:
+            async with SessionLocal() as db:
+                await db.execute(delete(models.IdempotencyKeys).where(expired()))
+                await db.commit()
+        except Exception:
+            logger.exception("Purging expired idempotency keys failed")
+        await asyncio.sleep(settings.IDEMPOTENCY_PURGE_INTERVAL)
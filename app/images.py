@@ -0,0 +1,195 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+from .thumbnails import RENDER_ERRORS, derivative_key, ensure_derivative, pick_size
+from .storage import is_content_key, storage
+from .uploads import DERIVED_SIGNATURES, legacy_image_path, sniff_image_type
+
+# Stored names are content hashes (uuids before that), so a name always means the same bytes
+IMMUTABLE = "public, max-age=31536000, immutable"
+# The id URL is repointed by every upload, clients revalidate it with If-None-Match
+REVALIDATE = "no-cache"
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ImagePathCache:
+    # (kind, id) -> (owner name, pictureName), saves the row lookup on every image request.
+    # An LRU bounded by entry count, expired entries go when they are next looked up.
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, int], Tuple[float, str, str]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, kind: str, id: int) -> Optional[Tuple[str, str]]:
+        with self.lock:
+            entry = self.entries.get((kind, id))
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[(kind, id)]
+                return None
+            self.entries.move_to_end((kind, id))
+            return entry[1], entry[2]
+
+    def set(self, kind: str, id: int, owner: str, picture_name: str):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[(kind, id)] = (time.monotonic() + self.ttl, owner, picture_name)
+            self.entries.move_to_end((kind, id))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pop(self, kind: str, id: int):
+        with self.lock:
+            self.entries.pop((kind, id), None)
+
+
+class ImageMemoryCache:
+    # LRU of image bytes keyed by storage key, bounded by their total size
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[Tuple[bytes, float]]:
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self.entries.move_to_end(path)
+            return entry
+
+    def set(self, path: str, data: bytes, modified: float):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            self.discard_locked(path)
+            self.entries[path] = (data, modified)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard_locked(self, path: str):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+
+image_paths = ImagePathCache(settings.IMAGE_PATH_CACHE_TTL, settings.IMAGE_PATH_CACHE_ENTRIES)
+image_data = ImageMemoryCache(settings.IMAGE_CACHE_BYTES)
+
+
+# Drop the cached lookup for an entity whose picture was replaced or which was deleted/renamed.
+# Cached bytes stay, they are keyed by content and still valid for anyone else sharing them.
+def forget_image(kind: str, id: int):
+    image_paths.pop(kind, id)
+
+def read_legacy_image(path: str) -> Tuple[bytes, float]:
+    with open(path, "rb") as file:
+        return file.read(), os.fstat(file.fileno()).st_mtime
+
+async def load_image(key: str, legacy_path: Optional[str] = None) -> Tuple[bytes, float]:
+    entry = image_data.get(legacy_path or key)
+    if entry is None:
+        if legacy_path:
+            entry = await run_in_threadpool(read_legacy_image, legacy_path)
+        else:
+            entry = await storage.read(key)
+        image_data.set(legacy_path or key, *entry)
+    return entry
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    # Single byte range only; anything else is answered with the full body
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match[1] == match[2] == "":
+        return None
+    if match[1] == "":
+        start, end = max(0, size - int(match[2])), size - 1
+    else:
+        start = int(match[1])
+        end = min(int(match[2]), size - 1) if match[2] else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, detail="Range not satisfiable.",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def accepts_webp(request: Request) -> bool:
+    return "image/webp" in request.headers.get("accept", "")
+
+async def serve_image(request: Request, db: AsyncSession, model, kind: str, id: int, size: Optional[int] = None) -> Response:
+    cached = image_paths.get(kind, id)
+    if cached is None:
+        row = (await db.execute(select(model.name, model.pictureName).where(model.id == id))).first()
+        if row is None or not row.pictureName:
+            raise HTTPException(status_code=404, detail="Image not found")
+        cached = (row.name, row.pictureName)
+        image_paths.set(kind, id, *cached)
+    owner, key = cached
+    # Pictures not yet moved by scripts/migrate_images.py are read from their old location
+    legacy_path = None if is_content_key(key) else legacy_image_path(owner, key)
+    version = os.path.basename(key)
+
+    etag = f'"{version}"'
+    headers = {
+        "Cache-Control": IMMUTABLE if request.query_params.get("v") == version else REVALIDATE,
+        "Accept-Ranges": "bytes",
+    }
+    derived = pick_size(size) if size and not legacy_path else None
+    if derived is not None:
+        fmt = "webp" if accepts_webp(request) else None
+        etag = f'"{version}.{derived}.{fmt or "original"}"'
+        headers["Vary"] = "Accept"
+    headers["ETag"] = etag
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        if derived is not None and image_data.get(derivative_key(key, derived, fmt)) is not None:
+            # Hot derivatives are served from memory without asking storage whether they exist
+            key = derivative_key(key, derived, fmt)
+        elif derived is not None:
+            try:
+                key = await ensure_derivative(key, derived, fmt)
+            except FileNotFoundError:
+                raise
+            except RENDER_ERRORS:
+                # Pillow can't render it, hand out the original as uploaded
+                headers["ETag"] = etag = f'"{version}"'
+                del headers["Vary"]
+        data, modified = await load_image(key, legacy_path)
+    except FileNotFoundError:
+        forget_image(kind, id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unable to find {version}")
+    headers["Last-Modified"] = formatdate(modified, usegmt=True)
+    media_type = sniff_image_type(data) or sniff_image_type(data, DERIVED_SIGNATURES) or "application/octet-stream"
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = parse_range(range_header, len(data))
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(content=data[start:end + 1], status_code=status.HTTP_206_PARTIAL_CONTENT, headers=headers, media_type=media_type)
+    return Response(content=data, headers=headers, media_type=media_type)
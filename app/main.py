@@ -1,9 +1,51 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .routers import members, tasks, teams
+from fastapi.responses import ORJSONResponse
+from .routers import batch, events, export, health, matchmaking, members, metrics, tasks, teams
+from .config import settings
+from .database import engine, warm_pool
+from .replicas import read_your_writes, replicas
+from .pagination import NEXT_CURSOR_HEADER
+from .cache import ResponseCacheMiddleware
+from .metrics import MetricsMiddleware
+from .events import backend as events_backend
+from .matchmaking import matchmaker
+from .formation import shutdown as shutdown_formation
+from .thumbnails import shutdown as shutdown_thumbnails
+from .idempotency import IdempotencyMiddleware, IdempotentReplay, purge_expired, replay
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.DATABASE_POOL_WARMUP:
+        await warm_pool()
+    monitor = None
+    if replicas.replicas:
+        await replicas.check()
+        monitor = asyncio.create_task(replicas.monitor())
+    await events_backend.start()
+    matchmaker.start()
+    purge = asyncio.create_task(purge_expired())
+    yield
+    purge.cancel()
+    matchmaker.stop()
+    await events_backend.stop()
+    if monitor:
+        monitor.cancel()
+    await replicas.dispose()
+    await engine.dispose()
+    shutdown_thumbnails()
+    shutdown_formation()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+if settings.RESPONSE_CACHE_TTL:
+    app.add_middleware(ResponseCacheMiddleware)
+
+app.add_middleware(IdempotencyMiddleware)
+app.add_exception_handler(IdempotentReplay, replay)
 
 # Set Origins to only be frontend http://ip address:port
 origins = ["*"]
@@ -15,11 +57,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=methods,
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Server-Timing"],
 )
 
+if replicas.replicas:
+    app.middleware("http")(read_your_writes)
+
+# Added last so it wraps everything else, cache hits included
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
 app.include_router(tasks.router)
 app.include_router(teams.router)
 app.include_router(members.router)
+app.include_router(export.router)
+app.include_router(health.router)
+app.include_router(metrics.router)
+app.include_router(events.router)
+app.include_router(matchmaking.router)
+app.include_router(batch.router)
 
 @app.get("/")
 def read():
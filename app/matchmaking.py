@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import ARRAY, Integer, any_, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .cache import invalidate, team_tags
+from .config import settings
+from .database import SessionLocal
+from .events import emit
+from .skills import parse_skills, sync_skills
+
+logger = logging.getLogger(__name__)
+
+WAITING = "waiting"
+ASSIGNED = "assigned"
+
+# Every path that adds or removes members locks the team row first and counts after, in a
+# separate statement. Under READ COMMITTED that count sees every earlier joiner's commit,
+# while a count taken in the locking statement would come from the snapshot before the wait.
+
+
+async def lock_team(db: AsyncSession, team_id: int, skip_locked: bool = False):
+    # None when the team doesn't exist, or with skip_locked when someone else holds its lock
+    return (await db.execute(select(models.Teams.id, models.Teams.task_id, models.Teams.maxMembers, models.Teams.needsMembers)
+                             .where(models.Teams.id == team_id).with_for_update(skip_locked=skip_locked))).first()
+
+async def member_counts(db: AsyncSession, team_ids: List[int]) -> Dict[int, int]:
+    if not team_ids:
+        return {}
+    rows = await db.execute(select(models.Members.team_id, func.count()).where(models.Members.team_id == any_(literal(team_ids, ARRAY(Integer))))
+                            .group_by(models.Members.team_id))
+    return dict(rows.all())
+
+async def refresh_needs_members(db: AsyncSession, team_ids: List[int]) -> Dict[int, bool]:
+    # After members were removed or maxMembers changed; locks in id order like the bulk import
+    if not team_ids:
+        return {}
+    matches = models.Teams.id == any_(literal(list(team_ids), ARRAY(Integer)))
+    locked = await db.execute(select(models.Teams.id, models.Teams.needsMembers).where(matches).order_by(models.Teams.id).with_for_update())
+    needsMembers = dict(locked.all())
+    # Only teams whose flag flips are written, an import adding a member to thousands of
+    # teams would otherwise rewrite every one of them and mark them all changed for sync
+    has_room = select(func.count()).where(models.Members.team_id == models.Teams.id).scalar_subquery() < models.Teams.maxMembers
+    rows = await db.execute(update(models.Teams).where(matches, models.Teams.needsMembers.is_distinct_from(has_room)).values(needsMembers=has_room)
+                            .returning(models.Teams.id, models.Teams.needsMembers))
+    needsMembers.update(rows.all())
+    return needsMembers
+
+async def add_member(db: AsyncSession, team, count: int, values: Dict) -> models.Members:
+    # team is a locked row from lock_team with `count` members
+    member = await db.scalar(pg_insert(models.Members).values(**values, team_id=team.id).returning(models.Members))
+    needsMembers = count + 1 < team.maxMembers
+    if needsMembers != team.needsMembers:
+        await db.execute(update(models.Teams).where(models.Teams.id == team.id).values(needsMembers=needsMembers))
+    await sync_skills(db, "members", member.id, member.skillsets)
+    await emit(db, "member.joined", id=member.id, team_id=team.id, needsMembers=needsMembers)
+    return member
+
+async def join_team(db: AsyncSession, team_id: int, values: Dict):
+    team = await lock_team(db, team_id)
+    if team is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Team with id: {team_id} does not exist.")
+    count = (await member_counts(db, [team_id])).get(team_id, 0)
+    if count >= team.maxMembers:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Team with id: {team_id} is full.")
+    return await add_member(db, team, count, values), team
+
+
+def open_teams(request: models.JoinRequests):
+    query = select(models.Teams.id, models.Teams.task_id, models.Teams.maxMembers, models.Teams.needsMembers, models.Teams.preferredSkillsets)
+    query = query.where(models.Teams.needsMembers)
+    if request.location:
+        query = query.where(func.lower(models.Teams.location) == request.location.lower())
+    if request.classificationLevel:
+        query = query.where(func.lower(models.Teams.classificationLevel) == request.classificationLevel.lower())
+    # Not locked, only the team picked from these is, see assign_next
+    return query.order_by(models.Teams.id).limit(settings.MATCHMAKING_CANDIDATES)
+
+def pick_team(request: models.JoinRequests, teams: list, counts: Dict[int, int]):
+    # Most shared skills, then the fullest team so teams fill up rather than all staying half empty
+    skills = set(parse_skills(request.skillsets))
+    candidates = [team for team in teams if counts.get(team.id, 0) < team.maxMembers]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda team: (len(skills & set(parse_skills(team.preferredSkillsets))), counts.get(team.id, 0), -team.id))
+
+async def assign_next(db: AsyncSession, started: float, retry: bool) -> Optional[bool]:
+    # Claim the longest-unchecked waiting request and place it, in one transaction.
+    # None when there is nothing left to look at in this pass, else whether it was placed.
+    query = select(models.JoinRequests).where(models.JoinRequests.status == WAITING)
+    if not retry:
+        # Only requests no worker has looked at yet
+        query = query.where(models.JoinRequests.checked_at == models.JoinRequests.created_at)
+    request = await db.scalar(query.order_by(models.JoinRequests.checked_at, models.JoinRequests.id)
+                              .limit(1).with_for_update(skip_locked=True))
+    if request is None or request.checked_at.timestamp() >= started:
+        await db.rollback()
+        return None
+
+    teams = (await db.execute(open_teams(request))).all()
+    counts = await member_counts(db, [team.id for team in teams])
+    while True:
+        team = pick_team(request, teams, counts)
+        if team is None:
+            request.checked_at = func.now()
+            await db.commit()
+            return False
+        # Only the chosen team is locked, so the other candidates stay free for other workers
+        # and joins. One another worker or a join is filling right now is passed over rather
+        # than waited for, as is one that filled up since the candidates were read.
+        locked = await lock_team(db, team.id, skip_locked=True)
+        if locked is not None:
+            count = (await member_counts(db, [team.id])).get(team.id, 0)
+            if count < locked.maxMembers:
+                break
+        teams = [candidate for candidate in teams if candidate.id != team.id]
+
+    member = await add_member(db, locked, count, {"name": request.name, "discordName": request.discordName, "skillsets": request.skillsets})
+    request.status, request.team_id, request.member_id, request.checked_at, request.assigned_at = ASSIGNED, locked.id, member.id, func.now(), func.now()
+    await db.commit()
+    await invalidate(*team_tags(locked.id, locked.task_id))
+    return True
+
+
+class Matchmaker:
+    # Background workers draining the queue. Any number may run, across processes too:
+    # SKIP LOCKED hands each one different requests and different teams.
+    # New requests wake them to place just those; requests no team fit are retried every
+    # MATCHMAKING_POLL_INTERVAL, and a wake cuts a retry short, so a backlog of them
+    # doesn't hold up placing the new ones.
+    def __init__(self):
+        self.wake = asyncio.Event()
+        self.tasks: List[asyncio.Task] = []
+
+    async def drain(self, retry: bool) -> bool:
+        # Whether the pass finished, a retry stops after any request once new ones are waiting
+        async with SessionLocal() as db:
+            started = (await db.scalar(select(func.now()))).timestamp()
+        while True:
+            async with SessionLocal() as db:
+                if await assign_next(db, started, retry) is None:
+                    return True
+            if retry and self.wake.is_set():
+                return False
+
+    async def run(self):
+        retried = None
+        while True:
+            due = retried is None or time.monotonic() - retried >= settings.MATCHMAKING_POLL_INTERVAL
+            retry = due and not self.wake.is_set()
+            if not retry:
+                self.wake.clear()
+            try:
+                if await self.drain(retry) and retry:
+                    retried = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Matchmaking pass failed")
+                if retry:
+                    retried = time.monotonic()
+            if retried is not None and not self.wake.is_set():
+                try:
+                    await asyncio.wait_for(self.wake.wait(), max(0, retried + settings.MATCHMAKING_POLL_INTERVAL - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(settings.MATCHMAKING_WORKERS)]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+matchmaker = Matchmaker()
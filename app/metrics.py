@@ -0,0 +1,239 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, the last bucket catches everything above
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Database queries run by one request
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    # Per-bucket (not cumulative) counts plus count and sum, cheap enough to observe on every call
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+            buckets["+Inf"] = self.counts[-1]
+            return {"count": self.count, "sum": round(self.sum, 6), "buckets": buckets}
+
+
+class RequestStats:
+    # Costs of the request being handled. Shared by reference, so queries run from
+    # greenlets or the threadpool add to the same object.
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.endpoint_done: Optional[float] = None
+        self.serialize_time = 0.0
+        # Only kept when the N+1 check is on
+        self.statements: Optional[Counter] = Counter() if settings.QUERY_BUDGET else None
+
+request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+def record_query(statement: str, duration: float):
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += duration
+        if stats.statements is not None:
+            stats.statements[statement] += 1
+
+def server_timing(stats: RequestStats) -> str:
+    total = time.perf_counter() - stats.start
+    return (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+            f"ser;dur={stats.serialize_time * 1000:.1f}, total;dur={total * 1000:.1f}")
+
+def check_query_budget(method: str, route: str, stats: RequestStats):
+    if settings.QUERY_BUDGET and stats.queries > settings.QUERY_BUDGET:
+        statement, repeats = stats.statements.most_common(1)[0]
+        logger.warning("%s %s ran %d queries (budget %d), the most repeated one %d times: %s",
+                       method, route, stats.queries, settings.QUERY_BUDGET, repeats, " ".join(statement.split())[:300])
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram()
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_time = Histogram()
+        self.serialize_time = Histogram()
+        self.statuses: Counter = Counter()
+
+
+class MetricsRegistry:
+    # Per-route request metrics for this worker, rendered in the Prometheus text format
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, method: str, route: str, status: int, stats: RequestStats, elapsed: float):
+        with self.lock:
+            metrics = self.routes.get((method, route))
+            if metrics is None:
+                metrics = self.routes[(method, route)] = RouteMetrics()
+            metrics.statuses[status] += 1
+        metrics.latency.observe(elapsed)
+        metrics.queries.observe(stats.queries)
+        metrics.db_time.observe(stats.db_time)
+        metrics.serialize_time.observe(stats.serialize_time)
+
+    def render(self, pools: Dict[str, dict]) -> str:
+        with self.lock:
+            routes = sorted(self.routes.items())
+        lines: List[str] = []
+        lines += metric_header("http_requests_total", "counter", "Requests by route and status")
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f"http_requests_total{labels(method=method, route=route, status=status)} {count}")
+        for name, attribute, help in (
+            ("http_request_duration_seconds", "latency", "Request latency by route"),
+            ("http_request_db_queries", "queries", "Database queries per request"),
+            ("http_request_db_seconds", "db_time", "Time per request spent in database queries"),
+            ("http_request_serialization_seconds", "serialize_time", "Time per request spent validating and encoding the response"),
+        ):
+            lines += metric_header(name, "histogram", help)
+            for (method, route), metrics in routes:
+                lines += histogram_lines(name, {"method": method, "route": route}, getattr(metrics, attribute).snapshot())
+
+        for name, key, help in (
+            ("db_pool_size", "size", "Connections the pool keeps open"),
+            ("db_pool_checked_out", "checkedOut", "Connections in use"),
+            ("db_pool_overflow", "overflow", "Connections open beyond the pool size"),
+        ):
+            lines += metric_header(name, "gauge", help)
+            lines += [f"{name}{labels(pool=pool)} {stats[key]}" for pool, stats in pools.items()]
+        lines += metric_header("db_pool_timeouts_total", "counter", "Checkouts that gave up waiting for a connection")
+        lines += [f"db_pool_timeouts_total{labels(pool=pool)} {stats['timeouts']}" for pool, stats in pools.items()]
+        lines += metric_header("db_pool_wait_seconds", "histogram", "Time spent waiting for a connection")
+        for pool, stats in pools.items():
+            lines += histogram_lines("db_pool_wait_seconds", {"pool": pool}, stats["waitTime"])
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def labels(**values) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(values, escaped)) + "}"
+
+def metric_header(name: str, type: str, help: str) -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+
+def histogram_lines(name: str, label_values: Dict[str, str], snapshot: dict) -> List[str]:
+    # Histogram keeps per-bucket counts, Prometheus wants them cumulative
+    lines, total = [], 0
+    for bound, count in snapshot["buckets"].items():
+        total += count
+        lines.append(f"{name}_bucket{labels(**label_values, le=bound)} {total}")
+    lines.append(f"{name}_sum{labels(**label_values)} {snapshot['sum']}")
+    lines.append(f"{name}_count{labels(**label_values)} {snapshot['count']}")
+    return lines
+
+
+class InstrumentedRoute(APIRoute):
+    # Notes when the endpoint returns, the rest of the route handler is FastAPI validating
+    # and encoding the response, which is reported as serialization time
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            @functools.wraps(call)
+            async def timed(*args, **kwargs):
+                try:
+                    return await call(*args, **kwargs)
+                finally:
+                    endpoint_done()
+        else:
+            @functools.wraps(call)
+            def timed(*args, **kwargs):
+                try:
+                    return call(*args, **kwargs)
+                finally:
+                    endpoint_done()
+        # The request handler looks the call up on the dependant each time it runs
+        self.dependant.call = timed
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            response = await handler(request)
+            stats = request_stats.get()
+            if stats is not None and stats.endpoint_done is not None:
+                stats.serialize_time += time.perf_counter() - stats.endpoint_done
+            return response
+        return timed_handler
+
+def endpoint_done():
+    stats = request_stats.get()
+    if stats is not None:
+        stats.endpoint_done = time.perf_counter()
+
+
+class MetricsMiddleware:
+    # Outermost middleware: times the whole request, adds Server-Timing and records per-route metrics
+    def __init__(self, app, routes: list):
+        self.app = app
+        self.routes = routes
+
+    def route_path(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        # Requests answered before routing, such as response cache hits
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.SERVER_TIMING:
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", server_timing(stats).encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            request_stats.reset(token)
+            route = self.route_path(scope)
+            registry.observe(scope["method"], route, status, stats, time.perf_counter() - stats.start)
+            check_query_budget(scope["method"], route, stats)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, LargeBinary, SmallInteger, String, Boolean, ForeignKey, Index, Table
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
@@ -8,6 +8,12 @@ from .database import Base
 
 class Tasks(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_preferredSkillsets_trgm", "preferredSkillsets", postgresql_using="gin", postgresql_ops={"preferredSkillsets": "gin_trgm_ops"}),
+        Index("ix_tasks_created_at_id", "created_at", "id"),
+        Index("ix_tasks_completed_created_at_id", "created_at", "id", postgresql_where=text('"isCompleted"')),
+        Index("ix_tasks_sync_txid_id", "sync_txid", "id"),
+    )
     id = Column(Integer, primary_key=True, nullable=False)
     name = Column(String, nullable=False, unique=True)
     description = Column(String, nullable=False)
@@ -19,16 +25,27 @@ class Tasks(Base):
     pocName = Column(String, nullable=False)
     pocDiscordName = Column(String, nullable=False)
     hasData = Column(Boolean, server_default='FALSE', nullable=False)
-    taskCode = Column(String, nullable=False)
+    taskCode = Column(String, nullable=False, unique=True)
     created_at = Column(TIMESTAMP(timezone=True),
                         nullable=False, server_default=text('now()'))
     isCompleted = Column(Boolean, server_default='FALSE', nullable=False)
     pictureName = Column(String, nullable=True)
+    # Both maintained by triggers, see the add_change_tracking migration
+    updated_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=text('now()'))
+    sync_txid = Column(BigInteger, nullable=False, server_default='0')
     teams = relationship("Teams", back_populates="tasks")
 
 
 class Teams(Base):
     __tablename__ = "teams"
+    __table_args__ = (
+        Index("ix_teams_preferredSkillsets_trgm", "preferredSkillsets", postgresql_using="gin", postgresql_ops={"preferredSkillsets": "gin_trgm_ops"}),
+        Index("ix_teams_created_at_id", "created_at", "id"),
+        Index("ix_teams_task_id_id", "task_id", "id"),
+        Index("ix_teams_sync_txid_id", "sync_txid", "id"),
+        Index("ix_teams_open", text('lower(location)'), text('lower("classificationLevel")'), "id", postgresql_where=text('"needsMembers"')),
+    )
     id = Column(Integer, primary_key=True, nullable=False)
     name = Column(String, nullable=False, unique=True)
     captainDiscordName = Column(String, nullable=False)
@@ -37,18 +54,28 @@ class Teams(Base):
     preferredWorkTime = Column(String, nullable=False)
     classificationLevel = Column(String, nullable=False)
     preferredSkillsets = Column(String, nullable=False)
+    # Kept in step with the member count by app/matchmaking.py
     needsMembers = Column(Boolean, nullable=False, server_default='TRUE')
+    maxMembers = Column(Integer, nullable=False, server_default='5')
     created_at = Column(TIMESTAMP(timezone=True),
                         nullable=False, server_default=text('now()'))
     captainCode = Column(String, nullable=True, unique=True)
     task_id = Column(Integer, ForeignKey("tasks.id", ondelete="SET NULL"), nullable=True)
     pictureName = Column(String, nullable=True)
+    updated_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=text('now()'))
+    sync_txid = Column(BigInteger, nullable=False, server_default='0')
     tasks = relationship("Tasks", back_populates="teams")
     members = relationship("Members", back_populates="teams")
 
 
 class Members(Base):
     __tablename__ = "members"
+    __table_args__ = (
+        Index("ix_members_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_members_created_at_id", "created_at", "id"),
+        Index("ix_members_team_id_id", "team_id", "id"),
+    )
     id = Column(Integer, primary_key=True, nullable=False)
     name = Column(String, nullable=False)
     discordName = Column(String, nullable=False)
@@ -56,4 +83,81 @@ class Members(Base):
     created_at = Column(TIMESTAMP(timezone=True),
                         nullable=False, server_default=text('now()'))
     team_id = Column(Integer, ForeignKey("teams.id", ondelete="CASCADE"), nullable=False)
-    teams = relationship("Teams", back_populates="members")
\ No newline at end of file
+    updated_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=text('now()'))
+    teams = relationship("Teams", back_populates="members")
+
+# Members waiting for app/matchmaking.py to place them on a team
+class JoinRequests(Base):
+    __tablename__ = "join_requests"
+    __table_args__ = (
+        Index("ix_join_requests_waiting", "checked_at", "id", postgresql_where=text("status = 'waiting'")),
+    )
+    id = Column(Integer, primary_key=True, nullable=False)
+    name = Column(String, nullable=False)
+    discordName = Column(String, nullable=False)
+    skillsets = Column(String, nullable=False)
+    location = Column(String, nullable=True)
+    classificationLevel = Column(String, nullable=True)
+    status = Column(String, nullable=False, server_default='waiting')
+    team_id = Column(Integer, ForeignKey("teams.id", ondelete="SET NULL"), nullable=True)
+    member_id = Column(Integer, ForeignKey("members.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=text('now()'))
+    # Last time a worker looked for a team, the queue is worked oldest-checked first
+    checked_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=text('now()'))
+    assigned_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+# Written by a trigger when a team or task is deleted, so /changes can report it
+class Tombstones(Base):
+    __tablename__ = "tombstones"
+    __table_args__ = (
+        Index("ix_tombstones_kind_sync_txid", "kind", "sync_txid"),
+    )
+    kind = Column(String, primary_key=True, nullable=False)
+    id = Column(Integer, primary_key=True, nullable=False)
+    sync_txid = Column(BigInteger, nullable=False)
+    deleted_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=text('now()'))
+
+# Responses of write requests sent with an Idempotency-Key, replayed to retries (app/idempotency.py)
+class IdempotencyKeys(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
+    key = Column(String, primary_key=True, nullable=False)
+    # sha256 of the method, path and body, a key reused for another request is refused
+    fingerprint = Column(LargeBinary, nullable=False)
+    # Empty until the response is stored, just after the write commits
+    status_code = Column(SmallInteger, nullable=True)
+    content_type = Column(String, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=text('now()'))
+
+class Skills(Base):
+    __tablename__ = "skills"
+    id = Column(Integer, primary_key=True, nullable=False)
+    name = Column(String, nullable=False, unique=True)
+
+
+# Normalized skills behind the free-text preferredSkillsets/skillsets columns
+team_skills = Table(
+    "team_skills", Base.metadata,
+    Column("team_id", Integer, ForeignKey("teams.id", ondelete="CASCADE"), primary_key=True),
+    Column("skill_id", Integer, ForeignKey("skills.id", ondelete="CASCADE"), primary_key=True),
+)
+
+task_skills = Table(
+    "task_skills", Base.metadata,
+    Column("task_id", Integer, ForeignKey("tasks.id", ondelete="CASCADE"), primary_key=True),
+    Column("skill_id", Integer, ForeignKey("skills.id", ondelete="CASCADE"), primary_key=True),
+)
+
+member_skills = Table(
+    "member_skills", Base.metadata,
+    Column("member_id", Integer, ForeignKey("members.id", ondelete="CASCADE"), primary_key=True),
+    Column("skill_id", Integer, ForeignKey("skills.id", ondelete="CASCADE"), primary_key=True),
+)
@@ -0,0 +1,89 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Page sizes for the list endpoints
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+# Response header carrying the opaque cursor for the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode(cursor: str) -> str:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    return _encode(f"{created_at.isoformat()}|{id}")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, id = _decode(cursor).split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+def encode_offset_cursor(offset: int) -> str:
+    return _encode(f"@{offset}")
+
+def decode_offset_cursor(cursor: str) -> int:
+    raw = _decode(cursor)
+    if not raw.startswith("@") or not raw[1:].isdigit():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+    return int(raw[1:])
+
+def encode_sync_token(txid: int, after: Optional[Tuple[int, int, int]] = None) -> str:
+    # A transaction id horizon, plus while a sync is still paging the horizon captured on its
+    # first page and the last (sync_txid, id) returned
+    return _encode(f"~{txid}" + ("".join(f"|{part}" for part in after) if after else ""))
+
+def decode_sync_token(token: str) -> Tuple[int, Optional[int], Optional[Tuple[int, int]]]:
+    # (horizon, next horizon, position); tokens from before the next horizon was carried have
+    # only a position, their horizon is a safe stand-in as it is older
+    raw = _decode(token)
+    parts = raw[1:].split("|")
+    if not raw.startswith("~") or len(parts) not in (1, 3, 4) or not all(part.isdigit() for part in parts):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid sync token.")
+    txid, *rest = map(int, parts)
+    if not rest:
+        return txid, None, None
+    if len(rest) == 2:
+        return txid, txid, tuple(rest)
+    return txid, rest[0], tuple(rest[1:])
+
+async def paginate(db: AsyncSession, query, model, response: Response, limit: int, cursor: Optional[str] = None, skip: int = 0, order_by=None):
+    if order_by is not None:
+        # Ranked results can't be keyed on (created_at, id), so their cursor wraps an offset
+        offset = decode_offset_cursor(cursor) if cursor else skip
+        query = query.order_by(*order_by, model.id).offset(offset)
+    else:
+        # Keyset pagination on (created_at, id); OFFSET is only used when no cursor is given
+        query = query.order_by(model.created_at, model.id)
+        if cursor:
+            created_at, id = decode_cursor(cursor)
+            query = query.filter(tuple_(model.created_at, model.id) > tuple_(created_at, id))
+        elif skip:
+            query = query.offset(skip)
+
+    # Fetch one extra row to know whether another page exists
+    rows = (await db.execute(query.limit(limit + 1))).unique().scalars().all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if order_by is not None:
+            response.headers[NEXT_CURSOR_HEADER] = encode_offset_cursor(offset + limit)
+        else:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at, last.id)
+    return rows
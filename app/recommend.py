@@ -0,0 +1,254 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import on_commit
+from .skills import popcount, skill_index
+
+# Score weights, the skill term is the share of the task's skills the team covers
+SKILL_WEIGHT = 0.6
+LOCATION_WEIGHT = 0.2
+CLASSIFICATION_WEIGHT = 0.2
+# Rebuild from the database periodically so writes from other workers show up
+RECOMMEND_INDEX_TTL = 300
+
+# Bits set in every byte value, used to popcount uint64 words through a uint8 view
+POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def normalize(value: Optional[str]) -> str:
+    return " ".join((value or "").lower().split())
+
+def mask_to_words(mask: int, width: int) -> np.ndarray:
+    return np.frombuffer(mask.to_bytes(width * 8, "little"), dtype=np.uint64)
+
+def words_needed(mask: int) -> int:
+    return max(1, (mask.bit_length() + 63) // 64)
+
+
+class FeatureTable:
+    # Column-oriented feature arrays for one entity kind, rows are reused through a free list
+    def __init__(self):
+        self.rows: Dict[int, int] = {}
+        self.free: List[int] = []
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.words = np.zeros((0, 1), dtype=np.uint64)
+        self.skill_counts = np.zeros(0, dtype=np.int32)
+        self.locations = np.zeros(0, dtype=np.int32)
+        self.classifications = np.zeros(0, dtype=np.int32)
+        self.eligible = np.zeros(0, dtype=bool)
+
+    def build(self, ids: List[int], masks: List[int], locations: List[int], classifications: List[int], eligible: List[bool]):
+        width = max([words_needed(mask) for mask in masks], default=1)
+        self.rows = {id: row for row, id in enumerate(ids)}
+        self.free = []
+        self.ids = np.array(ids, dtype=np.int64)
+        raw = b"".join(mask.to_bytes(width * 8, "little") for mask in masks)
+        self.words = np.frombuffer(raw, dtype=np.uint64).reshape(len(ids), width).copy()
+        self.skill_counts = popcount_rows(self.words)
+        self.locations = np.array(locations, dtype=np.int32)
+        self.classifications = np.array(classifications, dtype=np.int32)
+        self.eligible = np.array(eligible, dtype=bool)
+
+    def ensure_width(self, width: int):
+        if width > self.words.shape[1]:
+            padding = np.zeros((self.words.shape[0], width - self.words.shape[1]), dtype=np.uint64)
+            self.words = np.hstack([self.words, padding])
+
+    def grow(self):
+        size = max(16, len(self.ids) * 2)
+        extra = size - len(self.ids)
+        self.free.extend(range(size - 1, len(self.ids) - 1, -1))
+        self.ids = np.concatenate([self.ids, np.full(extra, -1, dtype=np.int64)])
+        self.words = np.vstack([self.words, np.zeros((extra, self.words.shape[1]), dtype=np.uint64)])
+        self.skill_counts = np.concatenate([self.skill_counts, np.zeros(extra, dtype=np.int32)])
+        self.locations = np.concatenate([self.locations, np.full(extra, -1, dtype=np.int32)])
+        self.classifications = np.concatenate([self.classifications, np.full(extra, -1, dtype=np.int32)])
+        self.eligible = np.concatenate([self.eligible, np.zeros(extra, dtype=bool)])
+
+    def upsert(self, id: int, mask: int, location: int, classification: int, eligible: bool):
+        row = self.rows.get(id)
+        if row is None:
+            if not self.free:
+                self.grow()
+            row = self.free.pop()
+            self.rows[id] = row
+        self.ensure_width(words_needed(mask))
+        self.ids[row] = id
+        self.words[row] = mask_to_words(mask, self.words.shape[1])
+        self.skill_counts[row] = popcount(mask)
+        self.locations[row] = location
+        self.classifications[row] = classification
+        self.eligible[row] = eligible
+
+    def set_eligible(self, id: int, eligible: bool):
+        row = self.rows.get(id)
+        if row is not None:
+            self.eligible[row] = eligible
+
+    def remove(self, id: int):
+        row = self.rows.pop(id, None)
+        if row is not None:
+            self.ids[row] = -1
+            self.eligible[row] = False
+            self.free.append(row)
+
+
+def popcount_rows(words: np.ndarray) -> np.ndarray:
+    if words.shape[0] == 0:
+        return np.zeros(0, dtype=np.int32)
+    return POPCOUNT8[words.view(np.uint8)].reshape(words.shape[0], -1).sum(axis=1, dtype=np.int32)
+
+
+class RecommendationIndex:
+    # Team/task compatibility scores over numpy feature arrays. Rebuilt in bulk from the
+    # database when stale and patched in place by the write handlers after they commit.
+    def __init__(self):
+        self.tasks = FeatureTable()
+        self.teams = FeatureTable()
+        self.codes: Dict[str, int] = {}
+        self.task_teams: Dict[int, set] = {}
+        self.team_task: Dict[int, Optional[int]] = {}
+        self.completed: Dict[int, bool] = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def code(self, value: Optional[str]) -> int:
+        return self.codes.setdefault(normalize(value), len(self.codes))
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > RECOMMEND_INDEX_TTL
+
+    async def ensure_loaded(self, db: AsyncSession):
+        await skill_index.ensure_loaded(db)
+        if self.is_stale():
+            await self.load(db)
+
+    async def load(self, db: AsyncSession):
+        task_rows = (await db.execute(select(models.Tasks.id, models.Tasks.location, models.Tasks.classificationLevel, models.Tasks.isCompleted))).all()
+        team_rows = (await db.execute(select(models.Teams.id, models.Teams.location, models.Teams.classificationLevel, models.Teams.task_id))).all()
+        with self.lock:
+            self.codes = {}
+            self.team_task = {id: task_id for id, _, _, task_id in team_rows}
+            self.task_teams = {}
+            for team_id, task_id in self.team_task.items():
+                if task_id is not None:
+                    self.task_teams.setdefault(task_id, set()).add(team_id)
+            self.completed = {id: completed for id, _, _, completed in task_rows}
+            self.tasks.build(
+                [id for id, _, _, _ in task_rows],
+                [skill_index.mask_of("tasks", id) for id, _, _, _ in task_rows],
+                [self.code(location) for _, location, _, _ in task_rows],
+                [self.code(level) for _, _, level, _ in task_rows],
+                [not completed and id not in self.task_teams for id, _, _, completed in task_rows],
+            )
+            self.teams.build(
+                [id for id, _, _, _ in team_rows],
+                [skill_index.mask_of("teams", id) for id, _, _, _ in team_rows],
+                [self.code(location) for _, location, _, _ in team_rows],
+                [self.code(level) for _, _, level, _ in team_rows],
+                [task_id is None for _, _, _, task_id in team_rows],
+            )
+            self.loaded_at = time.monotonic()
+
+    def task_is_open(self, id: int) -> bool:
+        return not self.completed.get(id, False) and not self.task_teams.get(id)
+
+    def upsert_task(self, id: int, location: str, classification: str, completed: bool):
+        with self.lock:
+            self.completed[id] = completed
+            self.tasks.upsert(id, skill_index.mask_of("tasks", id), self.code(location),
+                              self.code(classification), self.task_is_open(id))
+
+    def remove_task(self, id: int):
+        with self.lock:
+            self.tasks.remove(id)
+            self.completed.pop(id, None)
+            # Teams on a deleted task are released through ON DELETE SET NULL
+            for team_id in self.task_teams.pop(id, set()):
+                self.team_task[team_id] = None
+                self.teams.set_eligible(team_id, True)
+
+    def upsert_team(self, id: int, location: str, classification: str, task_id: Optional[int]):
+        with self.lock:
+            self._assign(id, task_id)
+            self.teams.upsert(id, skill_index.mask_of("teams", id), self.code(location),
+                              self.code(classification), task_id is None)
+
+    def remove_team(self, id: int):
+        with self.lock:
+            self._assign(id, None)
+            self.team_task.pop(id, None)
+            self.teams.remove(id)
+
+    def _assign(self, team_id: int, task_id: Optional[int]):
+        previous = self.team_task.get(team_id)
+        self.team_task[team_id] = task_id
+        if previous == task_id:
+            return
+        if previous is not None:
+            self.task_teams.get(previous, set()).discard(team_id)
+            self.tasks.set_eligible(previous, self.task_is_open(previous))
+        if task_id is not None:
+            self.task_teams.setdefault(task_id, set()).add(team_id)
+            self.tasks.set_eligible(task_id, self.task_is_open(task_id))
+
+    def _rank(self, candidates: FeatureTable, mask: int, location: int, classification: int,
+              limit: int, candidate_is_task: bool) -> List[Tuple[int, float]]:
+        if candidates.ids.shape[0] == 0:
+            return []
+        # Skills no candidate has can't overlap, so the query mask is cut to the table width
+        width = candidates.words.shape[1]
+        words = mask_to_words(mask & ((1 << 64 * width) - 1), width)
+        overlap = popcount_rows(candidates.words & words)
+        # Skill term is the share of the task's skills the team covers
+        if candidate_is_task:
+            required = candidates.skill_counts
+        else:
+            required = np.full(overlap.shape[0], popcount(mask), dtype=np.int32)
+        skill_score = np.divide(overlap, required, out=np.zeros(overlap.shape[0]), where=required > 0)
+        scores = (SKILL_WEIGHT * skill_score
+                  + LOCATION_WEIGHT * (candidates.locations == location)
+                  + CLASSIFICATION_WEIGHT * (candidates.classifications == classification))
+        scores = np.where(candidates.eligible, scores, -1.0)
+
+        limit = min(limit, int(candidates.eligible.sum()))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.lexsort((candidates.ids[top], -scores[top]))]
+        return [(int(candidates.ids[row]), round(float(scores[row]), 4)) for row in top]
+
+    def rank_tasks(self, team: models.Teams, limit: int) -> List[Tuple[int, float]]:
+        with self.lock:
+            return self._rank(self.tasks, skill_index.mask_of("teams", team.id), self.code(team.location),
+                              self.code(team.classificationLevel), limit, candidate_is_task=True)
+
+    def rank_teams(self, task: models.Tasks, limit: int) -> List[Tuple[int, float]]:
+        with self.lock:
+            return self._rank(self.teams, skill_index.mask_of("tasks", task.id), self.code(task.location),
+                              self.code(task.classificationLevel), limit, candidate_is_task=False)
+
+
+recommendations = RecommendationIndex()
+
+
+# Snapshot the row now and apply it to the index once the caller commits
+def track_task(db: AsyncSession, task: models.Tasks):
+    values = (task.id, task.location, task.classificationLevel, bool(task.isCompleted))
+    on_commit(db, lambda: recommendations.upsert_task(*values))
+
+def track_team(db: AsyncSession, team: models.Teams):
+    values = (team.id, team.location, team.classificationLevel, team.task_id)
+    on_commit(db, lambda: recommendations.upsert_team(*values))
+
+def forget_task(db: AsyncSession, id: int):
+    on_commit(db, lambda: recommendations.remove_task(id))
+
+def forget_team(db: AsyncSession, id: int):
+    on_commit(db, lambda: recommendations.remove_team(id))
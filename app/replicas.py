@@ -0,0 +1,109 @@
+import asyncio
+import itertools
+import time
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import text
+
+from .config import settings
+from .database import SessionLocal, make_engine, make_sessionmaker, pool_stats
+
+# Set on responses to writes, reads carrying it go to the primary until it expires
+READ_YOUR_WRITES_COOKIE = "tb_read_primary"
+# Request state flag sending the request's reads to the primary, see ResponseCacheMiddleware
+READ_PRIMARY = "read_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Seconds since the last replayed transaction, 0 when fully caught up or not a standby
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+def async_url(url: str) -> str:
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    return url
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = make_engine(async_url(url))
+        self.sessions = make_sessionmaker(self.engine)
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+
+    async def check(self):
+        try:
+            async with self.engine.connect() as connection:
+                lag = await asyncio.wait_for(connection.scalar(REPLICA_LAG_QUERY), settings.DATABASE_REPLICA_CHECK_INTERVAL)
+            self.lag = float(lag)
+            self.healthy = self.lag <= settings.DATABASE_REPLICA_MAX_LAG
+            self.error = None
+        except Exception as e:
+            self.healthy = False
+            self.error = str(e)
+        self.checked_at = time.time()
+
+
+class ReplicaSet:
+    # Round-robins reads over replicas that passed their last health check
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(url) for url in urls]
+        self.turns = itertools.count()
+
+    def pick(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self.turns) % len(healthy)]
+
+    async def check(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(settings.DATABASE_REPLICA_CHECK_INTERVAL)
+            await self.check()
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def stats(self) -> list:
+        return [{
+            "host": f"{replica.engine.url.host}:{replica.engine.url.port}",
+            "healthy": replica.healthy,
+            "lag": replica.lag,
+            "error": replica.error,
+            "checkedAt": replica.checked_at,
+            "pool": pool_stats(replica.engine),
+        } for replica in self.replicas]
+
+
+replicas = ReplicaSet([url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()])
+
+
+# Sessions for read-only work: a healthy replica unless the client wrote recently or the
+# response is going into the shared cache
+def read_sessions(request: Request):
+    primary = request.cookies.get(READ_YOUR_WRITES_COOKIE) or getattr(request.state, READ_PRIMARY, False)
+    replica = None if primary else replicas.pick()
+    return replica.sessions if replica else SessionLocal
+
+async def get_read_db(request: Request):
+    async with read_sessions(request)() as db:
+        yield db
+
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, "1", max_age=settings.READ_YOUR_WRITES_WINDOW, httponly=True, samesite="lax")
+    return response
@@ -0,0 +1,21 @@
+from fastapi import Response, status, Depends, APIRouter, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas
+from ..database import get_db
+from ..batch import run_batch
+from ..metrics import InstrumentedRoute
+
+router = APIRouter(
+    prefix="/batch",
+    tags=['Batch'],
+    route_class=InstrumentedRoute
+)
+
+# Run many API calls in one transaction, e.g. {"operations": [{"method": "PATCH", "path": "/teams/3", "body": {...}}, ...]}
+@router.post("", response_model=schemas.BatchResult)
+async def batch(batch: schemas.Batch, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    result = await run_batch(request, db, batch.operations, batch.atomic)
+    if not result["committed"]:
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    return result
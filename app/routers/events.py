@@ -0,0 +1,56 @@
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+
+from app.events import PING, RESET, broker, encode, parse_topics, sse_stream
+from app.config import settings
+from app.metrics import InstrumentedRoute
+
+router = APIRouter(
+    prefix="/events",
+    tags=['Events'],
+    route_class=InstrumentedRoute
+)
+
+# Live changes as Server-Sent Events, ?topics=teams,tasks filters and Last-Event-ID or ?after= resumes
+@router.get("")
+async def stream_events(topics: Optional[str] = None, after: Optional[int] = Query(None, ge=0),
+                        lastEventId: Optional[str] = Header(None, alias="Last-Event-ID")):
+    try:
+        selected = parse_topics(topics)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if after is None and lastEventId and lastEventId.isdigit():
+        after = int(lastEventId)
+    return StreamingResponse(sse_stream(selected, after), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# The same events over a WebSocket, one JSON message each
+@router.websocket("")
+async def events_socket(websocket: WebSocket, topics: Optional[str] = None, after: Optional[int] = Query(None, ge=0)):
+    try:
+        selected = parse_topics(topics)
+    except ValueError as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+        return
+    await websocket.accept()
+    # Clients don't send anything, reading is only how a close is noticed between events
+    closed = asyncio.create_task(wait_closed(websocket))
+    try:
+        with broker.subscribe(selected, after) as subscription:
+            async for event in subscription.events(settings.EVENTS_HEARTBEAT):
+                if closed.done():
+                    return
+                await websocket.send_text(encode(event or PING))
+            # Fell too far behind, the client reconnects with ?after= its last seq
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason=RESET)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.cancel()
+
+async def wait_closed(websocket: WebSocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Path, Query, Request
+from fastapi.responses import StreamingResponse
+
+from app.export import EXPORT_FORMATS, FORMAT_PATTERN, export_rows, gzip_chunks
+from app.replicas import read_sessions
+from app.metrics import InstrumentedRoute
+
+router = APIRouter(
+    prefix="/export",
+    tags=['Export'],
+    route_class=InstrumentedRoute
+)
+
+# Stream every team (with members), task (with teams) or member as NDJSON or CSV
+@router.get("/{kind}")
+async def export(request: Request, kind: str = Path(..., pattern="^(teams|tasks|members)$"), format: str = Query("ndjson", pattern=FORMAT_PATTERN)):
+    headers = {"Content-Disposition": f'attachment; filename="{kind}.{format}"', "Vary": "Accept-Encoding"}
+    chunks = export_rows(read_sessions(request), kind, format)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=EXPORT_FORMATS[format], headers=headers)
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+
+from app.database import pool_stats
+from app.replicas import replicas
+from app.metrics import InstrumentedRoute
+
+router = APIRouter(
+    prefix="/health",
+    tags=['Health'],
+    route_class=InstrumentedRoute
+)
+
+# Connection pool usage and checkout wait times for this worker
+@router.get("/pool")
+def get_pool_stats():
+    return pool_stats()
+
+# Replica health, replication lag and pool usage as of the last check
+@router.get("/replicas")
+def get_replica_stats():
+    return replicas.stats()
@@ -0,0 +1,33 @@
+from fastapi import status, HTTPException, Depends, APIRouter
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from ..database import get_db, commit, on_commit
+from ..replicas import get_read_db
+from ..matchmaking import matchmaker
+from ..idempotency import idempotent
+from ..metrics import InstrumentedRoute
+
+router = APIRouter(
+    prefix="/matchmaking",
+    tags=['Matchmaking'],
+    route_class=InstrumentedRoute
+)
+
+# Ask to be placed on any open team, poll the entry until it is assigned
+@router.post("/queue", status_code=status.HTTP_201_CREATED, response_model=schemas.ReturnQueueEntry, dependencies=[Depends(idempotent)])
+async def join_queue(request: schemas.QueueMember, db: AsyncSession = Depends(get_db)):
+    entry = await db.scalar(pg_insert(models.JoinRequests).values(**request.model_dump()).returning(models.JoinRequests))
+    on_commit(db, matchmaker.wake.set)
+    await commit(db)
+    return entry
+
+# Get a queue entry by id
+@router.get("/queue/{id}", response_model=schemas.ReturnQueueEntry)
+async def get_queue_entry(id: int, db: AsyncSession = Depends(get_read_db)):
+    entry = await db.scalar(select(models.JoinRequests).where(models.JoinRequests.id == id))
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Queue entry with id: {id} does not exist.")
+    return entry
@@ -1,54 +1,74 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Body
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Body, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 
-from sqlalchemy import func
-from sqlalchemy.sql.functions import func
+from sqlalchemy import delete, select
 from  .. import models, schemas
-from app.database import get_db
+from app.database import get_db, commit
+from app.replicas import get_read_db
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
+from app.search import MATCH_PATTERN, SORT_PATTERN, apply_search
+from app.skills import forget_skills
+from app.cache import invalidate, team_tags
+from app.bulk import import_members, read_rows
+from app.metrics import InstrumentedRoute
+from app.responses import render
+from app.fieldsets import FieldSet
+from app.events import emit
+from app.matchmaking import refresh_needs_members
 
 router = APIRouter(
     prefix="/members",
-    tags=['Members']
+    tags=['Members'],
+    route_class=InstrumentedRoute
 )
 
 # Get all members
 @router.get("/", response_model=List[schemas.ReturnMember])
-def get_members(db: Session = Depends(get_db), limit: int = 10, skip: int = 0, search: Optional[str] = ""):
-    members = db.query(models.Members).filter(models.Members.name.contains(search)).limit(limit).offset(skip).all()
+async def get_members(response: Response, db: AsyncSession = Depends(get_read_db), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      cursor: Optional[str] = None, skip: int = Query(0, ge=0, deprecated=True), search: Optional[str] = "",
+                      match: str = Query("all", pattern=MATCH_PATTERN), sort: str = Query("created", pattern=SORT_PATTERN),
+                      fields: Optional[str] = None):
+    fieldset = FieldSet.parse("members", fields, None)
+    query = select(models.Members).options(*fieldset.options())
+    query, order_by = apply_search(query, models.Members.name, search, match, sort)
+    members = await paginate(db, query, models.Members, response, limit, cursor, skip, order_by)
 
-    return members
+    return render(fieldset.adapter(), members, response)
 
 # Get members by id
 @router.get("/{id}", response_model=schemas.ReturnMember)
-def get_member(id: int, db: Session = Depends(get_db)):
-    member = db.query(models.Members).filter(models.Members.id == id).first()
-    teamNameQuery = db.query(models.Teams.name).join(models.Members, models.Members.team_id == models.Teams.id, isouter=True).first()
-    teamName = teamNameQuery[0]
-    teamNamejson = {
-        "teamName": teamName
-    }
+async def get_member(id: int, db: AsyncSession = Depends(get_read_db)):
+    member = await db.scalar(select(models.Members).where(models.Members.id == id))
     if not member:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id: {id} does not exist.")
-    return member, teamNamejson
+    return member
 
 
+# Bulk import members
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=schemas.BulkResult)
+async def bulk_members(request: Request, response: Response, atomic: bool = Query(False), db: AsyncSession = Depends(get_db)):
+    result = await import_members(db, await read_rows(request), atomic)
+    if atomic and result["failed"]:
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    return render(schemas.BulkResults, result, response, status.HTTP_201_CREATED)
+
 # Delete a member
 @router.put("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_member(id: int, request_body: schemas.DeleteTeam = Body(...), db: Session = Depends(get_db)):
-    memberQuery = db.query(models.Members).filter(models.Members.id == id)
-    member = memberQuery.first()
-
-    captainCodeQuery = db.query(models.Teams.captainCode).filter(models.Teams.id == id)
-    captainCodeResult = captainCodeQuery.first()
-    captainCode = captainCodeResult[0]
+async def delete_member(id: int, request_body: schemas.DeleteTeam = Body(...), db: AsyncSession = Depends(get_db)):
+    # DELETE ... USING teams checks the captain code in the same statement
+    member = (await db.execute(delete(models.Members.__table__)
+                               .where(models.Members.id == id, models.Members.team_id == models.Teams.id, models.Teams.captainCode == request_body.captainCode)
+                               .returning(models.Members.team_id, models.Teams.task_id))).first()
 
     if member is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Member with id: {id} does not exist.")
-
-    if captainCode != request_body.captainCode:
+        if await db.scalar(select(models.Members.id).where(models.Members.id == id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Member with id: {id} does not exist.")
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid captain code.")
 
-    memberQuery.delete(synchronize_session=False)
-    db.commit()
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    forget_skills(db, "members", id)
+    needsMembers = (await refresh_needs_members(db, [member.team_id]))[member.team_id]
+    await emit(db, "member.left", id=id, team_id=member.team_id, needsMembers=needsMembers)
+    await commit(db)
+    await invalidate(*team_tags(member.team_id, member.task_id))
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.database import pool_stats
+from app.metrics import registry
+from app.replicas import replicas
+
+router = APIRouter(
+    tags=['Metrics']
+)
+
+# Prometheus scrape endpoint, counts are per worker process
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    pools = {"primary": pool_stats()}
+    for replica in replicas.stats():
+        pools[replica["host"]] = replica["pool"]
+    return PlainTextResponse(registry.render(pools), media_type="text/plain; version=0.0.4")
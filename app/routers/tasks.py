@@ -1,196 +1,205 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Body, File, UploadFile
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional, Tuple
-import random
-import string
-import os
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Body, File, UploadFile, Query, Request
+from sqlalchemy import delete, select, update as sql_update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import List, Optional
 from .. import models, schemas
-from ..database import get_db
-from ..security import generate_filename
+from ..database import get_db, commit
+from ..idempotency import idempotent
+from ..replicas import get_read_db
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
+from ..search import MATCH_PATTERN, SORT_PATTERN, apply_search
+from ..skills import forget_skills, sync_skills
+from ..recommend import forget_task, recommendations, track_task, track_team
+from ..uploads import save_image
+from ..thumbnails import schedule_derivatives
+from ..images import forget_image, serve_image
+from ..cache import invalidate, task_tags
+from ..bulk import import_tasks, read_rows
+from ..codes import insert_with_code
+from ..metrics import InstrumentedRoute
+from ..responses import render
+from ..fieldsets import FieldSet
+from ..events import emit
+from ..sync import changes
 
 router = APIRouter(
     prefix="/tasks",
-    tags=['Tasks']
+    tags=['Tasks'],
+    route_class=InstrumentedRoute
 )
 
-DISALLOWED_EXTENSIONS = ['.py', '.php', '.exe', '.sh']
-ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png"]
-MAX_IMAGE_SIZE = 5 * 1024 * 1024
-# Change in production environment to something outside of the backends root directory
-IMAGEDIR = os.getcwd()
-
-def contains_disallowed_extension(filename: str) -> bool:
-    filename_lower = filename.lower()
-    for ext in DISALLOWED_EXTENSIONS:
-        print(ext)
-        if ext in filename_lower:
-            return True
-    return False
-    
-def validate_upload_file(contents: bytes, photo: UploadFile) -> Tuple[bytes, str]:
-    if contents is None or len(contents) == 0:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No file uploaded.")
-    if contains_disallowed_extension(photo.filename) == True:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"No, No, No!")
-    if len(contents) > MAX_IMAGE_SIZE:
-        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"{photo.filename} is too large.")
-    if photo.content_type not in ALLOWED_IMAGE_TYPES:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{photo.filename} file type is not valid.")
-    if ".." in photo.filename or photo.filename.startswith("/"):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image name.")
-
-    return contents, photo.filename
-
-def save_image_to_disk(contents: bytes, filename: str, task_name: str) -> str:
-    image_dir = os.path.join(IMAGEDIR, f"images/{task_name}")
-    if not os.path.exists(image_dir):
-        os.makedirs(image_dir)
-    new_filename = generate_filename(filename, task_name)
-    file_path = os.path.join(image_dir, new_filename)
-    with open(file_path, "wb") as file:
-        file.write(contents)
-    return new_filename
+# ReturnTask nests teams and their members, which can't be lazy loaded under asyncio
+TASK_TEAMS = joinedload(models.Tasks.teams).joinedload(models.Teams.members)
 
 # Get all tasks
 @router.get("/", response_model=List[schemas.ReturnTask])
-def get_tasks(db: Session = Depends(get_db), limit: int = 10, skip: int = 0, search: Optional[str] = ""):
-    query = db.query(models.Tasks).options(joinedload(models.Tasks.teams))
-    if search:
-        tasks = query.filter(models.Tasks.preferredSkillsets.contains(search)).limit(limit).offset(skip).all()
-        return tasks
-    else:
-        tasks = query.all()
-        return tasks
+async def get_tasks(response: Response, db: AsyncSession = Depends(get_read_db), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    cursor: Optional[str] = None, skip: int = Query(0, ge=0, deprecated=True), search: Optional[str] = "",
+                    match: str = Query("all", pattern=MATCH_PATTERN), sort: str = Query("created", pattern=SORT_PATTERN),
+                    fields: Optional[str] = None, include: Optional[str] = None):
+    fieldset = FieldSet.parse("tasks", fields, include)
+    query = select(models.Tasks).options(*fieldset.options())
+    query, order_by = apply_search(query, models.Tasks.preferredSkillsets, search, match, sort)
+    tasks = await paginate(db, query, models.Tasks, response, limit, cursor, skip, order_by)
+    await fieldset.load(db, tasks)
+    return render(fieldset.adapter(), tasks, response)
 
 # Get completed tasks
-@router.get("/completed", response_model=schemas.ReturnTask)
-def get_completed(db: Session = Depends(get_db), limit: int = 10, skip: int = 0, search: Optional[str] = ""):
-    completedTask = db.query(models.Tasks).filter(models.Tasks.isCompleted == 'true').filter(models.Tasks.preferredSkillsets.contains(search)).limit(limit).offset(skip).all()
-    return completedTask
+@router.get("/completed", response_model=List[schemas.ReturnTask])
+async def get_completed(response: Response, db: AsyncSession = Depends(get_read_db), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        cursor: Optional[str] = None, skip: int = Query(0, ge=0, deprecated=True), search: Optional[str] = "",
+                        match: str = Query("all", pattern=MATCH_PATTERN), sort: str = Query("created", pattern=SORT_PATTERN),
+                        fields: Optional[str] = None, include: Optional[str] = None):
+    fieldset = FieldSet.parse("tasks", fields, include)
+    query = select(models.Tasks).options(*fieldset.options()).where(models.Tasks.isCompleted == True)
+    query, order_by = apply_search(query, models.Tasks.preferredSkillsets, search, match, sort)
+    completedTasks = await paginate(db, query, models.Tasks, response, limit, cursor, skip, order_by)
+    await fieldset.load(db, completedTasks)
+    return render(fieldset.adapter(), completedTasks, response)
+
+# Tasks changed since ?since=<token> and ids of deleted ones, follow the returned token while more is true
+@router.get("/changes", response_model=schemas.TaskChanges)
+async def get_task_changes(response: Response, db: AsyncSession = Depends(get_read_db), since: Optional[str] = None,
+                           limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    taskChanges = await changes(db, models.Tasks, "tasks", since, limit, [selectinload(models.Tasks.teams).selectinload(models.Teams.members)])
+    return render(schemas.TaskChangeList, taskChanges, response)
 
 # Get task photo
 @router.get("/images/{id}")
-async def get_task_image(id: int, db: Session = Depends(get_db)):
-    task = db.query(models.Tasks).filter(models.Tasks.id == id).first()
-    if not task or not task.pictureName:  
-        raise HTTPException(status_code=404, detail="Image not found")
-
-    image_dir = os.path.join(IMAGEDIR, f"images/{task.name}")
-    file_path = os.path.join(image_dir, task.pictureName)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unable to find {task.pictureName}")
-    return FileResponse(file_path)
+async def get_task_image(id: int, request: Request, db: AsyncSession = Depends(get_read_db), size: Optional[int] = Query(None, ge=1)):
+    return await serve_image(request, db, models.Tasks, "tasks", id, size)
 
 # Get tasks by id
 @router.get("/{id}", response_model=schemas.ReturnTask)
-def get_task(id: int, db: Session = Depends(get_db), limit: int = 10, skip: int = 0, search: Optional[str] = ""):
-    taskQuery = db.query(models.Tasks).where(models.Tasks.id == id).first()
-    if taskQuery is None:
+async def get_task(id: int, db: AsyncSession = Depends(get_read_db)):
+    task = await db.scalar(select(models.Tasks).options(TASK_TEAMS).where(models.Tasks.id == id))
+    if task is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task with id: {id} not found.")
-    else:
-        task = db.query(models.Tasks).options(joinedload(models.Tasks.teams)).filter(models.Tasks.id == id).first()
     return task
 
+# Get recommended teams for a task
+@router.get("/{id}/recommended-teams", response_model=List[schemas.RecommendedTeam])
+async def get_recommended_teams(id: int, db: AsyncSession = Depends(get_read_db), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    task = await db.scalar(select(models.Tasks).where(models.Tasks.id == id))
+    if task is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task with id: {id} not found.")
+    await recommendations.ensure_loaded(db)
+    ranked = recommendations.rank_teams(task, limit)
+    teams = (await db.scalars(select(models.Teams).options(joinedload(models.Teams.members))
+                              .where(models.Teams.id.in_([team_id for team_id, _ in ranked])))).unique().all()
+    teamsById = {team.id: team for team in teams}
+    return render(schemas.RecommendedTeamList, [{"score": score, "team": teamsById[team_id]} for team_id, score in ranked if team_id in teamsById])
+
 # Create tasks
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.ReturnCreatedTask)
-def create_tasks(task: schemas.CreateTask, db: Session = Depends(get_db)):
-    # Function to generate a taskCode
-    def taskCodeGenerator(length=6):
-        chars = string.ascii_letters
-        taskCode = ''.join(random.choice(chars) for _ in range(length))
-        return taskCode
-    taskCode = taskCodeGenerator(length=6)
-    existingTask = db.query(models.Tasks.name).all()
-
-    # Create a new task entry
-    newTaskData = task.dict()
-    newTask = models.Tasks(**newTaskData, taskCode=taskCode)
-    
-    # Check to see if team already exists
-    for i in existingTask:
-        if task.name == i[0]:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Sorry, a team with name {newTask.name} already exists.")
-    
-    db.add(newTask)
-    db.commit()
-    db.refresh(newTask)
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.ReturnCreatedTask, dependencies=[Depends(idempotent)])
+async def create_tasks(task: schemas.CreateTask, db: AsyncSession = Depends(get_db)):
+    # Single INSERT, the unique name is enforced by the database
+    newTask = await insert_with_code(db, models.Tasks, task.model_dump(), "taskCode")
+    if newTask is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Sorry, a task with name {task.name} already exists.")
+    await sync_skills(db, "tasks", newTask.id, newTask.preferredSkillsets)
+    track_task(db, newTask)
+    await emit(db, "task.created", id=newTask.id, name=newTask.name, isCompleted=newTask.isCompleted)
+    await commit(db)
+    await invalidate(*task_tags(newTask.id))
+    set_committed_value(newTask, "teams", [])
     return newTask
 
+# Bulk import tasks
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=schemas.BulkResult)
+async def bulk_tasks(request: Request, response: Response, atomic: bool = Query(False), db: AsyncSession = Depends(get_db)):
+    result = await import_tasks(db, await read_rows(request), atomic)
+    if atomic and result["failed"]:
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    return render(schemas.BulkResults, result, response, status.HTTP_201_CREATED)
+
 # Upload task photo
 @router.post("/images/{id}", status_code=status.HTTP_202_ACCEPTED)
-async def upload_tasks_photo(id: int, photo: UploadFile = File(...), db: Session = Depends(get_db)):
-    task = db.query(models.Tasks).filter(models.Tasks.id == id).first()
+async def upload_tasks_photo(id: int, photo: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    task = await db.scalar(select(models.Tasks).where(models.Tasks.id == id))
     if not task:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task not found")
-    contents = await photo.read()
-    validate_upload_file(contents, photo)
-    new_filename = save_image_to_disk(contents, photo.filename, task.name)
-    task.pictureName = new_filename
+    upload = await save_image(photo)
+    task.pictureName = upload["filename"]
     db.add(task)
-    db.commit()
-    return {"detail": f"Successfully uploaded {photo.filename} for {task.name}"}
+    await commit(db)
+    forget_image("tasks", id)
+    schedule_derivatives(upload["filename"])
+    return {"detail": f"Successfully uploaded {photo.filename} for {task.name}", "size": upload["size"], "bytesPerSecond": upload["bytesPerSecond"]}
 
 # Update task by id 
 @router.patch("/{id}", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.ReturnTask)
-def update_task(id: int, update: schemas.UpdateTask = Body(...), db: Session = Depends(get_db)):
-    taskName= db.query(models.Tasks.name).filter(models.Tasks.id == id).first()
-    taskCode = db.query(models.Tasks.taskCode).filter(models.Tasks.id == id).first()
-    taskQuery = db.query(models.Tasks).filter(models.Tasks.id == id)
-    taskUpdate = update.dict(exclude_unset=True, exclude_none=True)
-    task = taskQuery.first()
-
-    if task == None:
-        raise HTTPException(status_code=404, detail=f"{taskName} not found")
-    
-    if taskCode[0] != update.taskCode:
+async def update_task(id: int, update: schemas.UpdateTask = Body(...), db: AsyncSession = Depends(get_db)):
+    taskUpdate = update.model_dump(exclude_unset=True, exclude_none=True, exclude={"taskCode"})
+    matches = (models.Tasks.id == id, models.Tasks.taskCode == update.taskCode)
+
+    # The task code check is part of the UPDATE, so a match is one round trip
+    try:
+        if taskUpdate:
+            task = await db.scalar(sql_update(models.Tasks).where(*matches).values(**taskUpdate).returning(models.Tasks))
+        else:
+            task = await db.scalar(select(models.Tasks).where(*matches))
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Sorry, a task with name {update.name} already exists.")
+
+    if task is None:
+        if await db.scalar(select(models.Tasks.id).where(models.Tasks.id == id)) is None:
+            raise HTTPException(status_code=404, detail=f"Task with id: {id} not found")
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Task code was invalid.")
-    else:
-        taskQuery.update(taskUpdate)
-        db.commit()
-        
-        return task
+
+    if "preferredSkillsets" in taskUpdate:
+        await sync_skills(db, "tasks", id, taskUpdate["preferredSkillsets"])
+    track_task(db, task)
+    await emit(db, "task.completed" if taskUpdate.get("isCompleted") else "task.updated", id=id, name=task.name, isCompleted=task.isCompleted)
+    await commit(db)
+    await invalidate(*task_tags(id))
+    forget_image("tasks", id)
+    return await db.scalar(select(models.Tasks).options(TASK_TEAMS).where(models.Tasks.id == id).execution_options(populate_existing=True))
 
 # Delete a task
 @router.put("/delete/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_task(id: int, request_body: schemas.DeleteTask = Body(...), db: Session = Depends(get_db)):
-    taskQuery = db.query(models.Tasks).filter(models.Tasks.id == id)
-    task = taskQuery.first()
-
-    taskCodeQuery = db.query(models.Tasks.taskCode).filter(models.Tasks.id == id)
-    taskCodeResult = taskCodeQuery.first()
-    taskCode = taskCodeResult[0]
-
-    if task is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task with id: {id} does not exist.")
+async def delete_task(id: int, request_body: schemas.DeleteTask = Body(...), db: AsyncSession = Depends(get_db)):
+    deleted = await db.scalar(delete(models.Tasks).where(models.Tasks.id == id, models.Tasks.taskCode == request_body.taskCode).returning(models.Tasks.id))
 
-    if taskCode != request_body.taskCode:
+    if deleted is None:
+        if await db.scalar(select(models.Tasks.id).where(models.Tasks.id == id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task with id: {id} does not exist.")
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid task code.")
 
-    taskQuery.delete(synchronize_session=False)
-    db.commit()
+    forget_skills(db, "tasks", id)
+    forget_task(db, id)
+    await emit(db, "task.deleted", id=id)
+    await commit(db)
+    forget_image("tasks", id)
+    await invalidate(*task_tags(id))
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 # Join a task
-@router.post("/{id}/join", status_code=status.HTTP_201_CREATED, response_model=schemas.ReturnTask)
-def join_task(id: int, join: schemas.JoinTask, db: Session = Depends(get_db)):
-    task = db.query(models.Tasks).filter(models.Tasks.id == id).first()
-    team = db.query(models.Teams).filter(models.Teams.name == join.team_name).first()
+@router.post("/{id}/join", status_code=status.HTTP_201_CREATED, response_model=schemas.ReturnTask, dependencies=[Depends(idempotent)])
+async def join_task(id: int, join: schemas.JoinTask, db: AsyncSession = Depends(get_db)):
+    # Assign in one UPDATE guarded by every check, the lookups below only run to explain a refusal
+    taskExists = select(models.Tasks.id).where(models.Tasks.id == id).exists()
+    team = await db.scalar(sql_update(models.Teams)
+                           .where(models.Teams.name == join.team_name, models.Teams.captainCode == join.captainCode,
+                                  models.Teams.task_id.is_(None), taskExists)
+                           .values(task_id=id).returning(models.Teams))
 
     if team is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Team was not found.")
-    if team.task_id != None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Team is already assigned to a task, please delete/complete previous task before selecting a new one.")
-    if task is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{task} does not exist.")
-    if team.captainCode != join.captainCode:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"You have enterd the wrong captain code for {team}")
-    if task is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{task.name} does not exist.")
-    if team.captainCode != join.captainCode:
+        existing = await db.scalar(select(models.Teams).where(models.Teams.name == join.team_name))
+        if existing is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Team was not found.")
+        if existing.task_id != None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Team is already assigned to a task, please delete/complete previous task before selecting a new one.")
+        if await db.scalar(select(models.Tasks.id).where(models.Tasks.id == id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task with id: {id} does not exist.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"You entered the wrong Captain Code.")
-    
-    team.task_id = id
-    db.commit()
-    db.refresh(team)
-    return task
\ No newline at end of file
+
+    track_team(db, team)
+    await emit(db, "task.joined", id=id, team_id=team.id)
+    await commit(db)
+    await invalidate(*task_tags(id))
+    task = await db.scalar(select(models.Tasks).options(TASK_TEAMS).where(models.Tasks.id == id).execution_options(populate_existing=True))
+    return task
@@ -1,177 +1,211 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Body, File, UploadFile
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional, Tuple
-import random
-import string
-import os
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Body, File, UploadFile, Query, Request
+from sqlalchemy import delete, func, select, update as sql_update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import List, Optional
 from .. import models, schemas
-from ..database import get_db
-from ..security import generate_filename
+from ..database import get_db, commit
+from ..idempotency import idempotent
+from ..replicas import get_read_db
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
+from ..search import MATCH_PATTERN, SORT_PATTERN, apply_search
+from ..skills import forget_skills, parse_skills, sync_skills
+from ..recommend import forget_team, normalize, recommendations, track_team
+from ..formation import form_teams_in_pool
+from ..cache import invalidate, team_tags
+from ..uploads import save_image
+from ..thumbnails import schedule_derivatives
+from ..images import forget_image, serve_image
+from ..bulk import import_teams, read_rows
+from ..codes import insert_with_code
+from ..metrics import InstrumentedRoute
+from ..responses import render
+from ..fieldsets import FieldSet
+from ..events import emit
+from ..sync import changes
+from ..matchmaking import join_team, refresh_needs_members
 
 
 router = APIRouter(
     prefix="/teams",
-    tags=['Teams']
+    tags=['Teams'],
+    route_class=InstrumentedRoute
 )
-DISALLOWED_EXTENSIONS = ['.py', '.php', '.exe', '.sh']
-ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png"]
-MAX_IMAGE_SIZE = 5 * 1024 * 1024
-# Change in production environment to something outside of the backends root directory
-IMAGEDIR = os.getcwd()
-
-def contains_disallowed_extension(filename: str) -> bool:
-    filename_lower = filename.lower()
-    for ext in DISALLOWED_EXTENSIONS:
-        if ext in filename_lower:
-            return True
-    return False
-    
-def validate_upload_file(contents: bytes, photo: UploadFile) -> Tuple[bytes, str]:
-    if contents is None or len(contents) == 0:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No file uploaded.")
-    if contains_disallowed_extension(photo.filename) == True:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"No, No, No!")
-    if len(contents) > MAX_IMAGE_SIZE:
-        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"{photo.filename} is too large.")
-    if photo.content_type not in ALLOWED_IMAGE_TYPES:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{photo.filename} file type is not valid.")
-    if ".." in photo.filename or photo.filename.startswith("/"):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image name.")
-
-    return contents, photo.filename
-
-def save_image_to_disk(contents: bytes, filename: str, team_name: str) -> str:
-    image_dir = os.path.join(IMAGEDIR, f"images/{team_name}")
-    if not os.path.exists(image_dir):
-        os.makedirs(image_dir)
-    new_filename = generate_filename(filename, team_name)
-    file_path = os.path.join(image_dir, new_filename)
-    with open(file_path, "wb") as file:
-        file.write(contents)
-    return new_filename
 
 # Get all teams
 @router.get("/", response_model=List[schemas.ReturnTeam])
-def get_teams(db: Session = Depends(get_db), limit: int = 10, skip: int = 0, search: Optional[str] = ""):
-    query = db.query(models.Teams).options(joinedload(models.Teams.members))
-    if search:
-        teams = query.filter(models.Teams.preferredSkillsets.contains(search)).limit(limit).offset(skip).all()
-        return teams
-    else:
-        teams = query.all()
-        return teams
+async def get_teams(response: Response, db: AsyncSession = Depends(get_read_db), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    cursor: Optional[str] = None, skip: int = Query(0, ge=0, deprecated=True), search: Optional[str] = "",
+                    match: str = Query("all", pattern=MATCH_PATTERN), sort: str = Query("created", pattern=SORT_PATTERN),
+                    fields: Optional[str] = None, include: Optional[str] = None):
+    # ?fields=name,members.name picks columns, ?include=members or members:3 picks what is embedded
+    fieldset = FieldSet.parse("teams", fields, include)
+    query = select(models.Teams).options(*fieldset.options())
+    query, order_by = apply_search(query, models.Teams.preferredSkillsets, search, match, sort)
+    teams = await paginate(db, query, models.Teams, response, limit, cursor, skip, order_by)
+    await fieldset.load(db, teams)
+    return render(fieldset.adapter(), teams, response)
+
+# Teams changed since ?since=<token> and ids of deleted ones, follow the returned token while more is true
+@router.get("/changes", response_model=schemas.TeamChanges)
+async def get_team_changes(response: Response, db: AsyncSession = Depends(get_read_db), since: Optional[str] = None,
+                           limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    teamChanges = await changes(db, models.Teams, "teams", since, limit, [selectinload(models.Teams.members)])
+    return render(schemas.TeamChangeList, teamChanges, response)
 
 # Get teams photo
 @router.get("/images/{id}")
-async def get_team_image(id: int, db: Session = Depends(get_db)):
-    team = db.query(models.Teams).filter(models.Teams.id == id).first()
-    if not team or not team.pictureName:  
-        raise HTTPException(status_code=404, detail="Image not found")
-
-    image_dir = os.path.join(IMAGEDIR, f"images/{team.name}")
-    file_path = os.path.join(image_dir, team.pictureName)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unable to find {team.pictureName}")
-    return FileResponse(file_path)
+async def get_team_image(id: int, request: Request, db: AsyncSession = Depends(get_read_db), size: Optional[int] = Query(None, ge=1)):
+    return await serve_image(request, db, models.Teams, "teams", id, size)
 
 # Get team by id
 @router.get("/{id}", response_model=schemas.ReturnTeam)
-def get_team(id: int, db: Session = Depends(get_db)):
-    team = db.query(models.Teams).options(joinedload(models.Teams.members)).filter(models.Teams.id == id).first()
+async def get_team(id: int, db: AsyncSession = Depends(get_read_db)):
+    team = await db.scalar(select(models.Teams).options(joinedload(models.Teams.members)).where(models.Teams.id == id))
+    if team is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Team with id: {id} does not exist.")
     return team
 
+# Get recommended tasks for a team
+@router.get("/{id}/recommended-tasks", response_model=List[schemas.RecommendedTask])
+async def get_recommended_tasks(id: int, db: AsyncSession = Depends(get_read_db), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    team = await db.scalar(select(models.Teams).where(models.Teams.id == id))
+    if team is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Team with id: {id} does not exist.")
+    await recommendations.ensure_loaded(db)
+    ranked = recommendations.rank_tasks(team, limit)
+    tasks = (await db.scalars(select(models.Tasks).options(joinedload(models.Tasks.teams).joinedload(models.Teams.members))
+                              .where(models.Tasks.id.in_([task_id for task_id, _ in ranked])))).unique().all()
+    tasksById = {task.id: task for task in tasks}
+    return render(schemas.RecommendedTaskList, [{"score": score, "task": tasksById[task_id]} for task_id, score in ranked if task_id in tasksById])
+
 # Create teams
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.ReturnCreatedTeam)
-def create_team(team: schemas.CreateTeam, db: Session = Depends(get_db)):
-    # Function to generate a captainCode
-    def captainCodeGenerator(length=6):
-        chars = string.ascii_letters
-        captainCode = ''.join(random.choice(chars) for _ in range(length))
-        return captainCode
-    captainCode = captainCodeGenerator(length=6)
-    existingTeams = db.query(models.Teams.name).all()
-
-
-    # Create a new team entry
-    newTeamData = team.dict(exclude={"captain"})
-    newTeam = models.Teams(**newTeamData, captainCode=captainCode)
-    
-    # Check to see if team already exists
-    for i in existingTeams:
-        if team.name == i[0]:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Sorry, a team with name {team.name} already exists.")
-    
-    db.add(newTeam)
-    db.commit()
-    db.refresh(newTeam)
-
-    captainData = team.captain.dict()
-    newMember = models.Members(**captainData, team_id=newTeam.id)
-    db.add(newMember)
-    db.commit()
-    db.refresh(newMember)
-    return newTeam 
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.ReturnCreatedTeam, dependencies=[Depends(idempotent)])
+async def create_team(team: schemas.CreateTeam, db: AsyncSession = Depends(get_db)):
+    # Team and captain go in with one INSERT each and a single commit, the unique name is enforced by the database
+    # The captain is the first member, a team of one is full from the start
+    newTeam = await insert_with_code(db, models.Teams, {**team.model_dump(exclude={"captain"}), "needsMembers": team.maxMembers > 1}, "captainCode")
+    if newTeam is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Sorry, a team with name {team.name} already exists.")
+    newMember = await db.scalar(pg_insert(models.Members).values(**team.captain.model_dump(), team_id=newTeam.id).returning(models.Members))
+    await sync_skills(db, "teams", newTeam.id, newTeam.preferredSkillsets)
+    await sync_skills(db, "members", newMember.id, newMember.skillsets)
+    track_team(db, newTeam)
+    await emit(db, "team.created", id=newTeam.id, name=newTeam.name, needsMembers=newTeam.needsMembers, task_id=None)
+    await commit(db)
+    await invalidate(*team_tags(newTeam.id))
+    set_committed_value(newTeam, "members", [newMember])
+    return newTeam
+
+# Bulk import teams
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=schemas.BulkResult)
+async def bulk_teams(request: Request, response: Response, atomic: bool = Query(False), db: AsyncSession = Depends(get_db)):
+    result = await import_teams(db, await read_rows(request), atomic)
+    if atomic and result["failed"]:
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    return render(schemas.BulkResults, result, response, status.HTTP_201_CREATED)
+
+# Automatically form teams from a pool of members
+@router.post("/auto-form", response_model=schemas.ReturnFormedTeams)
+async def auto_form_teams(request: schemas.AutoFormTeams):
+    skills = [parse_skills(member.skillsets) for member in request.members]
+    skillIds = {}
+    memberSkills = [[skillIds.setdefault(skill, len(skillIds)) for skill in memberSkill] for memberSkill in skills]
+    bucketIds = {}
+    buckets = [bucketIds.setdefault((normalize(member.location), normalize(member.classificationLevel)), len(bucketIds)) for member in request.members]
+
+    formed = await form_teams_in_pool(memberSkills, buckets, request.teamSize)
+
+    teams = []
+    for team in formed:
+        first = request.members[team[0]]
+        teams.append({
+            "location": first.location,
+            "classificationLevel": first.classificationLevel,
+            "skillsets": sorted({skill for i in team for skill in skills[i]}),
+            "members": [request.members[i] for i in team],
+        })
+    return {"teams": teams}
 
 # Update team by id 
 @router.patch("/{id}", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.ReturnTeam)
-def update_team(id: int, update: schemas.UpdateTeam, db: Session = Depends(get_db)):
-    teamName= db.query(models.Teams.name).filter(models.Teams.id == id).first()
-    captainCode = db.query(models.Teams.captainCode).filter(models.Teams.id == id).first()
-    teamQuery = db.query(models.Teams).filter(models.Teams.id == id)
-    teamUpdate = update.dict(exclude_unset=True, exclude_none=True)
-    team = teamQuery.first()
-
-    if team == None:
-        raise HTTPException(status_code=404, detail=f"{teamName} not found")
-    
-    if captainCode[0] != update.captainCode:
+async def update_team(id: int, update: schemas.UpdateTeam, db: AsyncSession = Depends(get_db)):
+    teamUpdate = update.model_dump(exclude_unset=True, exclude_none=True, exclude={"captainCode", "task"})
+    matches = (models.Teams.id == id, models.Teams.captainCode == update.captainCode)
+
+    # The captain code check is part of the UPDATE, so a match is one round trip
+    try:
+        if teamUpdate:
+            team = await db.scalar(sql_update(models.Teams).where(*matches).values(**teamUpdate).returning(models.Teams))
+        else:
+            team = await db.scalar(select(models.Teams).where(*matches))
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Sorry, a team with name {update.name} already exists.")
+
+    if team is None:
+        if await db.scalar(select(models.Teams.id).where(models.Teams.id == id)) is None:
+            raise HTTPException(status_code=404, detail=f"Team with id: {id} not found")
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Captain code was invalid.")
-    else:
-        teamQuery.update(teamUpdate)
-        db.commit()
-        
-        return team
+
+    if "preferredSkillsets" in teamUpdate:
+        await sync_skills(db, "teams", id, teamUpdate["preferredSkillsets"])
+    if "maxMembers" in teamUpdate:
+        # Lowering it below the current size closes the team but removes nobody
+        set_committed_value(team, "needsMembers", (await refresh_needs_members(db, [id]))[id])
+    track_team(db, team)
+    await emit(db, "team.updated", id=id, name=team.name, needsMembers=team.needsMembers, task_id=team.task_id)
+    await commit(db)
+    await invalidate(*team_tags(id, team.task_id))
+    forget_image("teams", id)
+    await db.refresh(team, ["members"])
+    return team
 
 # Delete a team
 @router.put("/delete/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_team(id: int, request_body: schemas.DeleteTeam = Body(...), db: Session = Depends(get_db)):
-    teamQuery = db.query(models.Teams).filter(models.Teams.id == id)
-    team = teamQuery.first()
-
-    captainCodeQuery = db.query(models.Teams.captainCode).filter(models.Teams.id == id)
-    captainCodeResult = captainCodeQuery.first()
-    captainCode = captainCodeResult[0]
+async def delete_team(id: int, request_body: schemas.DeleteTeam = Body(...), db: AsyncSession = Depends(get_db)):
+    # Delete on id and captain code in a CTE and read the member ids from the pre-delete snapshot in the same statement
+    deleted = (delete(models.Teams).where(models.Teams.id == id, models.Teams.captainCode == request_body.captainCode)
+               .returning(models.Teams.id, models.Teams.task_id).cte("deleted"))
+    memberIds = select(func.array_agg(models.Members.id)).where(models.Members.team_id == deleted.c.id).scalar_subquery()
+    team = (await db.execute(select(deleted.c.task_id, memberIds.label("member_ids")))).first()
 
     if team is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Team with id: {id} does not exist.")
-
-    if captainCode != request_body.captainCode:
+        if await db.scalar(select(models.Teams.id).where(models.Teams.id == id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Team with id: {id} does not exist.")
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid captain code.")
 
-    teamQuery.delete(synchronize_session=False)
-    db.commit()
+    forget_skills(db, "teams", id)
+    forget_team(db, id)
+    for memberId in team.member_ids or []:
+        forget_skills(db, "members", memberId)
+    await emit(db, "team.deleted", id=id, task_id=team.task_id)
+    await commit(db)
+    forget_image("teams", id)
+    await invalidate(*team_tags(id, team.task_id))
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 # Upload team photo
 @router.post("/images/{id}", status_code=status.HTTP_202_ACCEPTED)
-async def upload_teams_photo(id: int, photo: UploadFile = File(...), db: Session = Depends(get_db)):
-    team = db.query(models.Teams).filter(models.Teams.id == id).first()
+async def upload_teams_photo(id: int, photo: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    team = await db.scalar(select(models.Teams).where(models.Teams.id == id))
     if not team:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Team not found")
-    contents = await photo.read()
-    validate_upload_file(contents, photo)
-    new_filename = save_image_to_disk(contents, photo.filename, team.name)
-    team.pictureName = new_filename
+    upload = await save_image(photo)
+    team.pictureName = upload["filename"]
     db.add(team)
-    db.commit()
-    return {"detail": f"Successfully uploaded {photo.filename} for {team.name}"}
+    await commit(db)
+    forget_image("teams", id)
+    schedule_derivatives(upload["filename"])
+    return {"detail": f"Successfully uploaded {photo.filename} for {team.name}", "size": upload["size"], "bytesPerSecond": upload["bytesPerSecond"]}
 
 # Create members
-@router.post("/{id}/join", status_code=status.HTTP_201_CREATED, response_model=schemas.CreateMember)
-def create_member(id: int, member: schemas.CreateMember, db: Session = Depends(get_db)):
-    newMember = models.Members(**member.dict(), team_id=id)
-    db.add(newMember)
-    db.commit()
-    db.refresh(newMember)
+@router.post("/{id}/join", status_code=status.HTTP_201_CREATED, response_model=schemas.CreateMember, dependencies=[Depends(idempotent)])
+async def create_member(id: int, member: schemas.CreateMember, db: AsyncSession = Depends(get_db)):
+    # The team row stays locked from the capacity check to the commit, parallel joins queue up behind it
+    newMember, team = await join_team(db, id, member.model_dump())
+    await commit(db)
+    await invalidate(*team_tags(id, team.task_id))
     return newMember
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, root_validator, Field
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, model_validator
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Optional, List
 
 # Tasks
 class CreateTask(BaseModel):
@@ -14,8 +14,7 @@ class CreateTask(BaseModel):
     pocName: str
     pocDiscordName: str
     hasData: Optional[bool] = False
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DeleteTask(BaseModel):
     taskCode: str
@@ -50,8 +49,7 @@ class ReturnMember(BaseModel):
     discordName: str
     skillsets: str
     team_id: int
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class CreateTeamCaptain(CreateMember):
     pass
@@ -71,9 +69,9 @@ class ReturnTeam(BaseModel):
     classificationLevel: str
     preferredSkillsets: str
     needsMembers: bool
+    maxMembers: int
     members: List[ReturnMember] = []
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DeleteTeam(BaseModel):
     captainCode: str
@@ -87,12 +85,15 @@ class CreateTeam(BaseModel):
     preferredWorkTime: str
     classificationLevel: str
     preferredSkillsets: str
+    # Captain included, joins are refused once it is reached
+    maxMembers: int = Field(5, ge=1, le=100)
     captain: CreateTeamCaptain
 
-    @root_validator(pre=True)
+    @model_validator(mode="before")
+    @classmethod
     def populate_captain_discord_name(cls, values):
-        captain = values.get('captain')
-        if captain:
+        captain = values.get('captain') if isinstance(values, dict) else None
+        if isinstance(captain, dict):
             # Access the discordName using dictionary key access
             values['captainDiscordName'] = captain.get('discordName', '')
         return values
@@ -111,7 +112,8 @@ class UpdateTeam(BaseModel):
     preferredWorkTime: Optional[str] = None
     classificationLevel: Optional[str] = None
     preferredSkillsets: Optional[str] = None
-    needsMembers: Optional[bool] = None
+    # needsMembers follows the member count, set maxMembers to the current size to close a team
+    maxMembers: Optional[int] = Field(None, ge=1, le=100)
 
 class ReturnTask(BaseModel):
     id: int
@@ -127,9 +129,120 @@ class ReturnTask(BaseModel):
     hasData: bool
     isCompleted: bool
     teams: List[ReturnTeam] = []
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ReturnCreatedTask(ReturnTask):
     taskCode: str
     pass
+
+class RecommendedTask(BaseModel):
+    score: float
+    task: ReturnTask
+
+class RecommendedTeam(BaseModel):
+    score: float
+    team: ReturnTeam
+
+class AutoFormMember(CreateMember):
+    location: str
+    classificationLevel: str
+
+class AutoFormTeams(BaseModel):
+    teamSize: int = Field(5, ge=2, le=50)
+    members: List[AutoFormMember] = Field(..., min_length=1)
+
+class FormedTeam(BaseModel):
+    location: str
+    classificationLevel: str
+    skillsets: List[str]
+    members: List[AutoFormMember]
+
+class ReturnFormedTeams(BaseModel):
+    teams: List[FormedTeam]
+
+# Matchmaking queue
+class QueueMember(CreateMember):
+    # Only teams with the same location/classificationLevel (ignoring case) are considered when set
+    location: Optional[str] = None
+    classificationLevel: Optional[str] = None
+
+class ReturnQueueEntry(BaseModel):
+    id: int
+    status: str
+    team_id: Optional[int] = None
+    member_id: Optional[int] = None
+    created_at: datetime
+    assigned_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+# Bulk import
+class BulkMember(CreateMember):
+    team_id: int
+
+class BulkRowResult(BaseModel):
+    row: int
+    status: str
+    id: Optional[int] = None
+    # captainCode/taskCode of a created team or task, only ever returned here
+    code: Optional[str] = None
+    errors: List[str] = []
+
+class BulkResult(BaseModel):
+    created: int
+    failed: int
+    rows: List[BulkRowResult]
+
+# Batch, many API calls in one request and one transaction
+BATCH_MAX_OPERATIONS = 100
+
+class BatchOperation(BaseModel):
+    method: str = Field(pattern="^(GET|POST|PUT|PATCH)$")
+    # As it would be requested, e.g. /teams/3 or /tasks/5/join, query string included
+    path: str
+    body: Optional[Any] = None
+
+class Batch(BaseModel):
+    operations: List[BatchOperation] = Field(..., max_length=BATCH_MAX_OPERATIONS)
+    # Roll every operation back when one fails, rather than only the failed one
+    atomic: bool = True
+
+class BatchOperationResult(BaseModel):
+    operation: int
+    status: str
+    statusCode: Optional[int] = None
+    body: Optional[Any] = None
+
+class BatchResult(BaseModel):
+    committed: bool
+    succeeded: int
+    failed: int
+    results: List[BatchOperationResult]
+
+# Delta sync, rows changed since a token and the ids of deleted ones
+class ChangedTeam(ReturnTeam):
+    updated_at: datetime
+
+class ChangedTask(ReturnTask):
+    updated_at: datetime
+
+class TeamChanges(BaseModel):
+    changed: List[ChangedTeam]
+    deleted: List[int]
+    token: str
+    more: bool
+
+class TaskChanges(BaseModel):
+    changed: List[ChangedTask]
+    deleted: List[int]
+    token: str
+    more: bool
+
+# Adapters for the list responses, built once instead of on every request
+MemberList = TypeAdapter(List[ReturnMember])
+TeamList = TypeAdapter(List[ReturnTeam])
+TaskList = TypeAdapter(List[ReturnTask])
+RecommendedTaskList = TypeAdapter(List[RecommendedTask])
+RecommendedTeamList = TypeAdapter(List[RecommendedTeam])
+TeamChangeList = TypeAdapter(TeamChanges)
+TaskChangeList = TypeAdapter(TaskChanges)
+BulkResults = TypeAdapter(BulkResult)
@@ -0,0 +1,44 @@
+import re
+from typing import List
+
+from sqlalchemy import and_, func, or_
+
+# Terms are split on commas/whitespace, "quoted phrases" are kept together
+TERM_PATTERN = re.compile(r'"([^"]+)"|([^\s,"]+)')
+MAX_SEARCH_TERMS = 8
+
+# Query values for ?match= and ?sort=
+MATCH_PATTERN = "^(all|any)$"
+SORT_PATTERN = "^(created|relevance)$"
+
+
+def parse_terms(search: str) -> List[str]:
+    terms = []
+    for phrase, word in TERM_PATTERN.findall(search or ""):
+        term = " ".join((phrase or word).lower().split())
+        if term and term not in terms:
+            terms.append(term)
+    return terms[:MAX_SEARCH_TERMS]
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_filter(column, terms: List[str], match: str = "all"):
+    # ILIKE '%term%' is served by the pg_trgm GIN index on the column
+    clauses = [column.ilike(f"%{escape_like(term)}%", escape="\\") for term in terms]
+    if match == "any":
+        return or_(*clauses)
+    return and_(*clauses)
+
+def search_rank(column, terms: List[str]):
+    return func.similarity(column, " ".join(terms))
+
+def apply_search(query, column, search: str, match: str = "all", sort: str = "created"):
+    # Returns the filtered query and the ordering to paginate with (None keeps created_at order)
+    terms = parse_terms(search)
+    if not terms:
+        return query, None
+    query = query.filter(search_filter(column, terms, match))
+    if sort == "relevance":
+        return query, [search_rank(column, terms).desc()]
+    return query, None
@@ -1,4 +1,6 @@
 import os
+import random
+import string
 import uuid
 
 def sanitize_filename(filename: str) -> str:
@@ -11,4 +13,8 @@ def generate_filename(original_filename: str, identifier: str) -> str:
     file_extension = os.path.splitext(safe_filename)[1]
     unique_id = uuid.uuid4().hex
     new_filename = f"{identifier}_{unique_id}{file_extension}"
-    return new_filename
\ No newline at end of file
+    return new_filename
+
+def generate_code(length: int = 6) -> str:
+    chars = string.ascii_letters
+    return ''.join(random.choices(chars, k=length))
@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+from typing import Dict, Iterable, List
+
+from sqlalchemy import ARRAY, Integer, String, any_, delete, func, insert, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import on_commit
+
+# Separators seen in the free-text skill columns ("python, go; sql / k8s")
+SKILL_SEPARATORS = re.compile(r"[,;/|\n]+")
+# Rebuild the in-process index periodically so writes from other workers show up
+SKILL_INDEX_TTL = 300
+
+# Association table and its foreign key column for each entity kind
+SKILL_TABLES = {
+    "teams": (models.team_skills, models.team_skills.c.team_id),
+    "tasks": (models.task_skills, models.task_skills.c.task_id),
+    "members": (models.member_skills, models.member_skills.c.member_id),
+}
+
+
+def parse_skills(text: str) -> List[str]:
+    skills = []
+    for part in SKILL_SEPARATORS.split(text or ""):
+        skill = " ".join(part.lower().split())
+        if skill and skill not in skills:
+            skills.append(skill)
+    return skills
+
+def popcount(mask: int) -> int:
+    return bin(mask).count("1")
+
+
+class SkillIndex:
+    # Maps each team/task/member to an integer bitset where bit n is set for skill id n,
+    # so skill overlap is a popcount of the AND of two masks.
+    def __init__(self):
+        self.skill_ids: Dict[str, int] = {}
+        self.masks: Dict[str, Dict[int, int]] = {kind: {} for kind in SKILL_TABLES}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > SKILL_INDEX_TTL
+
+    async def load(self, db: AsyncSession):
+        skill_ids = {name: id for id, name in await db.execute(select(models.Skills.id, models.Skills.name))}
+        masks = {kind: {} for kind in SKILL_TABLES}
+        for kind, (table, column) in SKILL_TABLES.items():
+            kind_masks = masks[kind]
+            for entity_id, skill_id in await db.execute(select(column, table.c.skill_id)):
+                kind_masks[entity_id] = kind_masks.get(entity_id, 0) | (1 << skill_id)
+        with self.lock:
+            self.skill_ids = skill_ids
+            self.masks = masks
+            self.loaded_at = time.monotonic()
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if self.is_stale():
+            await self.load(db)
+
+    def mask_for(self, skills: Iterable[str]) -> int:
+        mask = 0
+        for skill in skills:
+            skill_id = self.skill_ids.get(skill)
+            if skill_id is not None:
+                mask |= 1 << skill_id
+        return mask
+
+    def mask_of(self, kind: str, entity_id: int) -> int:
+        return self.masks[kind].get(entity_id, 0)
+
+    def set(self, kind: str, entity_id: int, skill_ids: Dict[str, int]):
+        with self.lock:
+            self.skill_ids.update(skill_ids)
+            mask = 0
+            for skill_id in skill_ids.values():
+                mask |= 1 << skill_id
+            self.masks[kind][entity_id] = mask
+
+    def discard(self, kind: str, entity_id: int):
+        with self.lock:
+            self.masks[kind].pop(entity_id, None)
+
+    def overlap(self, mask_a: int, mask_b: int) -> int:
+        return popcount(mask_a & mask_b)
+
+
+skill_index = SkillIndex()
+
+
+async def get_skill_ids(db: AsyncSession, skills: List[str]) -> Dict[str, int]:
+    # Existing names are looked up first: an upsert of a name that is already there still
+    # takes a value from the id sequence, and the masks above are as wide as the largest id
+    if not skills:
+        return {}
+    names = literal(list(skills), ARRAY(String))
+    skill_ids = dict((await db.execute(select(models.Skills.name, models.Skills.id).where(models.Skills.name == any_(names)))).all())
+    # Sorted, so concurrent writers take the name index locks in the same order
+    missing = sorted(set(skills) - set(skill_ids))
+    if missing:
+        inserted = await db.execute(pg_insert(models.Skills).values([{"name": skill} for skill in missing])
+                                    .on_conflict_do_nothing(index_elements=["name"]).returning(models.Skills.name, models.Skills.id))
+        skill_ids.update(inserted.all())
+        # Inserted by someone else in between
+        raced = [skill for skill in missing if skill not in skill_ids]
+        if raced:
+            rows = await db.execute(select(models.Skills.name, models.Skills.id).where(models.Skills.name == any_(literal(raced, ARRAY(String)))))
+            skill_ids.update(rows.all())
+    return skill_ids
+
+async def sync_skills(db: AsyncSession, kind: str, entity_id: int, text: str):
+    # Replace the entity's skill associations; the index is updated once the caller commits
+    table, column = SKILL_TABLES[kind]
+    skill_ids = await get_skill_ids(db, parse_skills(text))
+    await db.execute(delete(table).where(column == entity_id))
+    if skill_ids:
+        await db.execute(insert(table), [{column.name: entity_id, "skill_id": skill_id} for skill_id in skill_ids.values()])
+    on_commit(db, lambda: skill_index.set(kind, entity_id, skill_ids))
+
+async def sync_skills_many(db: AsyncSession, kind: str, texts: Dict[int, str]):
+    # sync_skills for many entities at once, one skill upsert and one association insert in total
+    if not texts:
+        return
+    table, column = SKILL_TABLES[kind]
+    parsed = {entity_id: parse_skills(text) for entity_id, text in texts.items()}
+    skill_ids = await get_skill_ids(db, list({skill for skills in parsed.values() for skill in skills}))
+    await db.execute(delete(table).where(column == any_(literal(list(parsed), ARRAY(Integer)))))
+    pairs = [(entity_id, skill_ids[skill]) for entity_id, skills in parsed.items() for skill in skills]
+    if pairs:
+        # Two array parameters unnested server side instead of a bind per association
+        entity_ids, skill_id_list = zip(*pairs)
+        rows = select(func.unnest(literal(list(entity_ids), ARRAY(Integer))), func.unnest(literal(list(skill_id_list), ARRAY(Integer))))
+        await db.execute(insert(table).from_select([column.name, "skill_id"], rows))
+    on_commit(db, lambda: [skill_index.set(kind, entity_id, {skill: skill_ids[skill] for skill in skills}) for entity_id, skills in parsed.items()])
+
+def forget_skills(db: AsyncSession, kind: str, entity_id: int):
+    # Associations go with the row through ON DELETE CASCADE, only the index needs updating
+    on_commit(db, lambda: skill_index.discard(kind, entity_id))
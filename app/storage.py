@@ -0,0 +1,155 @@
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+
+# Original pictures live at <sha[:2]>/<sha[2:4]>/<sha><ext>, so identical uploads share a key
+# and a key never changes when its team or task is renamed
+
+
+def content_key(digest: str, extension: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+def is_content_key(picture_name: str) -> bool:
+    # Names from before content addressing were stored flat under images/<team or task name>/
+    return "/" in picture_name
+
+
+class Storage(ABC):
+    # A backend missing any of these can't be instantiated
+    @abstractmethod
+    async def put_file(self, temp_path: str, key: str):
+        ...
+
+    @abstractmethod
+    async def put_bytes(self, key: str, data: bytes):
+        ...
+
+    @abstractmethod
+    async def read(self, key: str) -> Tuple[bytes, float]:
+        # Returns the object and its modification time, raises FileNotFoundError when missing
+        ...
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    def temp_dir(self) -> Optional[str]:
+        # Where uploads are spooled before put_file
+        return None
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def temp_dir(self) -> str:
+        # Same filesystem as the objects, so put_file is a rename
+        directory = os.path.join(self.root, ".tmp")
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _put_file(self, temp_path: str, key: str):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def _put_bytes(self, key: str, data: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir())
+        with os.fdopen(fd, "wb") as temp:
+            temp.write(data)
+        self._put_file(temp_path, key)
+
+    def _read(self, key: str) -> Tuple[bytes, float]:
+        with open(self.path(key), "rb") as file:
+            return file.read(), os.fstat(file.fileno()).st_mtime
+
+    async def put_file(self, temp_path: str, key: str):
+        await run_in_threadpool(self._put_file, temp_path, key)
+
+    async def put_bytes(self, key: str, data: bytes):
+        await run_in_threadpool(self._put_bytes, key, data)
+
+    async def read(self, key: str) -> Tuple[bytes, float]:
+        return await run_in_threadpool(self._read, key)
+
+    async def exists(self, key: str) -> bool:
+        return await run_in_threadpool(os.path.exists, self.path(key))
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None):
+        import boto3
+        from botocore.exceptions import ClientError
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+        )
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except self.client_error as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def _put_file(self, temp_path: str, key: str):
+        try:
+            if not self._exists(key):
+                self.client.upload_file(temp_path, self.bucket, self.prefix + key)
+        finally:
+            os.remove(temp_path)
+
+    def _put_bytes(self, key: str, data: bytes):
+        if not self._exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def _read(self, key: str) -> Tuple[bytes, float]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.client_error as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(key)
+            raise
+        return response["Body"].read(), response["LastModified"].timestamp()
+
+    async def put_file(self, temp_path: str, key: str):
+        await run_in_threadpool(self._put_file, temp_path, key)
+
+    async def put_bytes(self, key: str, data: bytes):
+        await run_in_threadpool(self._put_bytes, key, data)
+
+    async def read(self, key: str) -> Tuple[bytes, float]:
+        return await run_in_threadpool(self._read, key)
+
+    async def exists(self, key: str) -> bool:
+        return await run_in_threadpool(self._exists, key)
+
+
+def make_storage() -> Storage:
+    if settings.IMAGE_STORAGE == "s3":
+        return S3Storage(settings.S3_BUCKET, settings.S3_PREFIX, settings.S3_ENDPOINT_URL, settings.S3_REGION,
+                         settings.S3_ACCESS_KEY_ID, settings.S3_SECRET_ACCESS_KEY)
+    return LocalStorage(settings.IMAGE_STORAGE_ROOT or os.path.join(os.getcwd(), "images", "objects"))
+
+
+storage = make_storage()
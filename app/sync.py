@@ -0,0 +1,39 @@
+from typing import Dict, Optional
+
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .pagination import decode_sync_token, encode_sync_token
+
+# Oldest transaction still running: everything below it has committed or never will.
+# Rows carry the id of the transaction that last wrote them (sync_txid), so a client that
+# has seen everything up to one horizon only needs rows with sync_txid >= that horizon.
+SNAPSHOT_XMIN = text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+
+
+async def changes(db: AsyncSession, model, kind: str, since: Optional[str], limit: int, options: list) -> Dict:
+    horizon, nextHorizon, after = decode_sync_token(since) if since else (0, None, None)
+    # Read on the first page, before any rows, and carried through the rest: a transaction
+    # committing while the client pages is either returned now or, having been in progress
+    # then, at or above the next horizon and returned again next time. Reading it again on a
+    # later page would step over a transaction that committed behind the page position.
+    if nextHorizon is None:
+        nextHorizon = await db.scalar(SNAPSHOT_XMIN)
+
+    query = select(model).options(*options).where(model.sync_txid >= horizon)
+    if after:
+        query = query.where(tuple_(model.sync_txid, model.id) > tuple_(*after))
+    rows = (await db.scalars(query.order_by(model.sync_txid, model.id).limit(limit + 1))).all()
+    if len(rows) > limit:
+        # Keep paging from the same horizon, the new one is handed out with the last page
+        rows = rows[:limit]
+        return {"changed": rows, "deleted": [], "token": encode_sync_token(horizon, (nextHorizon, rows[-1].sync_txid, rows[-1].id)), "more": True}
+
+    # A first sync (horizon 0) starts from nothing, so there is nothing to delete
+    deleted = []
+    if horizon:
+        deleted = (await db.scalars(select(models.Tombstones.id)
+                                    .where(models.Tombstones.kind == kind, models.Tombstones.sync_txid >= horizon)
+                                    .order_by(models.Tombstones.id))).all()
+    return {"changed": rows, "deleted": deleted, "token": encode_sync_token(nextHorizon), "more": False}
@@ -0,0 +1,114 @@
+import asyncio
+import io
+import os
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from .storage import storage
+
+# Longest edge of each derivative, ?size= picks the smallest one that is at least as large
+THUMBNAIL_SIZES = (64, 256, 1024)
+# Pillow format and file extension per derivative type; None keeps the upload's format
+DERIVATIVE_FORMATS = {"webp": ("WEBP", ".webp")}
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_QUALITY = 80
+# What rendering raises for a picture it can't make a derivative of: undecodable (OSError),
+# larger than Image.MAX_IMAGE_PIXELS allows (DecompressionBombError), or a mode the target
+# format can't save (ValueError), or the pool lost a worker (BrokenExecutor)
+RENDER_ERRORS = (OSError, Image.DecompressionBombError, ValueError, BrokenExecutor)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pending: Dict[str, asyncio.Future] = {}
+_background = set()
+
+
+def pick_size(requested: int) -> Optional[int]:
+    # None means the original is the closest match
+    for size in THUMBNAIL_SIZES:
+        if size >= requested:
+            return size
+    return None
+
+def derivative_key(key: str, size: int, fmt: Optional[str] = None) -> str:
+    # Derived from a content key, so derivatives are shared by identical uploads too
+    stem, extension = os.path.splitext(key)
+    if fmt is not None:
+        extension = DERIVATIVE_FORMATS[fmt][1]
+    return f"{stem}_{size}{extension}"
+
+def render_derivative(data: bytes, size: int, fmt: Optional[str] = None) -> bytes:
+    with Image.open(io.BytesIO(data)) as source:
+        original_format = source.format
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.save(output, format=DERIVATIVE_FORMATS[fmt][0] if fmt else original_format, quality=THUMBNAIL_QUALITY)
+        return output.getvalue()
+
+def render_derivatives(data: bytes) -> List[Tuple[int, Optional[str], bytes]]:
+    rendered = []
+    for size in THUMBNAIL_SIZES:
+        for fmt in (None, *DERIVATIVE_FORMATS):
+            rendered.append((size, fmt, render_derivative(data, size, fmt)))
+    return rendered
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _executor
+
+def shutdown():
+    # Called when the app stops, renders not started yet are dropped
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+async def _render(function, *args):
+    global _executor
+    executor = _get_executor()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+    except BrokenExecutor:
+        # A worker died and took the pool with it, the next render starts a new one
+        if _executor is executor:
+            _executor = None
+        raise
+
+async def _store_derivatives(key: str):
+    data, _ = await storage.read(key)
+    for size, fmt, rendered in await _render(render_derivatives, data):
+        await storage.put_bytes(derivative_key(key, size, fmt), rendered)
+
+def _finished(task: asyncio.Task):
+    _background.discard(task)
+    # Missing derivatives are rendered again on demand, so a failure here only needs consuming
+    if not task.cancelled():
+        task.exception()
+
+# Render every derivative of a fresh upload without holding up the request
+def schedule_derivatives(key: str):
+    task = asyncio.create_task(_store_derivatives(key))
+    _background.add(task)
+    task.add_done_callback(_finished)
+
+async def _store_derivative(key: str, target: str, size: int, fmt: Optional[str]):
+    data, _ = await storage.read(key)
+    await storage.put_bytes(target, await _render(render_derivative, data, size, fmt))
+
+async def ensure_derivative(key: str, size: int, fmt: Optional[str] = None) -> str:
+    # Pictures uploaded before derivatives existed are rendered on first request
+    target = derivative_key(key, size, fmt)
+    if await storage.exists(target):
+        return target
+    task = _pending.get(target)
+    if task is None:
+        task = asyncio.ensure_future(_store_derivative(key, target, size, fmt))
+        _pending[target] = task
+        task.add_done_callback(lambda _: _pending.pop(target, None))
+    await asyncio.shield(task)
+    return target
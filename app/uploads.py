@@ -0,0 +1,98 @@
+import hashlib
+import os
+import tempfile
+import time
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+
+from .storage import content_key, storage
+
+DISALLOWED_EXTENSIONS = ['.py', '.php', '.exe', '.sh']
+# Leading bytes of the accepted image formats, the client's content_type is not trusted
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+}
+IMAGE_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png"}
+# Only produced by derivatives, uploads are limited to the types above
+DERIVED_SIGNATURES = {b"RIFF": "image/webp"}
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Pictures lived under IMAGEDIR/images/<team or task name>/ before content-addressed storage
+IMAGEDIR = os.getcwd()
+
+
+def contains_disallowed_extension(filename: str) -> bool:
+    filename_lower = filename.lower()
+    for ext in DISALLOWED_EXTENSIONS:
+        if ext in filename_lower:
+            return True
+    return False
+
+def validate_filename(filename: Optional[str]):
+    if not filename:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No file uploaded.")
+    if contains_disallowed_extension(filename):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No, No, No!")
+    if ".." in filename or filename.startswith("/"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image name.")
+
+def sniff_image_type(head: bytes, signatures: dict = IMAGE_SIGNATURES) -> Optional[str]:
+    for signature, content_type in signatures.items():
+        if head.startswith(signature):
+            return content_type
+    return None
+
+# See scripts/migrate_images.py for moving these into the storage backend
+def legacy_image_path(owner: str, filename: str) -> str:
+    return os.path.join(IMAGEDIR, f"images/{owner}", filename)
+
+def _temp_file():
+    # temp_dir() may create the directory, so it runs in the threadpool along with mkstemp
+    return tempfile.mkstemp(dir=storage.temp_dir(), suffix=".part")
+
+def _discard(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+async def save_image(photo: UploadFile) -> dict:
+    # Copies the upload chunk by chunk into a temp file, hashing as it goes, so memory per
+    # upload stays at one chunk; the file is stored under its SHA-256 once it passed validation
+    validate_filename(photo.filename)
+    if photo.size is not None and photo.size > MAX_IMAGE_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"{photo.filename} is too large.")
+
+    start = time.perf_counter()
+    fd, temp_path = await run_in_threadpool(_temp_file)
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+    try:
+        with os.fdopen(fd, "wb") as temp:
+            while chunk := await photo.read(UPLOAD_CHUNK_SIZE):
+                if content_type is None:
+                    content_type = sniff_image_type(chunk)
+                    if content_type is None:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{photo.filename} file type is not valid.")
+                size += len(chunk)
+                if size > MAX_IMAGE_SIZE:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"{photo.filename} is too large.")
+                digest.update(chunk)
+                await run_in_threadpool(temp.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No file uploaded.")
+        key = content_key(digest.hexdigest(), IMAGE_EXTENSIONS[content_type])
+        await storage.put_file(temp_path, key)
+    except BaseException:
+        _discard(temp_path)
+        raise
+
+    elapsed = time.perf_counter() - start
+    return {
+        "filename": key,
+        "contentType": content_type,
+        "size": size,
+        "bytesPerSecond": round(size / elapsed) if elapsed > 0 else size,
+    }
@@ -0,0 +1,60 @@
+"""Benchmark the team-formation engine on a synthetic sign-up pool.
+
+Usage: python scripts/bench_formation.py [members] [team_size]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.formation import form_teams  # noqa: E402
+
+SKILLS = 60
+LOCATIONS = 6
+LEVELS = 3
+
+
+def synthetic_pool(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    # Skewed popularity so some skills are rare, like real sign-ups
+    weights = [1 / (rank + 1) for rank in range(SKILLS)]
+    skills = [sorted(set(rng.choices(range(SKILLS), weights=weights, k=rng.randint(1, 5)))) for _ in range(count)]
+    buckets = [rng.randrange(LOCATIONS * LEVELS) for _ in range(count)]
+    return skills, buckets
+
+
+def baseline(skills, buckets, team_size):
+    # Sign-up order, which is what manual assembly through POST /teams/{id}/join amounts to
+    teams = []
+    for bucket in sorted(set(buckets)):
+        members = [i for i, b in enumerate(buckets) if b == bucket]
+        teams.extend(members[i:i + team_size] for i in range(0, len(members), team_size))
+    return teams
+
+
+def coverage(skills, teams):
+    return sum(len({skill for member in team for skill in skills[member]}) for team in teams) / len(teams)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    team_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    skills, buckets = synthetic_pool(count)
+
+    start = time.perf_counter()
+    teams = form_teams(skills, buckets, team_size)
+    elapsed = time.perf_counter() - start
+
+    sizes = [len(team) for team in teams]
+    assert sorted(member for team in teams for member in team) == list(range(count))
+    print(f"members={count} team_size={team_size} teams={len(teams)}")
+    print(f"form_teams: {elapsed:.2f}s ({count / elapsed:,.0f} members/s)")
+    print(f"team sizes: min={min(sizes)} max={max(sizes)}")
+    print(f"distinct skills per team: formed={coverage(skills, teams):.2f} "
+          f"sign-up order={coverage(skills, baseline(skills, buckets, team_size)):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark rendering a large List[ReturnTeam] response.
+
+Compares FastAPI's default response_model path encoded with the stdlib JSONResponse (what the
+list endpoints used to do), the same path with ORJSONResponse, and the pre-built TypeAdapter
+fast path in app/responses.py.
+
+Usage: python scripts/bench_serialization.py [teams] [members_per_team] [rounds]
+"""
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from app import models, schemas  # noqa: E402
+from app.responses import render  # noqa: E402
+
+
+def synthetic_teams(count: int, members: int) -> List[models.Teams]:
+    # Transient ORM objects, the same shape the list endpoints hand to the serializer
+    teams = []
+    for i in range(count):
+        team = models.Teams(id=i, name=f"team {i}", captainDiscordName=f"captain#{i}", gitRepo=f"https://git.example/{i}",
+                            location="Remote", preferredWorkTime="evenings", classificationLevel="U",
+                            preferredSkillsets="python, sql, react", needsMembers=True)
+        team.members = [models.Members(id=i * members + j, name=f"member {j}", discordName=f"member#{j}",
+                                       skillsets="python, go", team_id=i) for j in range(members)]
+        teams.append(team)
+    return teams
+
+
+async def default_path(field, teams, response_class):
+    content = await serialize_response(field=field, response_content=teams)
+    return response_class(content).body
+
+def measure(rounds: int, run) -> List[float]:
+    times = []
+    for _ in range(rounds):
+        gc.collect()
+        start = time.perf_counter()
+        body = run()
+        times.append(time.perf_counter() - start)
+    return times, body
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    members = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    teams = synthetic_teams(count, members)
+    field = create_response_field(name="Response_get_teams", type_=List[schemas.ReturnTeam])
+
+    paths = [
+        ("response_model + JSONResponse", lambda: asyncio.run(default_path(field, teams, JSONResponse))),
+        ("response_model + ORJSONResponse", lambda: asyncio.run(default_path(field, teams, ORJSONResponse))),
+        ("TypeAdapter.dump_json", lambda: render(schemas.TeamList, teams).body),
+    ]
+    print(f"teams={count} members_per_team={members} rounds={rounds}")
+    baseline = None
+    bodies = []
+    for name, run in paths:
+        times, body = measure(rounds, run)
+        bodies.append(body)
+        median = statistics.median(times)
+        baseline = baseline or median
+        print(f"{name:34} median={median * 1000:8.1f}ms best={min(times) * 1000:8.1f}ms "
+              f"size={len(body) / 1024:,.0f}KiB speedup={baseline / median:.1f}x")
+    assert all(json.loads(body) == json.loads(bodies[0]) for body in bodies), "paths rendered different payloads"
+
+
+if __name__ == "__main__":
+    main()
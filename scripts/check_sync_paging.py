@@ -0,0 +1,82 @@
+"""Check that a paged /teams/changes sync doesn't lose a write committed between its pages.
+
+A transaction is opened and left running while it updates one team, so that team's change
+carries an older transaction id than the changes committed after it. The client fetches the
+first page, the held transaction commits, the client finishes paging and then syncs again
+from the final token: the held change must turn up in one of those responses. Exits with
+status 1 if it never does. Run it against a scratch database, it creates teams.
+
+Usage: python scripts/check_sync_paging.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from app.database import SQLALCHEMY_DATABASE_URL  # noqa: E402
+from app.main import app  # noqa: E402
+
+PAGE = 1
+
+
+def create_team(client: TestClient, name: str) -> dict:
+    response = client.post("/teams/", json={
+        "name": name, "gitRepo": "git", "location": "sync", "preferredWorkTime": "evenings",
+        "classificationLevel": "U", "preferredSkillsets": "python",
+        "captain": {"name": f"{name} captain", "discordName": "captain#1", "skillsets": "python"}})
+    if response.status_code != 201:
+        sys.exit(f"Creating a team failed with {response.status_code}: {response.text}")
+    return response.json()
+
+
+def sync(client: TestClient, token: str) -> tuple:
+    # Every team id seen while paging to the end, and the final token
+    seen = set()
+    while True:
+        response = client.get("/teams/changes", params={"since": token, "limit": PAGE})
+        page = response.json()
+        seen |= {team["id"] for team in page["changed"]}
+        token = page["token"]
+        if not page["more"]:
+            return seen, token
+
+
+def main():
+    prefix = f"sync {int(time.time())} "
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    with TestClient(app) as client:
+        held, first, second = (create_team(client, f"{prefix}{name}") for name in ("held", "first", "second"))
+        _, token = sync(client, client.get("/teams/changes", params={"limit": PAGE}).json()["token"])
+
+        with engine.connect() as connection:
+            # Takes a transaction id older than the two updates below
+            connection.execute(text('UPDATE teams SET "gitRepo" = :repo WHERE id = :id'), {"repo": "held", "id": held["id"]})
+            for team in (first, second):
+                response = client.patch(f"/teams/{team['id']}", json={"gitRepo": "updated", "captainCode": team["captainCode"]})
+                if response.status_code != 202:
+                    sys.exit(f"Updating a team failed with {response.status_code}: {response.text}")
+            page = client.get("/teams/changes", params={"since": token, "limit": PAGE}).json()
+            connection.commit()
+
+        seen = {team["id"] for team in page["changed"]}
+        if page["more"]:
+            pages, token = sync(client, page["token"])
+            seen |= pages
+        else:
+            token = page["token"]
+        paged = held["id"] in seen
+        again, _ = sync(client, token)
+
+    print(f"held change seen while paging: {paged}, on the next sync: {held['id'] in again}")
+    if held["id"] not in seen | again:
+        print(f"FAIL team {held['id']} was updated between pages and never synced")
+        sys.exit(1)
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Check the query plans behind the API for sequential scans over large tables.
+
+Seeds synthetic tasks, teams and members, drives the routers through the test client while
+recording every statement they send, then runs EXPLAIN (FORMAT JSON) on each one. Exits with
+status 1 if any plan seq-scans a table holding more than `threshold` rows, so a dropped index
+or a query that stops using one shows up before it reaches production.
+
+Run it against a scratch database, the seeded rows are left in place and some are updated
+or deleted by the write endpoints it calls.
+
+Usage: python scripts/explain_audit.py [teams] [threshold]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import create_engine, event, text  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+from app.database import SQLALCHEMY_DATABASE_URL, engine  # noqa: E402
+from app.main import app  # noqa: E402
+
+# Tables allowed to be seq-scanned whatever their size
+ALLOWED_SEQ_SCANS = {"skills"}
+EXPLAINED = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+SEED = [
+    """INSERT INTO tasks (name, description, "classificationLevel", "preferredSkillsets", "desiredDeliverable", organization,
+                          location, "pocName", "pocDiscordName", "taskCode", "isCompleted", created_at)
+       SELECT :prefix || 'task ' || g, 'audit', 'U', 'python, sql', 'report', 'org', 'NY', 'poc', 'poc#1',
+              :prefix || 't' || g, g % 10 = 0, now() - g * interval '1 minute'
+       FROM generate_series(1, :tasks) g""",
+    """INSERT INTO teams (name, "captainDiscordName", "gitRepo", location, "preferredWorkTime", "classificationLevel",
+                          "preferredSkillsets", "captainCode", task_id, created_at)
+       SELECT :prefix || 'team ' || g, 'captain#1', 'git', 'NY', 'evenings', 'U', 'python, go', :prefix || 'c' || g,
+              CASE WHEN g % 4 = 0 THEN NULL ELSE ids[1 + g % array_length(ids, 1)] END, now() - g * interval '1 minute'
+       FROM generate_series(1, :teams) g,
+            (SELECT array_agg(id ORDER BY id) AS ids FROM tasks WHERE name LIKE :prefix || '%') seeded""",
+    """INSERT INTO members (name, "discordName", skillsets, team_id, created_at)
+       SELECT :prefix || 'member ' || g, 'member#1', 'python', ids[1 + g % array_length(ids, 1)], now() - g * interval '1 minute'
+       FROM generate_series(1, :teams * 4) g,
+            (SELECT array_agg(id ORDER BY id) AS ids FROM teams WHERE name LIKE :prefix || '%') seeded""",
+]
+
+
+def seed(sync_engine, teams: int) -> str:
+    prefix = f"audit {int(time.time())} "
+    with sync_engine.begin() as connection:
+        for statement in SEED:
+            connection.execute(text(statement), {"prefix": prefix, "teams": teams, "tasks": max(1, teams // 4)})
+    with sync_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("ANALYZE tasks, teams, members"))
+    return prefix
+
+
+def table_sizes(sync_engine) -> dict:
+    with sync_engine.connect() as connection:
+        rows = connection.execute(text("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"))
+        return {name: int(size) for name, size in rows}
+
+
+def has_trigram_indexes(sync_engine) -> bool:
+    with sync_engine.connect() as connection:
+        return bool(connection.scalar(text("SELECT count(*) FROM pg_indexes WHERE indexname LIKE '%\\_trgm'")))
+
+
+def pick(sync_engine, prefix: str) -> dict:
+    # A team with a task and members, and a task with teams, to aim the detail and write endpoints at
+    with sync_engine.connect() as connection:
+        team = connection.execute(text("""SELECT id, "captainCode", name FROM teams WHERE name LIKE :prefix || '%' AND task_id IS NOT NULL
+                                          ORDER BY id LIMIT 1"""), {"prefix": prefix}).one()
+        other = connection.execute(text("""SELECT id, "captainCode", name FROM teams WHERE name LIKE :prefix || '%' AND task_id IS NULL
+                                           ORDER BY id LIMIT 1"""), {"prefix": prefix}).one()
+        task = connection.execute(text("""SELECT id, "taskCode" FROM tasks WHERE name LIKE :prefix || '%' AND NOT "isCompleted"
+                                          ORDER BY id DESC LIMIT 1"""), {"prefix": prefix}).one()
+        member = connection.scalar(text("SELECT id FROM members WHERE team_id = :team ORDER BY id DESC LIMIT 1"), {"team": team.id})
+    return {"team": team, "other": other, "task": task, "member": member}
+
+
+def drive(client: TestClient, ids: dict, search: bool):
+    team, other, task = ids["team"], ids["other"], ids["task"]
+    calls = [
+        ("GET", "/teams/?limit=20", None),
+        ("GET", "/tasks/?limit=20", None),
+        ("GET", "/tasks/completed?limit=20", None),
+        ("GET", "/members/?limit=20", None),
+        ("GET", "/teams/?include=members:3&fields=name,members.name", None),
+        ("GET", "/tasks/?include=teams:2.members:2", None),
+        ("GET", "/teams/changes?limit=20", None),
+        ("GET", "/tasks/changes?limit=20", None),
+        ("GET", f"/teams/{team.id}", None),
+        ("GET", f"/tasks/{task.id}", None),
+        ("GET", f"/members/{ids['member']}", None),
+        ("GET", f"/teams/{team.id}/recommended-tasks", None),
+        ("GET", f"/tasks/{task.id}/recommended-teams", None),
+        ("PATCH", f"/teams/{team.id}", {"captainCode": team.captainCode, "gitRepo": "git2"}),
+        ("PATCH", f"/tasks/{task.id}", {"taskCode": task.taskCode, "organization": "org2"}),
+        ("POST", f"/teams/{team.id}/join", {"name": "audit joiner", "discordName": "joiner#1", "skillsets": "go"}),
+        ("POST", f"/tasks/{task.id}/join", {"captainCode": other.captainCode, "team_name": other.name}),
+        ("POST", "/matchmaking/queue", {"name": "audit queued", "discordName": "queued#1", "skillsets": "python", "location": "ny"}),
+        ("GET", "/matchmaking/queue/1", None),
+        ("PUT", f"/members/{ids['member']}", {"captainCode": team.captainCode}),
+        ("PUT", f"/teams/delete/{other.id}", {"captainCode": other.captainCode}),
+    ]
+    if search:
+        calls += [("GET", "/teams/?search=python", None), ("GET", "/tasks/?search=sql&sort=relevance", None),
+                  ("GET", "/members/?search=member", None)]
+    for method, url, body in calls:
+        response = client.request(method, url, json=body)
+        # Follow the cursor once, later pages take the keyset path rather than the first page's
+        cursor = response.headers.get("X-Next-Cursor")
+        if method == "GET" and cursor:
+            client.get(url + ("&" if "?" in url else "?") + f"cursor={cursor}")
+        print(f"{response.status_code} {method} {url}")
+
+
+def seq_scans(plan: dict):
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+def main():
+    teams = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    threshold = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    sync_engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    prefix = seed(sync_engine, teams)
+    sizes = table_sizes(sync_engine)
+    ids = pick(sync_engine, prefix)
+    search = has_trigram_indexes(sync_engine)
+    if not search:
+        print("pg_trgm indexes missing, search queries are not audited")
+
+    statements = {}
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(EXPLAINED) and not executemany:
+            statements.setdefault(statement, parameters)
+
+    with TestClient(app) as client:
+        # Only the routers' statements, not the ones that warm caches at startup
+        event.listen(Engine, "before_cursor_execute", record)
+        try:
+            drive(client, ids, search)
+        finally:
+            event.remove(Engine, "before_cursor_execute", record)
+
+        async def explain():
+            plans = []
+            async with engine.connect() as connection:
+                for statement, parameters in statements.items():
+                    result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+                    plan = result.scalar()
+                    plans.append((statement, json.loads(plan) if isinstance(plan, str) else plan))
+                await connection.rollback()
+            return plans
+        plans = client.portal.call(explain)
+
+    failures = 0
+    for statement, plan in plans:
+        # Loads of a whole table, like the ones rebuilding the in-memory recommendation index,
+        # have nothing better than a seq scan; a LIMIT without WHERE is still a page read
+        words = statement.upper().split()
+        if "WHERE" not in words and "LIMIT" not in words:
+            continue
+        scanned = [table for table in seq_scans(plan[0]["Plan"]) if table not in ALLOWED_SEQ_SCANS and sizes.get(table, 0) > threshold]
+        if scanned:
+            failures += 1
+            print(f"\nSeq Scan on {', '.join(scanned)} (cost {plan[0]['Plan']['Total Cost']}):\n{' '.join(statement.split())}")
+    print(f"\n{len(plans)} statements explained, {failures} seq-scan tables over {threshold} rows")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
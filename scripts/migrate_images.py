@@ -0,0 +1,60 @@
+"""Move team/task pictures from images/<name>/ into the configured image storage.
+
+Each file is stored under its SHA-256 content key and the row's pictureName is rewritten to
+that key. Rows whose file is missing are reported and left alone, the old files are kept so
+the move can be rolled back. Safe to re-run.
+
+Usage: python scripts/migrate_images.py [--dry-run]
+"""
+import asyncio
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import select, update  # noqa: E402
+
+from app import models  # noqa: E402
+from app.database import SessionLocal, engine  # noqa: E402
+from app.storage import content_key, is_content_key, storage  # noqa: E402
+from app.uploads import IMAGE_EXTENSIONS, legacy_image_path, sniff_image_type  # noqa: E402
+
+
+async def migrate(model, dry_run: bool):
+    moved = missing = 0
+    async with SessionLocal() as db:
+        rows = (await db.execute(select(model.id, model.name, model.pictureName).where(model.pictureName.is_not(None)))).all()
+        for id, name, picture_name in rows:
+            if is_content_key(picture_name):
+                continue
+            path = legacy_image_path(name, picture_name)
+            if not os.path.exists(path):
+                print(f"{model.__tablename__} {id}: missing {path}")
+                missing += 1
+                continue
+            with open(path, "rb") as file:
+                data = file.read()
+            extension = IMAGE_EXTENSIONS.get(sniff_image_type(data)) or os.path.splitext(picture_name)[1].lower()
+            key = content_key(hashlib.sha256(data).hexdigest(), extension)
+            print(f"{model.__tablename__} {id}: {path} -> {key}")
+            if not dry_run:
+                await storage.put_bytes(key, data)
+                await db.execute(update(model).where(model.id == id).values(pictureName=key))
+                # Commit per row so an interrupted run keeps its progress
+                await db.commit()
+            moved += 1
+    return moved, missing
+
+
+async def main(dry_run: bool):
+    try:
+        for model in (models.Teams, models.Tasks):
+            moved, missing = await migrate(model, dry_run)
+            print(f"{model.__tablename__}: {moved} moved, {missing} missing" + (" (dry run)" if dry_run else ""))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main("--dry-run" in sys.argv[1:]))
@@ -0,0 +1,146 @@
+"""Race hundreds of parallel joins against a running API and check no team ends up over capacity.
+
+Three scenarios, each fired from a thread pool so the requests genuinely overlap:
+
+  direct  joins aimed at a few small teams through POST /teams/{id}/join
+  queue   members queued through POST /matchmaking/queue, placed by the background workers
+  tasks   one team trying to join many tasks at once through POST /tasks/{id}/join
+
+Afterwards every team is read back: none may hold more than maxMembers, needsMembers must
+match its member count, no queue entry may be placed twice, and exactly as many joins may
+succeed as there were free places. Exits with status 1 on any violation. Run it against a
+scratch database with several uvicorn workers to exercise the row locks across processes.
+
+Usage: python scripts/stress_matchmaking.py [base_url] [joins]
+"""
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+TEAMS = 10
+TEAM_SIZE = 4
+TASKS = 50
+THREADS = 64
+QUEUE_TIMEOUT = 60
+
+
+def call(base: str, method: str, path: str, body=None):
+    request = urllib.request.Request(base + path, method=method, data=json.dumps(body).encode() if body is not None else None,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read() or b"null")
+
+
+def parallel(calls):
+    with ThreadPoolExecutor(THREADS) as pool:
+        return list(pool.map(lambda args: call(*args), calls))
+
+
+def create_teams(base: str, prefix: str, location: str, count: int) -> list:
+    teams = []
+    for i in range(count):
+        status, team = call(base, "POST", "/teams/", {
+            "name": f"{prefix}{location} team {i}", "gitRepo": "git", "location": location, "preferredWorkTime": "evenings",
+            "classificationLevel": "U", "preferredSkillsets": "python", "maxMembers": TEAM_SIZE,
+            "captain": {"name": f"{prefix}captain {i}", "discordName": "captain#1", "skillsets": "python"}})
+        if status != 201:
+            sys.exit(f"Creating a team failed with {status}: {team}")
+        teams.append(team)
+    return teams
+
+
+def check_teams(base: str, teams: list) -> tuple:
+    # Violations found and how many members joined beyond the captains
+    problems, joined = [], 0
+    for team in teams:
+        _, current = call(base, "GET", f"/teams/{team['id']}")
+        members = len(current["members"])
+        joined += members - 1
+        if members > current["maxMembers"]:
+            problems.append(f"team {team['id']} has {members} members, capacity {current['maxMembers']}")
+        if current["needsMembers"] != (members < current["maxMembers"]):
+            problems.append(f"team {team['id']} has {members}/{current['maxMembers']} members but needsMembers={current['needsMembers']}")
+    return problems, joined
+
+
+def direct(base: str, prefix: str, joins: int) -> list:
+    teams = create_teams(base, prefix, "direct", TEAMS)
+    member = {"name": f"{prefix}joiner", "discordName": "joiner#1", "skillsets": "go"}
+    started = time.perf_counter()
+    results = parallel([(base, "POST", f"/teams/{teams[i % TEAMS]['id']}/join", member) for i in range(joins)])
+    elapsed = time.perf_counter() - started
+    succeeded = sum(1 for status, _ in results if status == 201)
+    refused = sum(1 for status, _ in results if status == 409)
+    problems, joined = check_teams(base, teams)
+    expected = min(joins, TEAMS * (TEAM_SIZE - 1))
+    if succeeded != expected or joined != expected:
+        problems.append(f"{succeeded} joins succeeded and {joined} members joined, expected {expected}")
+    if succeeded + refused != joins:
+        problems.append(f"{joins - succeeded - refused} joins failed with something other than 409")
+    print(f"direct: {joins} joins in {elapsed:.2f}s, {succeeded} placed, {refused} refused as full")
+    return problems
+
+
+def queue(base: str, prefix: str, joins: int) -> list:
+    location = f"{prefix}queue"
+    teams = create_teams(base, prefix, location, TEAMS)
+    member = {"name": f"{prefix}queued", "discordName": "queued#1", "skillsets": "python", "location": location.upper()}
+    started = time.perf_counter()
+    entries = [entry for status, entry in parallel([(base, "POST", "/matchmaking/queue", member)] * joins) if status == 201]
+    queued = time.perf_counter() - started
+    capacity = min(len(entries), TEAMS * (TEAM_SIZE - 1))
+
+    deadline = time.monotonic() + QUEUE_TIMEOUT
+    while True:
+        current = [entry for _, entry in parallel([(base, "GET", f"/matchmaking/queue/{entry['id']}", None) for entry in entries])]
+        assigned = [entry for entry in current if entry["status"] == "assigned"]
+        if len(assigned) >= capacity or time.monotonic() > deadline:
+            break
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - started
+
+    problems, joined = check_teams(base, teams)
+    if len(entries) != joins:
+        problems.append(f"{joins - len(entries)} requests could not be queued")
+    if len(assigned) != capacity or joined != capacity:
+        problems.append(f"{len(assigned)} entries assigned and {joined} members joined, expected {capacity}")
+    memberIds = [entry["member_id"] for entry in assigned]
+    if len(set(memberIds)) != len(memberIds):
+        problems.append("a member was assigned to more than one queue entry")
+    print(f"queue: {len(entries)} queued in {queued:.2f}s, {len(assigned)} assigned after {elapsed:.2f}s")
+    return problems
+
+
+def tasks(base: str, prefix: str) -> list:
+    team = create_teams(base, prefix, "tasks", 1)[0]
+    ids = []
+    for i in range(TASKS):
+        _, task = call(base, "POST", "/tasks/", {
+            "name": f"{prefix}task {i}", "description": "stress", "classificationLevel": "U", "preferredSkillsets": "python",
+            "desiredDeliverable": "report", "organization": "org", "location": "tasks", "pocName": "poc", "pocDiscordName": "poc#1"})
+        ids.append(task["id"])
+    join = {"captainCode": team["captainCode"], "team_name": team["name"]}
+    results = parallel([(base, "POST", f"/tasks/{id}/join", join) for id in ids])
+    succeeded = sum(1 for status, _ in results if status == 201)
+    print(f"tasks: one team raced to join {TASKS} tasks, {succeeded} succeeded")
+    return [] if succeeded == 1 else [f"the team joined {succeeded} tasks"]
+
+
+def main():
+    base = (sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:8000").rstrip("/")
+    joins = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    prefix = f"stress {int(time.time())} "
+    problems = direct(base, prefix, joins) + queue(base, prefix, joins) + tasks(base, prefix)
+    for problem in problems:
+        print(f"FAIL {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()